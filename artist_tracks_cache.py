@@ -0,0 +1,132 @@
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from settings import ARTIST_CACHE_MAX_ENTRIES, ARTIST_CACHE_TTL_SECONDS
+from typing import Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from s3_manager import S3Manager
+
+TRACK_URI_PREFIX = "spotify:track:"
+
+class ArtistTracksCache:
+    """
+    In-memory cache of artists' top tracks shared by every user of a run.
+
+    An artist's top tracks are the same for every user in a market, so they are
+    cached by (artist_id, market). Entries expire after a TTL and the least
+    recently used entries are evicted once the cache is full.
+
+    The cache lives at module level in the Lambda entry point, so a warm
+    container keeps it between invocations. Between cold starts it is persisted
+    to a single compact JSON object in S3.
+
+    Attributes:
+        ttl_seconds (int): Lifetime of an entry in seconds.
+        max_entries (int): Maximum number of entries kept in memory.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that had to call Spotify.
+        loaded (bool): Whether the persisted cache has been loaded from S3.
+    """
+    def __init__(self, ttl_seconds: int = ARTIST_CACHE_TTL_SECONDS, max_entries: int = ARTIST_CACHE_MAX_ENTRIES, clock: Callable[[], float] = time.time):
+        """
+        Parameters:
+            ttl_seconds (int): Lifetime of an entry in seconds.
+            max_entries (int): Maximum number of entries kept in memory.
+            clock (Callable): Returns the current UNIX time. Replaceable in tests.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.loaded = False
+        self._entries: OrderedDict[Tuple[str, str], Tuple[float, List[str]]] = OrderedDict()
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def get(self, artist_id: str, market: str) -> Optional[List[str]]:
+        """
+        Return the cached top track URIs of an artist, or None on a miss.
+        """
+        key = (artist_id, market)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry[0]):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def put(self, artist_id: str, market: str, track_uris: List[str]):
+        """
+        Store the top track URIs of an artist and evict the oldest entries if needed.
+        """
+        with self._lock:
+            self._entries[(artist_id, market)] = (self.clock(), list(track_uris))
+            self._entries.move_to_end((artist_id, market))
+            self._evict()
+            self._dirty = True
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return hit/miss counters and the current number of entries.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def load(self, s3_manager: S3Manager, bucket: str, key: str):
+        """
+        Merge the cache persisted in S3 into memory, skipping expired entries.
+        Entries already in memory are newer and win.
+
+        The object has the form
+        {"entries": [[artist_id, market, fetched_at, [track_id, ...]], ...]}
+        in least to most recently used order, with the "spotify:track:" prefix
+        stripped to keep it small. Other URIs are stored as they are.
+
+        The loaded entries are older than those in memory, so they are put in
+        front of them; walking the list backwards keeps their own order.
+        """
+        data = s3_manager.load_info(bucket, key) or {}
+        with self._lock:
+            for artist_id, market, fetched_at, track_ids in reversed(data.get("entries", [])):
+                cache_key = (artist_id, market)
+                if cache_key in self._entries or self._is_expired(fetched_at):
+                    continue
+                self._entries[cache_key] = (fetched_at, [self._expand_uri(track_id) for track_id in track_ids])
+                self._entries.move_to_end(cache_key, last=False)
+            self._evict()
+            self.loaded = True
+
+    def save(self, s3_manager: S3Manager, bucket: str, key: str):
+        """
+        Persist the unexpired entries to S3. Nothing is written when no entry changed.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = [
+                [artist_id, market, fetched_at, [self._compact_uri(uri) for uri in track_uris]]
+                for (artist_id, market), (fetched_at, track_uris) in self._entries.items()
+                if not self._is_expired(fetched_at)
+            ]
+            self._dirty = False
+        s3_manager.save_info(bucket, key, {"entries": entries}, indent=None)
+
+    def _compact_uri(self, uri: str) -> str:
+        return uri[len(TRACK_URI_PREFIX):] if uri.startswith(TRACK_URI_PREFIX) else uri
+
+    def _expand_uri(self, track_id: str) -> str:
+        # Track IDs never contain ':', so anything with one was stored as a full URI.
+        return track_id if ":" in track_id else TRACK_URI_PREFIX + track_id
+
+    def _is_expired(self, fetched_at: float) -> bool:
+        return self.clock() - fetched_at >= self.ttl_seconds
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
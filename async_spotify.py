@@ -0,0 +1,264 @@
+from __future__ import annotations
+import asyncio
+import logging
+import threading
+from settings import ASYNC_HTTP_CONNECTION_LIMIT, ASYNC_HTTP_TIMEOUT_SECONDS, SPOTIFY_API_BASE_URL, SPOTIFY_MAX_RETRIES, SPOTIFY_MAX_RETRY_AFTER_SECONDS
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    import aiohttp
+
+# Optional asyncio implementation of the Spotify Web API calls this project uses.
+# It needs aiohttp, which is not in requirements.txt:
+#
+#   python -m pip install aiohttp
+#
+# AsyncSpotify returns the same JSON as the spotipy methods of the same name and
+# raises spotipy's SpotifyException for error responses, so callers can use
+# either client. BlockingSpotify runs it on one shared event loop for the
+# synchronous playlist generators (SPOTIFY_CLIENT = 'async'); its gather()
+# sends a batch of independent calls (the top tracks and top artists of every
+# term, the top tracks of many artists) as coroutines on that loop instead of
+# one thread per call.
+#
+# The generators have no asyncio entry point of their own (no async main per
+# generator). Users are planned by UserPlanner on worker threads, which also
+# bound the users per owner and keep one user's failure to itself; the
+# generators only run inside that plan, and most of a user's steps (paginated
+# playlist reads, writes, S3 state) are blocking. So the generators stay
+# synchronous and hand their batches to gather: the requests of all terms and
+# all users still run concurrently on the one loop and connection pool, and
+# the same generator code runs unchanged on Spotipy.
+
+logger = logging.getLogger(__name__)
+
+def _get_id(kind: str, value: str) -> str:
+    """
+    Return the Spotify ID of an ID, a URI (spotify:kind:id) or an open.spotify.com URL.
+    """
+    if value.startswith("spotify:"):
+        return value.split(":")[-1]
+    if value.startswith("http"):
+        return value.rstrip("/").split("/")[-1].split("?")[0]
+    return value
+
+def _get_uri(kind: str, value: str) -> str:
+    """
+    Return the Spotify URI of an ID, a URI or a URL.
+    """
+    if value.startswith("spotify:"):
+        return value
+    return f"spotify:{kind}:{_get_id(kind, value)}"
+
+class AsyncSpotify:
+    """
+    asyncio Spotify Web API client for one access token.
+
+    All clients share the aiohttp session passed in, so their requests use
+    one connection pool. base_url can point to a local fake server in tests.
+
+    A 429 response is retried after its Retry-After up to max_retries times;
+    pass max_retries=0 when a RequestScheduler handles rate limits.
+    """
+    def __init__(self, access_token: str, session: aiohttp.ClientSession, base_url: str = SPOTIFY_API_BASE_URL, max_retries: int = SPOTIFY_MAX_RETRIES, max_retry_after: float = SPOTIFY_MAX_RETRY_AFTER_SECONDS):
+        """
+        Parameters:
+            access_token (str): The user's OAuth access token.
+            session (aiohttp.ClientSession): Shared HTTP session.
+            base_url (str): Base URL of the Web API, ending with a slash.
+            max_retries (int): Retries of a request answered with 429.
+            max_retry_after (float): Longest Retry-After that is waited for.
+        """
+        self.access_token = access_token
+        self.session = session
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+
+    async def _request(self, method: str, url: str, params: Optional[Dict[str, Any]] = None, payload: Optional[Dict[str, Any]] = None) -> Any:
+        if not url.startswith("http"):
+            url = self.base_url + url
+        params = {key: value for key, value in (params or {}).items() if value is not None}
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+
+        attempt = 0
+        while True:
+            async with self.session.request(method, url, params=params, json=payload, headers=headers) as response:
+                if response.status == 429 and attempt < self.max_retries:
+                    retry_after = float(response.headers.get("Retry-After", 1))
+                    if retry_after <= self.max_retry_after:
+                        attempt += 1
+                        logger.warning("Rate limited by Spotify, retrying in %.1f s.", retry_after)
+                        await asyncio.sleep(retry_after)
+                        continue
+                if response.status >= 400:
+                    await self._raise_error(method, url, response)
+                if response.status == 204 or response.content_length == 0:
+                    return None
+                return await response.json(content_type=None)
+
+    async def _raise_error(self, method: str, url: str, response: aiohttp.ClientResponse):
+        from spotipy.exceptions import SpotifyException
+        try:
+            error = (await response.json(content_type=None) or {}).get("error", {})
+            message = error.get("message", "error") if isinstance(error, dict) else str(error)
+            reason = error.get("reason") if isinstance(error, dict) else None
+        except ValueError:
+            message, reason = response.reason or "error", None
+        raise SpotifyException(response.status, -1, f"{url}:\n {message}", reason=reason, headers=dict(response.headers))
+
+    async def me(self) -> Dict[str, Any]:
+        return await self._request("GET", "me")
+
+    async def current_user_top_tracks(self, limit: int = 20, offset: int = 0, time_range: str = "medium_term") -> Dict[str, Any]:
+        return await self._request("GET", "me/top/tracks", {"limit": limit, "offset": offset, "time_range": time_range})
+
+    async def current_user_top_artists(self, limit: int = 20, offset: int = 0, time_range: str = "medium_term") -> Dict[str, Any]:
+        return await self._request("GET", "me/top/artists", {"limit": limit, "offset": offset, "time_range": time_range})
+
+    async def artist_top_tracks(self, artist_id: str, country: str = "US") -> Dict[str, Any]:
+        return await self._request("GET", f"artists/{_get_id('artist', artist_id)}/top-tracks", {"market": country})
+
+    async def current_user_playlists(self, limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        return await self._request("GET", "me/playlists", {"limit": limit, "offset": offset})
+
+    async def playlist(self, playlist_id: str, fields: Optional[str] = None, market: Optional[str] = None) -> Dict[str, Any]:
+        return await self._request("GET", f"playlists/{_get_id('playlist', playlist_id)}", {"fields": fields, "market": market})
+
+    async def playlist_items(self, playlist_id: str, fields: Optional[str] = None, limit: int = 100, offset: int = 0, market: Optional[str] = None) -> Dict[str, Any]:
+        return await self._request("GET", f"playlists/{_get_id('playlist', playlist_id)}/tracks", {"fields": fields, "limit": limit, "offset": offset, "market": market})
+
+    async def next(self, result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if result.get("next"):
+            return await self._request("GET", result["next"])
+        return None
+
+    async def user_playlist_create(self, user: str, name: str, public: bool = True, collaborative: bool = False, description: str = "") -> Dict[str, Any]:
+        payload = {"name": name, "public": public, "collaborative": collaborative, "description": description}
+        return await self._request("POST", f"users/{user}/playlists", payload=payload)
+
+    async def playlist_change_details(self, playlist_id: str, name: Optional[str] = None, public: Optional[bool] = None, collaborative: Optional[bool] = None, description: Optional[str] = None) -> Any:
+        payload = {"name": name, "public": public, "collaborative": collaborative, "description": description}
+        payload = {key: value for key, value in payload.items() if value is not None}
+        return await self._request("PUT", f"playlists/{_get_id('playlist', playlist_id)}", payload=payload)
+
+    async def playlist_add_items(self, playlist_id: str, items: List[str], position: Optional[int] = None) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {"uris": [_get_uri("track", item) for item in items]}
+        if position is not None:
+            payload["position"] = position
+        return await self._request("POST", f"playlists/{_get_id('playlist', playlist_id)}/tracks", payload=payload)
+
+    async def playlist_replace_items(self, playlist_id: str, items: List[str]) -> Dict[str, Any]:
+        payload = {"uris": [_get_uri("track", item) for item in items]}
+        return await self._request("PUT", f"playlists/{_get_id('playlist', playlist_id)}/tracks", payload=payload)
+
+    async def playlist_reorder_items(self, playlist_id: str, range_start: int, insert_before: int, range_length: int = 1, snapshot_id: Optional[str] = None) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {"range_start": range_start, "insert_before": insert_before, "range_length": range_length}
+        if snapshot_id:
+            payload["snapshot_id"] = snapshot_id
+        return await self._request("PUT", f"playlists/{_get_id('playlist', playlist_id)}/tracks", payload=payload)
+
+    async def playlist_remove_all_occurrences_of_items(self, playlist_id: str, items: List[str], snapshot_id: Optional[str] = None) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {"tracks": [{"uri": _get_uri("track", item)} for item in items]}
+        if snapshot_id:
+            payload["snapshot_id"] = snapshot_id
+        return await self._request("DELETE", f"playlists/{_get_id('playlist', playlist_id)}/tracks", payload=payload)
+
+
+class EventLoopThread:
+    """
+    Runs an asyncio event loop and one pooled aiohttp session in a daemon thread.
+
+    Threads submit coroutines with run() and block until they finish, so the
+    HTTP requests of all worker threads are multiplexed on the same loop and
+    connection pool.
+    """
+    def __init__(self, connection_limit: int = ASYNC_HTTP_CONNECTION_LIMIT, timeout: float = ASYNC_HTTP_TIMEOUT_SECONDS):
+        """
+        Parameters:
+            connection_limit (int): Maximum number of open connections of the session.
+            timeout (float): Timeout of one request in seconds.
+        """
+        import aiohttp
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="spotify-event-loop", daemon=True)
+        self._thread.start()
+
+        async def make_session() -> aiohttp.ClientSession:
+            return aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=connection_limit),
+                timeout=aiohttp.ClientTimeout(total=timeout)
+            )
+        self.session = self.run(make_session())
+
+    def run(self, coroutine: Awaitable[Any]) -> Any:
+        """
+        Run a coroutine on the loop and return its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        """
+        Close the session and stop the loop.
+        """
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+class BlockingSpotify:
+    """
+    Synchronous facade of an AsyncSpotify client, with the spotipy method names.
+    Every call runs on the EventLoopThread and blocks the calling thread until
+    the response arrives; gather() runs several calls concurrently.
+    """
+    def __init__(self, client: AsyncSpotify, loop_thread: EventLoopThread):
+        """
+        Parameters:
+            client (AsyncSpotify): The client whose methods are called.
+            loop_thread (EventLoopThread): The loop the client's session belongs to.
+        """
+        self.client = client
+        self.loop_thread = loop_thread
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self.client, name)
+
+        def blocking(*args: Any, **kwargs: Any) -> Any:
+            return self.loop_thread.run(method(*args, **kwargs))
+        return blocking
+
+    def gather(self, calls: Sequence[Tuple[str, Sequence[Any], Dict[str, Any]]], max_workers: Optional[int] = None, wrap: Optional[Callable[..., Awaitable[Any]]] = None) -> List[Any]:
+        """
+        Run several client methods as coroutines on the loop and wait for all of them.
+
+        Parameters:
+            calls (list): (method name, args, kwargs) of every call.
+            max_workers (int | None): Most calls in flight at once. No limit if None.
+            wrap (Callable | None): Awaited as wrap(name, method, *args, **kwargs)
+                                    instead of method(*args, **kwargs), e.g. to
+                                    schedule the call.
+
+        Returns:
+            list: The result of every call, in the order of calls.
+
+        Raises:
+            Exception: The error of the first failed call, after all calls finished.
+        """
+        async def run_all() -> List[Any]:
+            semaphore = asyncio.Semaphore(max_workers) if max_workers else None
+
+            async def run_one(name: str, args: Sequence[Any], kwargs: Dict[str, Any]) -> Any:
+                method = getattr(self.client, name)
+                call = wrap(name, method, *args, **kwargs) if wrap else method(*args, **kwargs)
+                if semaphore is None:
+                    return await call
+                async with semaphore:
+                    return await call
+            return await asyncio.gather(*(run_one(name, args, kwargs) for name, args, kwargs in calls), return_exceptions=True)
+
+        results = self.loop_thread.run(run_all())
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
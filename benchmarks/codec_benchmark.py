@@ -0,0 +1,99 @@
+import argparse
+import hashlib
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+# Compares the size and the encode/decode time of the S3 codecs on synthetic
+# documents of the size of a large deployment (10,000 users by default).
+#
+#   python benchmarks/codec_benchmark.py
+#   python benchmarks/codec_benchmark.py --users 50000 --runs 3
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from s3_codecs import CODECS, decode_body, get_codec
+
+TERMS = ["short_term", "medium_term", "long_term"]
+
+
+def make_playlist_info(user_count: int) -> Dict[str, Any]:
+    """
+    Build a playlist info document (PLAYLIST_INFO_FILE_KEY) with user_count users.
+    """
+    data = {}
+    for index in range(user_count):
+        user_id = f"user{index:06d}"
+        uris = {term: f"spotify:playlist:{hashlib.sha1(f'{user_id}{term}'.encode()).hexdigest()[:22]}" for term in TERMS}
+        artist_uris = {term: f"spotify:playlist:{hashlib.sha1(f'{user_id}{term}a'.encode()).hexdigest()[:22]}" for term in TERMS}
+        data[user_id] = {
+            "profile": {"id": user_id, "display_name": f"User {index}"},
+            "top_tracks_uris": uris,
+            "artist_top_tracks_uris": artist_uris,
+            "playlist_states": {
+                uri: {"snapshot_id": hashlib.sha1(uri.encode()).hexdigest(), "tracks_hash": hashlib.sha1(uri[::-1].encode()).hexdigest()}
+                for uri in list(uris.values()) + list(artist_uris.values())
+            }
+        }
+    return data
+
+
+def make_users(user_count: int, owner_count: int = 10) -> Dict[str, Any]:
+    """
+    Build a users document (USERS_FILE_KEY) with user_count users over owner_count owners.
+    """
+    owners = {f"owner{owner}": {"users": []} for owner in range(owner_count)}
+    for index in range(user_count):
+        owners[f"owner{index % owner_count}"]["users"].append({"id": f"user{index:06d}"})
+    return {"owners": owners}
+
+
+def best_ms(function: Callable[[], Any], runs: int) -> float:
+    """
+    Return the fastest of several runs in milliseconds.
+    """
+    best = float("inf")
+    for _ in range(max(1, runs)):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def benchmark(name: str, data: Dict[str, Any], runs: int) -> List[str]:
+    """
+    Measure every available codec on one document.
+    """
+    lines = [f"{name}:", f"  {'codec':<8} {'bytes':>12} {'encode ms':>10} {'decode ms':>10}"]
+    for codec_name in CODECS:
+        codec = get_codec(codec_name)
+        try:
+            body = codec.encode(data)
+        except ImportError as e:
+            lines.append(f"  {codec_name:<8} skipped: {e}")
+            continue
+        encode_ms = best_ms(lambda: codec.encode(data), runs)
+        decode_ms = best_ms(lambda: decode_body(body, codec.content_type, codec.content_encoding), runs)
+        lines.append(f"  {codec_name:<8} {len(body):>12,} {encode_ms:>10.1f} {decode_ms:>10.1f}")
+    return lines
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare the S3 codecs by size and speed.")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=5, help="Measurements per codec; the fastest is kept.")
+    args = parser.parse_args()
+
+    documents = {
+        "playlist info": make_playlist_info(args.users),
+        "users": make_users(args.users),
+    }
+    for name, data in documents.items():
+        print("\n".join(benchmark(f"{name} ({args.users} users)", data, args.runs)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
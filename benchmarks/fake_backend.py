@@ -0,0 +1,342 @@
+import hashlib
+import io
+import itertools
+import random
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+
+# In-process stand-ins for the Spotify Web API and S3, used by
+# benchmarks/run_benchmark.py to run the workflow without network access.
+#
+# FakeSpotifyAPI keeps the playlists of every user in memory and answers the
+# spotipy methods the project uses, with a configurable latency per request,
+# pagination and injected 429 responses. FakeS3Client answers the boto3 calls
+# of S3Manager, including conditional GETs (IfNoneMatch) and conditional PUTs
+# (IfMatch, IfNoneMatch='*'). Both count the requests they receive.
+
+class NoSuchKey(Exception):
+    pass
+
+
+class _S3Exceptions:
+    NoSuchKey = NoSuchKey
+
+
+class FakeS3Client:
+    """
+    Thread-safe in-memory replacement of the boto3 S3 client.
+    """
+    exceptions = _S3Exceptions
+
+    def __init__(self, latency: float = 0.0):
+        """
+        Parameters:
+            latency (float): Seconds every request takes.
+        """
+        self.latency = latency
+        self._objects: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.gets = 0
+            self.puts = 0
+            self.not_modified = 0
+            self.conflicts = 0
+            self.bytes_read = 0
+            self.bytes_written = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "gets": self.gets,
+                "puts": self.puts,
+                "not_modified": self.not_modified,
+                "conflicts": self.conflicts,
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+            }
+
+    def get_object(self, Bucket: str, Key: str, IfNoneMatch: Optional[str] = None, **kwargs: Any) -> Dict[str, Any]:
+        from botocore.exceptions import ClientError
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.gets += 1
+            obj = self._objects.get(Key)
+            if obj is None:
+                raise NoSuchKey(Key)
+            if IfNoneMatch is not None and IfNoneMatch == obj["ETag"]:
+                self.not_modified += 1
+                raise ClientError({"Error": {"Code": "304", "Message": "Not Modified"}, "ResponseMetadata": {"HTTPStatusCode": 304}}, "GetObject")
+            self.bytes_read += len(obj["Body"])
+            response = {key: value for key, value in obj.items() if key != "Body"}
+        response["Body"] = io.BytesIO(obj["Body"])
+        return response
+
+    def put_object(self, Bucket: str, Key: str, Body: Any, IfMatch: Optional[str] = None, IfNoneMatch: Optional[str] = None, **kwargs: Any) -> Dict[str, Any]:
+        from botocore.exceptions import ClientError
+        if self.latency:
+            time.sleep(self.latency)
+        body = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        obj = {"Body": body, "ETag": etag, "ContentLength": len(body)}
+        for name in ("ContentType", "ContentEncoding"):
+            if name in kwargs:
+                obj[name] = kwargs[name]
+        with self._lock:
+            self.puts += 1
+            current = self._objects.get(Key)
+            if (IfMatch is not None and (current is None or current["ETag"] != IfMatch)) or (IfNoneMatch == "*" and current is not None):
+                self.conflicts += 1
+                raise ClientError({"Error": {"Code": "PreconditionFailed", "Message": "At least one of the pre-conditions you specified did not hold"}, "ResponseMetadata": {"HTTPStatusCode": 412}}, "PutObject")
+            self.bytes_written += len(body)
+            self._objects[Key] = obj
+        return {"ETag": etag}
+
+    def total_bytes(self) -> int:
+        """
+        Return the size of all stored objects.
+        """
+        with self._lock:
+            return sum(len(obj["Body"]) for obj in self._objects.values())
+
+
+class FakeSpotifyAPI:
+    """
+    In-memory Spotify Web API shared by the clients of all users.
+
+    Top tracks and top artists are derived from the user ID, so every run of
+    a population sees the same data. advance() moves to the next "day": the
+    top lists of the `drift` fraction of users change, the others stay.
+    Artists are drawn from a catalog of `artist_count` artists, so users
+    share artists as they do on Spotify.
+    """
+    def __init__(self, latency: float = 0.0, throttle_rate: float = 0.0, retry_after: float = 0.0, drift: float = 0.1, artist_count: int = 2000, track_count: int = 200000, seed: int = 0):
+        """
+        Parameters:
+            latency (float): Seconds every request takes.
+            throttle_rate (float): Fraction of requests answered with 429 (0 to 1).
+            retry_after (float): Retry-After of the injected 429 responses in seconds.
+            drift (float): Fraction of users whose top lists change on advance().
+            artist_count (int): Number of artists in the catalog.
+            track_count (int): Number of tracks in the catalog.
+            seed (int): Seed of the injected 429 responses.
+        """
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.drift = drift
+        self.artist_count = artist_count
+        self.track_count = track_count
+        self.epoch = 0
+        self._random = random.Random(seed)
+        self._playlists: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._playlist_ids = itertools.count()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls: Dict[str, int] = {}
+            self.throttled = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": sum(self.calls.values()),
+                "throttled": self.throttled,
+                "endpoints": dict(sorted(self.calls.items())),
+            }
+
+    def advance(self):
+        """
+        Move to the next day, changing the top lists of the drifting users.
+        """
+        self.epoch += 1
+
+    def client(self, user_id: str) -> "FakeSpotify":
+        return FakeSpotify(self, user_id)
+
+    def request(self, endpoint: str, handler: Callable[[], Any]) -> Any:
+        """
+        Count a request, wait for the latency, maybe answer 429, then run it.
+        """
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            throttle = self.throttle_rate > 0 and self._random.random() < self.throttle_rate
+            if throttle:
+                self.throttled += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttle:
+            from spotipy.exceptions import SpotifyException
+            raise SpotifyException(429, -1, f"{endpoint}: API rate limit exceeded", headers={"Retry-After": str(self.retry_after)})
+        with self._lock:
+            return handler()
+
+    def _random_for(self, user_id: str, term: str, kind: str) -> random.Random:
+        changing = zlib.crc32(user_id.encode()) % 1000 < self.drift * 1000
+        epoch = self.epoch if changing else 0
+        return random.Random(zlib.crc32(f"{user_id}:{term}:{kind}:{epoch}".encode()))
+
+    def top_tracks(self, user_id: str, term: str, limit: int) -> List[str]:
+        rng = self._random_for(user_id, term, "tracks")
+        return [f"spotify:track:t{number:07d}" for number in rng.sample(range(self.track_count), limit)]
+
+    def top_artists(self, user_id: str, term: str, limit: int) -> List[str]:
+        rng = self._random_for(user_id, term, "artists")
+        # Popular artists are far more common, as in real listening data.
+        return list(dict.fromkeys(f"a{int(self.artist_count * rng.random() ** 3):06d}" for _ in range(limit * 2)))[:limit]
+
+    def playlists(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        return self._playlists.setdefault(user_id, {})
+
+    def new_playlist_id(self) -> str:
+        return f"p{next(self._playlist_ids):021d}"
+
+
+def _page_url(path: str, **params: Any) -> str:
+    return f"https://api.spotify.test/v1/{path}?{urlencode(params)}"
+
+
+class FakeSpotify:
+    """
+    spotipy.Spotify look-alike of one user on a FakeSpotifyAPI.
+    """
+    def __init__(self, api: FakeSpotifyAPI, user_id: str):
+        self.api = api
+        self.user_id = user_id
+
+    def _playlist(self, playlist_id: str) -> Dict[str, Any]:
+        playlist_id = playlist_id.split(":")[-1]
+        return self.api.playlists(self.user_id)[playlist_id]
+
+    def _snapshot(self, playlist: Dict[str, Any]) -> Dict[str, str]:
+        playlist["version"] += 1
+        playlist["snapshot_id"] = f"{playlist['id']}-{playlist['version']}"
+        return {"snapshot_id": playlist["snapshot_id"]}
+
+    def _summary(self, playlist: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: playlist[key] for key in ("id", "uri", "name", "description", "snapshot_id")}
+
+    def me(self) -> Dict[str, Any]:
+        return self.api.request("me", lambda: {"id": self.user_id, "display_name": self.user_id.upper()})
+
+    def current_user_top_tracks(self, limit: int = 20, offset: int = 0, time_range: str = "medium_term") -> Dict[str, Any]:
+        return self.api.request("current_user_top_tracks", lambda: {
+            "items": [{"uri": uri} for uri in self.api.top_tracks(self.user_id, time_range, limit)],
+            "next": None,
+        })
+
+    def current_user_top_artists(self, limit: int = 20, offset: int = 0, time_range: str = "medium_term") -> Dict[str, Any]:
+        return self.api.request("current_user_top_artists", lambda: {
+            "items": [{"id": artist_id} for artist_id in self.api.top_artists(self.user_id, time_range, limit)],
+            "next": None,
+        })
+
+    def artist_top_tracks(self, artist_id: str, country: str = "US") -> Dict[str, Any]:
+        return self.api.request("artist_top_tracks", lambda: {
+            "tracks": [{"uri": f"spotify:track:{artist_id}x{number}"} for number in range(10)]
+        })
+
+    def current_user_playlists(self, limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        def handler() -> Dict[str, Any]:
+            playlists = list(self.api.playlists(self.user_id).values())
+            page = playlists[offset:offset + min(limit, 50)]
+            end = offset + len(page)
+            return {
+                "items": [self._summary(playlist) for playlist in page],
+                "total": len(playlists),
+                "next": _page_url("me/playlists", offset=end, limit=limit) if end < len(playlists) else None,
+            }
+        return self.api.request("current_user_playlists", handler)
+
+    def playlist(self, playlist_id: str, fields: Optional[str] = None, **kwargs: Any) -> Dict[str, Any]:
+        return self.api.request("playlist", lambda: {"snapshot_id": self._playlist(playlist_id)["snapshot_id"]})
+
+    def playlist_items(self, playlist_id: str, fields: Optional[str] = None, limit: int = 100, offset: int = 0, **kwargs: Any) -> Dict[str, Any]:
+        def handler() -> Dict[str, Any]:
+            playlist = self._playlist(playlist_id)
+            page = playlist["tracks"][offset:offset + min(limit, 100)]
+            end = offset + len(page)
+            return {
+                "items": [{"track": {"uri": uri}} for uri in page],
+                "next": _page_url(f"playlists/{playlist['id']}/tracks", offset=end, limit=limit) if end < len(playlist["tracks"]) else None,
+            }
+        return self.api.request("playlist_items", handler)
+
+    def next(self, result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not result.get("next"):
+            return None
+        url = urlparse(result["next"])
+        params = {key: int(values[0]) for key, values in parse_qs(url.query).items()}
+        path = url.path.split("/v1/", 1)[1]
+        if path == "me/playlists":
+            return self.current_user_playlists(**params)
+        return self.playlist_items(path.split("/")[1], **params)
+
+    def user_playlist_create(self, user: str, name: str, public: bool = True, collaborative: bool = False, description: str = "") -> Dict[str, Any]:
+        def handler() -> Dict[str, Any]:
+            playlist_id = self.api.new_playlist_id()
+            playlist = {
+                "id": playlist_id,
+                "uri": f"spotify:playlist:{playlist_id}",
+                "name": name,
+                "description": description,
+                "tracks": [],
+                "version": 0,
+            }
+            self._snapshot(playlist)
+            self.api.playlists(self.user_id)[playlist_id] = playlist
+            return self._summary(playlist)
+        return self.api.request("user_playlist_create", handler)
+
+    def playlist_change_details(self, playlist_id: str, name: Optional[str] = None, public: Optional[bool] = None, collaborative: Optional[bool] = None, description: Optional[str] = None):
+        def handler():
+            playlist = self._playlist(playlist_id)
+            if name is not None:
+                playlist["name"] = name
+            if description is not None:
+                playlist["description"] = description
+            self._snapshot(playlist)
+        return self.api.request("playlist_change_details", handler)
+
+    def playlist_add_items(self, playlist_id: str, items: List[str], position: Optional[int] = None) -> Dict[str, str]:
+        def handler() -> Dict[str, str]:
+            playlist = self._playlist(playlist_id)
+            if position is None:
+                playlist["tracks"].extend(items)
+            else:
+                playlist["tracks"][position:position] = items
+            return self._snapshot(playlist)
+        return self.api.request("playlist_add_items", handler)
+
+    def playlist_replace_items(self, playlist_id: str, items: List[str]) -> Dict[str, str]:
+        def handler() -> Dict[str, str]:
+            playlist = self._playlist(playlist_id)
+            playlist["tracks"] = list(items)
+            return self._snapshot(playlist)
+        return self.api.request("playlist_replace_items", handler)
+
+    def playlist_remove_all_occurrences_of_items(self, playlist_id: str, items: List[str], snapshot_id: Optional[str] = None) -> Dict[str, str]:
+        def handler() -> Dict[str, str]:
+            playlist = self._playlist(playlist_id)
+            removed = set(items)
+            playlist["tracks"] = [uri for uri in playlist["tracks"] if uri not in removed]
+            return self._snapshot(playlist)
+        return self.api.request("playlist_remove_all_occurrences_of_items", handler)
+
+    def playlist_reorder_items(self, playlist_id: str, range_start: int, insert_before: int, range_length: int = 1, snapshot_id: Optional[str] = None) -> Dict[str, str]:
+        def handler() -> Dict[str, str]:
+            tracks = self._playlist(playlist_id)["tracks"]
+            moved = tracks[range_start:range_start + range_length]
+            rest = tracks[:range_start] + tracks[range_start + range_length:]
+            position = insert_before if insert_before <= range_start else insert_before - range_length
+            self._playlist(playlist_id)["tracks"] = rest[:position] + moved + rest[position:]
+            return self._snapshot(self._playlist(playlist_id))
+        return self.api.request("playlist_reorder_items", handler)
@@ -0,0 +1,124 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Measures the import cost of the Lambda entry point with `python -X importtime`
+# and fails when it exceeds IMPORT_BUDGET_MS, so that a new eager import of a
+# heavy library shows up before it reaches the cold start.
+#
+#   python benchmarks/import_benchmark.py
+#   python benchmarks/import_benchmark.py --libraries
+#   python benchmarks/import_benchmark.py --statement "import spotify_main" --budget-ms 50
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from settings import IMPORT_BUDGET_MS
+
+'''
+Libraries imported lazily by the workflow. --libraries reports what each of
+them costs when it is finally imported, e.g. to compare S3_CLIENT_LIBRARY modes.
+'''
+LAZY_LIBRARIES: List[str] = ["boto3", "botocore.session", "requests", "spotipy"]
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def project_modules() -> List[str]:
+    """
+    Return the names of the top-level modules of this project.
+    """
+    return sorted(name[:-3] for name in os.listdir(ROOT_DIR) if name.endswith(".py"))
+
+
+def measure(statement: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Run a statement in a fresh interpreter with -X importtime.
+
+    Returns:
+        dict: (self_us, cumulative_us) keyed by module name, for every module
+              the statement imported.
+    """
+    env = dict(os.environ)
+    env.setdefault("BucketName", "import-benchmark")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT_DIR,
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"'{statement}' failed:\n{result.stderr}")
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure_best(statement: str, runs: int) -> Dict[str, Tuple[int, int]]:
+    """
+    Measure a statement several times and keep the fastest time of every module,
+    which is the least disturbed by other work on the machine.
+    """
+    best: Dict[str, Tuple[int, int]] = {}
+    for _ in range(max(1, runs)):
+        for name, (self_us, cumulative_us) in measure(statement).items():
+            if name not in best or cumulative_us < best[name][1]:
+                best[name] = (self_us, cumulative_us)
+    return best
+
+
+def report(title: str, modules: Dict[str, Tuple[int, int]], names: List[str], top: int):
+    """
+    Print the cumulative import time of the given modules and of the slowest ones overall.
+    """
+    print(title)
+    for name in names:
+        if name in modules:
+            print(f"  {modules[name][1] / 1000:8.1f} ms  {name}")
+    slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    if slowest:
+        print(f"  slowest {len(slowest)} module(s) by self time:")
+        for name, (self_us, cumulative_us) in slowest:
+            print(f"  {self_us / 1000:8.1f} ms  {name} (cumulative {cumulative_us / 1000:.1f} ms)")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Report and check the import cost of the Lambda entry point.")
+    parser.add_argument("--statement", default="import lambda_function", help="Statement whose imports are measured.")
+    parser.add_argument("--module", default="lambda_function", help="Module whose cumulative time is checked against the budget.")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5, help="Measurements per statement; the fastest is kept.")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest modules to list.")
+    parser.add_argument("--libraries", action="store_true", help="Also report the cost of the lazily imported libraries.")
+    args = parser.parse_args()
+
+    modules = measure_best(args.statement, args.runs)
+    report(f"{args.statement}:", modules, [name for name in project_modules() if name in modules], args.top)
+
+    if args.libraries:
+        for library in LAZY_LIBRARIES:
+            library_modules = measure_best(f"import {library}", args.runs)
+            print(f"{library}: {library_modules.get(library, (0, 0))[1] / 1000:.1f} ms")
+
+    if args.module not in modules:
+        print(f"{args.module} was not imported by '{args.statement}'.")
+        return 1
+    total_ms = modules[args.module][1] / 1000
+    if total_ms > args.budget_ms:
+        print(f"FAIL: {args.module} takes {total_ms:.1f} ms to import, budget {args.budget_ms:.1f} ms.")
+        return 1
+    print(f"OK: {args.module} takes {total_ms:.1f} ms to import, budget {args.budget_ms:.1f} ms.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
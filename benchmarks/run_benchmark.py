@@ -0,0 +1,283 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+# Runs the whole workflow offline, on a fake Spotify Web API and a local S3
+# stand-in (benchmarks/fake_backend.py), for synthetic populations of users,
+# and reports wall time, Spotify requests per user, S3 requests and bytes,
+# and peak memory of every run.
+#
+# Every population is run several times on the same components, like the
+# invocations of one warm Lambda container: the first run creates every
+# playlist, the following runs update them after advance() changed the top
+# lists of a fraction of the users.
+#
+#   python benchmarks/run_benchmark.py
+#   python benchmarks/run_benchmark.py --users 10 1000 10000 --save-baseline baseline.json
+#   python benchmarks/run_benchmark.py --baseline benchmarks/baseline.json
+#   python benchmarks/run_benchmark.py --users 1000 --latency-ms 50 --throttle-rate 0.01 --rate 10
+#   python benchmarks/run_benchmark.py --users 1000 --plan
+#
+# With --baseline the results are compared with a file written earlier by
+# --save-baseline, and the script exits with 1 when a metric grew by more
+# than --tolerance. Wall time depends on the machine, so compare baselines
+# recorded on the same machine. benchmarks/baseline.json is committed with
+# the default populations and --counts-only (Spotify and S3 requests and
+# bytes, no wall time or memory), so any machine can compare with it; record
+# it again when a change is meant to alter those counts.
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from fake_backend import FakeS3Client, FakeSpotifyAPI
+
+ENTRY_POINTS = ("handler", "main")
+
+'''
+Metrics compared with the baseline. Counts are deterministic for a given
+population; wall time and memory vary from run to run.
+'''
+COMPARED_METRICS = ("wall_s", "spotify_calls_per_user", "s3_requests", "s3_bytes", "peak_memory_mb")
+
+'''
+Metrics that depend on the machine, left out of files written with --counts-only.
+'''
+MACHINE_METRICS = ("wall_s", "users_per_s", "peak_memory_mb")
+
+
+def populate(components: Dict[str, Any], user_count: int, owner_count: int):
+    """
+    Register user_count users over owner_count owners, with valid tokens and
+    owner credentials, in the fake S3 of the components.
+    """
+    from users_store import UsersStore
+
+    owners = {f"owner{owner}": {"users": []} for owner in range(owner_count)}
+    for index in range(user_count):
+        owners[f"owner{index % owner_count}"]["users"].append({"id": f"user{index:06d}"})
+    UsersStore(components["s3_manager"], components["json_manager"]).save({"owners": owners})
+
+    token_manager = components["spotify_main"].token_manager
+    expires_at = int(time.time()) + 365 * 24 * 3600
+    for owner_info in owners.values():
+        for user in owner_info["users"]:
+            token_manager.save_token(user["id"], {
+                "access_token": f"token-{user['id']}",
+                "refresh_token": f"refresh-{user['id']}",
+                "token_type": "Bearer",
+                "expires_at": expires_at,
+                "scope": token_manager.scope,
+            })
+    if token_manager.token_vault is not None:
+        token_manager.token_vault.flush()
+
+    for owner_id in owners:
+        os.environ[f"E{owner_id}ClientId"] = "benchmark"
+        os.environ[f"E{owner_id}ClientSecret"] = "benchmark"
+        os.environ[f"E{owner_id}RedirectUrl"] = "http://127.0.0.1/callback"
+
+
+def build(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Build the workflow's components on a fresh fake backend.
+    """
+    import runtime
+    from refresh_schedule import RefreshSchedule
+    from request_scheduler import RequestScheduler, SchedulerPool
+
+    s3_client = FakeS3Client(latency=args.s3_latency_ms / 1000)
+    api = FakeSpotifyAPI(
+        latency=args.latency_ms / 1000,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        drift=args.drift
+    )
+    # Without --schedule every playlist is due on every run.
+    refresh_schedule = None if args.schedule else RefreshSchedule(intervals={})
+    components = runtime.build_components(
+        s3_client=s3_client,
+        spotify_factory=lambda owner_id, token_info: api.client(token_info["access_token"].split("-", 1)[1]),
+        refresh_schedule=refresh_schedule
+    )
+    # A rate of 0 means no client-side rate limit.
+    rate = args.rate or 1e9
+    burst = args.burst or (1_000_000 if not args.rate else 20)
+    components["spotify_main"].schedulers = SchedulerPool(lambda: RequestScheduler(rate=rate, burst=burst))
+    components["fake_s3"] = s3_client
+    components["fake_spotify"] = api
+    return components
+
+
+def run_once(components: Dict[str, Any], entry: str, user_count: int, measure_memory: bool, verbose: bool, plan: bool = False) -> Dict[str, Any]:
+    """
+    Run the workflow once (in plan mode with plan) and return its metrics.
+    """
+    import runtime
+    from lambda_function import lambda_handler
+    from tracing import tracer
+
+    s3_client = components["fake_s3"]
+    api = components["fake_spotify"]
+    s3_client.reset_stats()
+    api.reset_stats()
+    tracer.reset()
+
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    if measure_memory:
+        tracemalloc.start()
+    error = None
+    start = time.perf_counter()
+    with output:
+        if entry == "handler":
+            runtime.use_components(components)
+            try:
+                response = lambda_handler({"plan": True} if plan else {}, None)
+            finally:
+                runtime.use_components(None)
+            if response["statusCode"] != 200:
+                error = json.loads(response["body"]).get("error")
+        else:
+            try:
+                components["spotify_main"].run(plan=plan)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+    wall_s = time.perf_counter() - start
+    peak = 0
+    if measure_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    s3 = s3_client.stats()
+    spotify = api.stats()
+    return {
+        "wall_s": round(wall_s, 3),
+        "users_per_s": round(user_count / wall_s, 1) if wall_s else None,
+        "spotify_calls": spotify["calls"],
+        "spotify_calls_per_user": round(spotify["calls"] / user_count, 2),
+        "spotify_throttled": spotify["throttled"],
+        "spotify_endpoints": spotify["endpoints"],
+        "s3_gets": s3["gets"],
+        "s3_puts": s3["puts"],
+        "s3_not_modified": s3["not_modified"],
+        "s3_requests": s3["gets"] + s3["puts"],
+        "s3_bytes_read": s3["bytes_read"],
+        "s3_bytes_written": s3["bytes_written"],
+        "s3_bytes": s3["bytes_read"] + s3["bytes_written"],
+        "peak_memory_mb": round(peak / 2 ** 20, 1) if measure_memory else None,
+        "error": error,
+    }
+
+
+def benchmark_population(args: argparse.Namespace, user_count: int) -> List[Dict[str, Any]]:
+    """
+    Run one population args.runs times and return the metrics of every run.
+    """
+    components = build(args)
+    populate(components, user_count, max(1, min(args.owners, user_count)))
+    results = []
+    for run in range(args.runs):
+        if run:
+            components["fake_spotify"].advance()
+        # With --plan the first run still creates the playlists, so the later runs plan updates.
+        results.append(run_once(components, args.entry, user_count, not args.no_memory, args.verbose, plan=args.plan and run > 0))
+    return results
+
+
+def format_table(results: Dict[str, List[Dict[str, Any]]]) -> str:
+    header = f"{'users':>6} {'run':>3} {'wall s':>8} {'users/s':>8} {'calls/user':>10} {'429s':>5} {'s3 req':>7} {'s3 KiB':>9} {'peak MiB':>9}  error"
+    lines = [header]
+    for users, runs in results.items():
+        for run, metrics in enumerate(runs):
+            peak = "-" if metrics["peak_memory_mb"] is None else f"{metrics['peak_memory_mb']:.1f}"
+            lines.append(
+                f"{users:>6} {run:>3} {metrics['wall_s']:>8.2f} {metrics['users_per_s'] or 0:>8.1f} "
+                f"{metrics['spotify_calls_per_user']:>10.2f} {metrics['spotify_throttled']:>5} {metrics['s3_requests']:>7} "
+                f"{metrics['s3_bytes'] / 1024:>9.1f} {peak:>9}  {metrics['error'] or ''}"
+            )
+    return "\n".join(lines)
+
+
+def compare(results: Dict[str, List[Dict[str, Any]]], baseline: Dict[str, List[Dict[str, Any]]], tolerance: float) -> List[str]:
+    """
+    Return a line for every metric that grew by more than tolerance over the baseline.
+    """
+    regressions = []
+    for users, runs in results.items():
+        for run, metrics in enumerate(runs):
+            try:
+                base = baseline[users][run]
+            except (KeyError, IndexError):
+                continue
+            for name in COMPARED_METRICS:
+                value, reference = metrics.get(name), base.get(name)
+                if value is None or reference is None:
+                    continue
+                if value > reference * (1 + tolerance) and value - reference > 1e-3:
+                    regressions.append(f"{users} users, run {run}: {name} {reference} -> {value} (+{(value / reference - 1) * 100 if reference else float('inf'):.0f}%)")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the workflow on a local fake Spotify and S3.")
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 1000], help="Population sizes, e.g. 10 1000 10000.")
+    parser.add_argument("--owners", type=int, default=10, help="Owners the users are spread over.")
+    parser.add_argument("--runs", type=int, default=2, help="Runs per population; the first one creates the playlists.")
+    parser.add_argument("--entry", choices=ENTRY_POINTS, default="handler", help="Run lambda_handler or SpotifyMain.run.")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency of every Spotify request.")
+    parser.add_argument("--s3-latency-ms", type=float, default=0.0, help="Latency of every S3 request.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of Spotify requests answered with 429.")
+    parser.add_argument("--retry-after", type=float, default=0.0, help="Retry-After of the injected 429 responses in seconds.")
+    parser.add_argument("--drift", type=float, default=0.1, help="Fraction of users whose top lists change between runs.")
+    parser.add_argument("--rate", type=float, default=0.0, help="Requests per second per owner; 0 disables the rate limit.")
+    parser.add_argument("--burst", type=int, default=0, help="Request burst per owner with --rate.")
+    parser.add_argument("--schedule", action="store_true", help="Use TERM_REFRESH_INTERVALS instead of refreshing every playlist on every run.")
+    parser.add_argument("--plan", action="store_true", help="Run every run after the first in plan mode (reads only).")
+    parser.add_argument("--no-memory", action="store_true", help="Do not trace memory; tracemalloc slows the runs down.")
+    parser.add_argument("--verbose", action="store_true", help="Show the workflow's output.")
+    parser.add_argument("--json", metavar="PATH", help="Write the full results to PATH.")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write the results as a baseline to PATH.")
+    parser.add_argument("--baseline", metavar="PATH", help="Compare the results with a baseline written by --save-baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed growth of a metric over the baseline (0.2 = 20%%).")
+    parser.add_argument("--counts-only", action="store_true", help="Leave wall time and memory out of the files written by --json and --save-baseline.")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    for user_count in args.users:
+        results[str(user_count)] = benchmark_population(args, user_count)
+        print(format_table({str(user_count): results[str(user_count)]}).split("\n", 1)[1] if len(results) > 1 else format_table(results), flush=True)
+
+    saved = results
+    if args.counts_only:
+        saved = {users: [{name: value for name, value in metrics.items() if name not in MACHINE_METRICS} for metrics in runs] for users, runs in results.items()}
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"settings": vars(args), "results": saved}, f, indent=2)
+
+    if any(metrics["error"] for runs in results.values() for metrics in runs):
+        print("Some runs failed.")
+        return 1
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            print("\n".join(f"  {line}" for line in regressions))
+            return 1
+        print(f"OK: no metric grew by more than {args.tolerance * 100:.0f}% over the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
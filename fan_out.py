@@ -0,0 +1,154 @@
+from __future__ import annotations
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from settings import BUCKET_NAME, FAN_OUT_FUNCTION_NAME, FAN_OUT_WAIT_TIMEOUT_SECONDS, PLAYLIST_INFO_SHARD_PREFIX, STATE_LAYOUT, STATE_SHARD_COUNT
+from typing import Any, Callable, Dict, List, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from json_manager import JsonManager
+    from s3_manager import S3Manager
+
+# Splits one run over several Lambda invocations.
+#
+# The coordinator invocation ({"mode": "coordinator"}) partitions the registered
+# users into shards and dispatches one worker invocation per shard:
+#
+#   {"mode": "worker", "owner_ids": [...], "user_ids": [...]}
+#
+# A worker only processes the users listed in its event. Users are assigned to
+# workers by their playlist info hash bucket (JsonManager.shard_of), so with
+# STATE_LAYOUT = 'sharded' no two workers write the same bucket. The buckets
+# are computed with the shard count of the state manifest, which wins over
+# STATE_SHARD_COUNT once the state exists (e.g. after migrate_state --shard-count).
+#
+# Workers are fire-and-forget: the coordinator only learns whether each one
+# was started, and their results and errors are in their own logs. In plan
+# mode the coordinator waits for them instead (dispatch(events, wait=True)),
+# since their plans are the result of the run.
+
+logger = logging.getLogger(__name__)
+
+MODE_COORDINATOR = 'coordinator'
+MODE_WORKER = 'worker'
+
+def state_shard_count(s3_manager: S3Manager, json_manager: JsonManager) -> int:
+    """
+    Return the number of playlist info hash buckets: the one recorded in the
+    state manifest, as ShardedPlaylistStateStore uses it, or STATE_SHARD_COUNT
+    if there is no manifest yet. The monolithic layout has no manifest to read.
+    """
+    if STATE_LAYOUT != 'sharded':
+        return STATE_SHARD_COUNT
+    manifest = s3_manager.load_info(BUCKET_NAME, json_manager.manifest_key(PLAYLIST_INFO_SHARD_PREFIX), cache=True)
+    return (manifest or {}).get("shard_count") or STATE_SHARD_COUNT
+
+def partition_users(users_data: Dict[str, Any], json_manager: JsonManager, shard_count: int, state_shards: int = STATE_SHARD_COUNT) -> List[Dict[str, Any]]:
+    """
+    Split the registered users into at most shard_count worker events.
+
+    Parameters:
+        users_data (dict): The users json ({"owners": {...}}).
+        json_manager (JsonManager): Computes the users' hash buckets.
+        shard_count (int): Maximum number of worker invocations.
+        state_shards (int): Number of playlist info hash buckets (state_shard_count).
+
+    Returns:
+        list: Worker events, one per non-empty shard, in shard order.
+    """
+    shard_count = max(1, shard_count)
+    shards: Dict[int, Dict[str, List[str]]] = {}
+    for owner_id, owner_info in users_data.get('owners', {}).items():
+        for user_info in owner_info.get('users', []):
+            user_id = user_info.get('id')
+            if not user_id:
+                continue
+            bucket = int(json_manager.shard_of(user_id, state_shards))
+            shard = shards.setdefault(bucket % shard_count, {"owner_ids": [], "user_ids": []})
+            if owner_id not in shard["owner_ids"]:
+                shard["owner_ids"].append(owner_id)
+            shard["user_ids"].append(user_id)
+    return [
+        {"mode": MODE_WORKER, **shards[index]}
+        for index in sorted(shards)
+    ]
+
+class LambdaDispatcher:
+    """
+    Dispatches worker events as invocations of a Lambda function.
+    """
+    def __init__(self, function_name: Optional[str] = FAN_OUT_FUNCTION_NAME, client: Any = None, wait_timeout: float = FAN_OUT_WAIT_TIMEOUT_SECONDS):
+        """
+        Parameters:
+            function_name (str | None): Lambda function to invoke. Defaults to the running function.
+            client: Lambda client. A new boto3 client if None.
+            wait_timeout (float): Longest time a waiting dispatch waits for a worker, in seconds.
+        """
+        if not function_name:
+            raise RuntimeError("No Lambda function name to dispatch fan-out workers to.")
+        self.function_name = function_name
+        if client is None:
+            import boto3
+            from botocore.config import Config
+            # A retried invocation could run its worker twice, so none is retried.
+            client = boto3.client("lambda", config=Config(read_timeout=wait_timeout, retries={"max_attempts": 0}))
+        self.client = client
+
+    def dispatch(self, events: List[Dict[str, Any]], wait: bool = False) -> List[Dict[str, Any]]:
+        """
+        Invoke one worker per event, all at once.
+
+        Parameters:
+            events (list): Worker events from partition_users.
+            wait (bool): Invoke synchronously (InvocationType='RequestResponse') and
+                         return the workers' responses. Otherwise the invocations are
+                         asynchronous (InvocationType='Event') and only accepted.
+
+        Returns:
+            list: In event order, with wait the response of every worker, a worker
+                  that failed without one as {"statusCode": 500, "body": {"error": ...}};
+                  without wait {"statusCode": 202} for every accepted invocation.
+        """
+        def invoke(event: Dict[str, Any]) -> Dict[str, Any]:
+            response = self.client.invoke(
+                FunctionName=self.function_name,
+                InvocationType='RequestResponse' if wait else 'Event',
+                Payload=json.dumps(event).encode("utf-8")
+            )
+            if not wait:
+                return {"statusCode": response.get("StatusCode")}
+            payload = json.loads(response["Payload"].read() or b"null")
+            if response.get("FunctionError"):
+                # The worker crashed or timed out before lambda_handler could answer.
+                message = payload.get("errorMessage") if isinstance(payload, dict) else str(payload)
+                return {"statusCode": 500, "body": json.dumps({"error": message})}
+            return payload
+
+        if not events:
+            return []
+        with ThreadPoolExecutor(max_workers=len(events)) as executor:
+            return list(executor.map(invoke, events))
+
+class InProcessDispatcher:
+    """
+    Stand-in for LambdaDispatcher that runs the worker events one after another
+    in the current process. Used by local_run.py to test the fan-out mode.
+    """
+    def __init__(self, handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]):
+        """
+        Parameters:
+            handler (Callable): The Lambda handler to call with every worker event.
+        """
+        self.handler = handler
+
+    def dispatch(self, events: List[Dict[str, Any]], wait: bool = False) -> List[Dict[str, Any]]:
+        """
+        Call the handler for every event.
+
+        Returns:
+            list: Like LambdaDispatcher.dispatch, in event order: with wait the
+                  handler responses, otherwise only their status codes.
+        """
+        responses = [self.handler(event, None) for event in events]
+        if wait:
+            return responses
+        return [{"statusCode": response.get("statusCode")} for response in responses]
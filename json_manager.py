@@ -1,3 +1,8 @@
+import hashlib
+from typing import Any, Dict, Iterable, List
+
+MANIFEST_NAME = 'manifest.json'
+
 class JsonManager:
     """
     This class is responsible for handling JSON structures used by the
@@ -30,7 +35,9 @@ class JsonManager:
             It initializes empty placeholders for:
               - current_user_top_tracks_uris
               - artist_top_tracks_uris
-            across all Spotify time ranges (short, medium, long).
+            across all Spotify time ranges (short, medium, long), and an
+            empty playlist_states map for the playlists' snapshot IDs and an
+            empty refresh map for the playlists' last runs.
         """
         data[user_id] = {
             "current_user_top_tracks_uris": {
@@ -42,7 +49,9 @@ class JsonManager:
                 "short_term": '',
                 "medium_term": '',
                 "long_term": ''
-            }
+            },
+            "playlist_states": {},
+            "refresh": {}
         }
         return data
     
@@ -63,4 +72,77 @@ class JsonManager:
             This function is used by SpotifyMain to determine whether a user
             needs initial playlist structures created and uploaded to S3.
         """
-        return user_id not in data
\ No newline at end of file
+        return user_id not in data
+
+    def shard_of(self, user_id: str, shard_count: int) -> str:
+        """
+        Return the hash bucket of a user in the sharded playlist info layout.
+
+        The bucket only depends on the user ID and the shard count, so every
+        writer agrees on it.
+        """
+        digest = hashlib.sha1(user_id.encode("utf-8")).hexdigest()
+        return f"{int(digest[:8], 16) % shard_count:04d}"
+
+    def shard_key(self, prefix: str, shard_id: str) -> str:
+        """
+        Return the S3 object key of a shard.
+        """
+        return f"{prefix}{shard_id}.json"
+
+    def manifest_key(self, prefix: str) -> str:
+        """
+        Return the S3 object key of the manifest of a sharded layout.
+        """
+        return f"{prefix}{MANIFEST_NAME}"
+
+    def make_manifest(self, shard_ids: Iterable[str], shard_count: int = 0) -> Dict[str, Any]:
+        """
+        Create the manifest of a sharded layout.
+
+        Parameters:
+            shard_ids (Iterable[str]): IDs of the shards that exist in S3.
+            shard_count (int): Number of hash buckets, 0 for shards keyed by owner.
+
+        Returns:
+            dict: {"version": 1, "shard_count": ..., "shards": [...]}
+        """
+        return {
+            "version": 1,
+            "shard_count": shard_count,
+            "shards": sorted(set(shard_ids))
+        }
+
+    def split_playlist_info(self, data: Dict[str, Any], shard_count: int) -> Dict[str, Dict[str, Any]]:
+        """
+        Split the playlist info json into hash buckets of users.
+
+        Returns:
+            dict: {shard_id: {user_id: entry, ...}, ...}
+        """
+        shards: Dict[str, Dict[str, Any]] = {}
+        for user_id, entry in data.items():
+            shards.setdefault(self.shard_of(user_id, shard_count), {})[user_id] = entry
+        return shards
+
+    def split_users_info(self, data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """
+        Split the users json into one object per owner.
+
+        Returns:
+            dict: {owner_id: {"users": [...]}, ...}
+        """
+        return dict(data.get("owners", {}))
+
+    def merge_users_info(self, owners: Dict[str, Dict[str, Any]], owner_ids: List[str]) -> Dict[str, Any]:
+        """
+        Rebuild the users json from per-owner objects, in manifest order.
+        Owners whose object is missing are left out.
+        """
+        return {
+            "owners": {
+                owner_id: owners[owner_id]
+                for owner_id in owner_ids
+                if owners.get(owner_id) is not None
+            }
+        }
@@ -0,0 +1,118 @@
+from __future__ import annotations
+import codecs
+import json
+from typing import Any, Iterable, Iterator, Tuple
+
+# Incremental reader for large JSON documents of the form
+# {"field": {"key": value, ...}, ...}, e.g. the users file {"owners": {...}}.
+#
+# The document is read chunk by chunk and only the entry that is being parsed
+# is kept in memory, so a caller can start working on the first entries
+# while the rest is still being downloaded.
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",]}"
+
+class _Buffer:
+    """
+    Text buffer over a stream of byte chunks, refilled on demand.
+    """
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._decoder_json = json.JSONDecoder()
+        self.text = ""
+        self.pos = 0
+        self.exhausted = False
+
+    def _fill(self) -> bool:
+        if self.exhausted:
+            return False
+        chunk = next(self._chunks, None)
+        # Drop the consumed text so that the buffer stays small.
+        self.text = self.text[self.pos:]
+        self.pos = 0
+        if chunk is None:
+            self.exhausted = True
+            self.text += self._decoder.decode(b"", final=True)
+            return True
+        self.text += self._decoder.decode(chunk)
+        return True
+
+    def peek(self) -> str:
+        """
+        Return the next non-whitespace character without consuming it, '' at the end.
+        """
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str):
+        """
+        Consume the next non-whitespace character, which must be char.
+        """
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' in JSON stream, found '{found or 'end of data'}'.")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """
+        Parse the next complete JSON value, reading more chunks until it is complete.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder_json.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number is only complete when a delimiter follows it; otherwise
+            # it may continue in the next chunk (e.g. "0." + "5").
+            if isinstance(value, (int, float)) and not self.exhausted and (end == len(self.text) or self.text[end] not in _DELIMITERS):
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+
+def iter_object_items(chunks: Iterable[bytes], field: str) -> Iterator[Tuple[str, Any]]:
+    """
+    Yield the (key, value) pairs of the object under a top-level field.
+
+    Parameters:
+        chunks (Iterable[bytes]): The UTF-8 document in chunks of any size.
+        field (str): Top-level field whose object is iterated. Other fields are skipped.
+
+    Raises:
+        ValueError: If the document is not a JSON object, or the field is not an object.
+    """
+    buffer = _Buffer(chunks)
+    buffer.expect("{")
+    if buffer.peek() == "}":
+        return
+    while True:
+        name = buffer.value()
+        buffer.expect(":")
+        if name == field:
+            buffer.expect("{")
+            if buffer.peek() != "}":
+                while True:
+                    key = buffer.value()
+                    buffer.expect(":")
+                    yield key, buffer.value()
+                    if buffer.peek() != ",":
+                        break
+                    buffer.pos += 1
+            buffer.expect("}")
+        else:
+            buffer.value()
+        if buffer.peek() != ",":
+            break
+        buffer.pos += 1
+    buffer.expect("}")
@@ -1,12 +1,12 @@
 import json
 import traceback
 import logging
-from playlist_manager import PlaylistManager
-from s3_manager import S3Manager
-from json_manager import JsonManager
-from spotify_top_tracks import SpotifyTopTracks
-from spotify_top_artists_tracks import SpotifyTopArtistsTracks
-from spotify_main import SpotifyMain
+import runtime
+from users_store import UsersStore
+from fan_out import LambdaDispatcher, MODE_COORDINATOR, MODE_WORKER, partition_users, state_shard_count
+from settings import BUCKET_NAME, ARTIST_CACHE_FILE_KEY, FAN_OUT_SHARDS
+from tracing import cache_stats, tracer
+from user_plan import summarize_plans
 
 logging.basicConfig(
     level=logging.INFO,
@@ -15,36 +15,119 @@ logging.basicConfig(
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def lambda_handler(event, context):
+def lambda_handler(event, context, dispatcher=None):
     """
     AWS Lambda entry point.
     This function initializes all managers and orchestrates the Spotify playlist update workflow.
     It loads required managers, constructs the SpotifyMain controller,
     and triggers the processing of user playlists stored in S3.
+
+    The event selects the mode:
+      - {} processes every registered user.
+      - {"mode": "coordinator", "shards": N} splits the users into N worker
+        events and dispatches them (see fan_out.py) without processing users itself.
+        The workers run asynchronously: "results" only holds whether each was
+        started ("failed" counts those that were not); their own results and
+        errors are in their logs.
+      - {"mode": "worker", "owner_ids": [...], "user_ids": [...]} processes only those users.
+    Any of them with "plan": true runs in plan mode: every read is sent and
+    the playlist changes are computed and returned in the body, but nothing is
+    written to Spotify and nothing to S3, except the token of a user for whom
+    Spotify issued a new refresh token (counted as "tokens_saved" in the plan
+    totals; see SpotifyMain.run). A coordinator passes the flag on to its workers
+    and waits for them, returning their status codes, the number that failed
+    and their plans merged into one.
+
+    `dispatcher` replaces the Lambda dispatcher of the coordinator, e.g. with
+    fan_out.InProcessDispatcher when running locally.
+
+    With TRACING_ENABLED the response body of a run also holds its report
+    (see tracing.py), which is logged as JSON and as EMF metrics as well.
     """
     try:
-        # Initialize managers responsible for playlist handling, S3 interactions, and JSON operations.
-        playlist_manager = PlaylistManager()
-        s3_manager = S3Manager()
-        json_manager = JsonManager()
-        spotify_top_tracks = SpotifyTopTracks(playlist_manager)
-        spotify_top_artists_tracks = SpotifyTopArtistsTracks(playlist_manager)
+        event = event or {}
+        mode = event.get("mode")
+        plan = bool(event.get("plan"))
+        # The tracer lives as long as the container; report this invocation only.
+        tracer.reset()
+
+        # Managers responsible for playlist handling, S3 interactions, and JSON operations.
+        # They are built on the first invocation and reused while the container is warm.
+        components = runtime.get_components()
+        s3_manager = components["s3_manager"]
+        json_manager = components["json_manager"]
+        artist_tracks_cache = components["artist_tracks_cache"]
+
+        if mode == MODE_COORDINATOR:
+            users_data = UsersStore(s3_manager, json_manager).load() or {}
+            events = partition_users(users_data, json_manager, event.get("shards", FAN_OUT_SHARDS), state_shard_count(s3_manager, json_manager))
+            if plan:
+                for worker_event in events:
+                    worker_event["plan"] = True
+            results = (dispatcher or LambdaDispatcher()).dispatch(events, wait=plan)
+            body = {
+                "message": "Dispatched",
+                "workers": len(events),
+                "users": sum(len(worker_event["user_ids"]) for worker_event in events),
+                "results": [{"statusCode": result.get("statusCode")} for result in results],
+                "failed": sum(1 for result in results if not 200 <= (result.get("statusCode") or 0) < 300),
+            }
+            if plan:
+                plans = {}
+                for result in results:
+                    if result.get("statusCode") == 200:
+                        plans.update(json.loads(result["body"])["plan"]["users"])
+                    else:
+                        logger.error("Plan worker failed: %s", result.get("body"))
+                body["message"] = "Planned"
+                body["plan"] = {"totals": summarize_plans(plans), "users": plans}
+            return {
+                "statusCode": 200,
+                "body": json.dumps(body)
+            }
+
+        # Load the shared artist cache persisted in S3 once per container.
+        if not artist_tracks_cache.loaded:
+            artist_tracks_cache.load(s3_manager, BUCKET_NAME, ARTIST_CACHE_FILE_KEY)
 
         # Main orchestrator responsible for running all Spotify-related logic.
-        spotify_main = SpotifyMain(
-            s3_manager,
-            json_manager,
-            spotify_top_tracks,
-            spotify_top_artists_tracks
-        )
+        spotify_main = components["spotify_main"]
+        artist_stats_before = artist_tracks_cache.stats()
+
+        # Execute the core Spotify update process, for the event's users in worker mode.
+        if mode == MODE_WORKER:
+            plans = spotify_main.run(user_ids=event.get("user_ids", []), owner_ids=event.get("owner_ids"), plan=plan)
+        else:
+            plans = spotify_main.run(plan=plan)
 
-        # Execute the core Spotify update process.
-        spotify_main.run()
+        # Persist the shared artist cache for the next cold start.
+        if not plan:
+            artist_tracks_cache.save(s3_manager, BUCKET_NAME, ARTIST_CACHE_FILE_KEY)
+        artist_stats = artist_tracks_cache.stats()
+        logger.info("Artist top tracks cache: %s", artist_stats)
+
+        body = {"message": "Success"}
+        if plan:
+            totals = summarize_plans(plans or {})
+            logger.info("Plan: %s", json.dumps(totals))
+            body = {"message": "Planned", "plan": {"totals": totals, "users": plans or {}}}
+        if tracer.enabled:
+            report = tracer.report({
+                "caches": {
+                    "artist_tracks": cache_stats(
+                        artist_stats["hits"] - artist_stats_before["hits"],
+                        artist_stats["misses"] - artist_stats_before["misses"]
+                    ),
+                },
+                "schedulers": spotify_main.schedulers.stats(),
+            })
+            tracer.emit(report)
+            body["report"] = report
 
         # If no exceptions occur, return a successful API response.
         return {
             "statusCode": 200,
-            "body": json.dumps({"message": "Success"})
+            "body": json.dumps(body)
         }
         
     except Exception as e:
@@ -1,14 +1,38 @@
+import argparse
 import json
 import sys
 
+from fan_out import InProcessDispatcher, MODE_COORDINATOR
 from lambda_function import lambda_handler
 
 
 def main() -> int:
-    response = lambda_handler(
-        event={},
-        context=None
+    parser = argparse.ArgumentParser(description="Run the Lambda workflow locally.")
+    parser.add_argument(
+        "--fan-out",
+        type=int,
+        metavar="N",
+        help="Run as a coordinator that splits the users into N workers, executed in this process."
     )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Only read and compute the playlist changes; write nothing to Spotify or the playlist info."
+    )
+    args = parser.parse_args()
+    event = {"plan": True} if args.plan else {}
+
+    if args.fan_out:
+        response = lambda_handler(
+            event={"mode": MODE_COORDINATOR, "shards": args.fan_out, **event},
+            context=None,
+            dispatcher=InProcessDispatcher(lambda_handler)
+        )
+    else:
+        response = lambda_handler(
+            event=event,
+            context=None
+        )
 
     print(
         json.dumps(
@@ -0,0 +1,64 @@
+import argparse
+import json
+import sys
+
+from json_manager import JsonManager
+from s3_manager import S3Manager
+from settings import BUCKET_NAME, PLAYLIST_INFO_FILE_KEY, PLAYLIST_INFO_SHARD_PREFIX, STATE_SHARD_COUNT, USERS_FILE_KEY, USERS_SHARD_PREFIX
+
+
+def migrate(s3_manager: S3Manager, json_manager: JsonManager, bucket: str, shard_count: int, dry_run: bool = False) -> dict:
+    """
+    Copy the monolithic users and playlist info files into the sharded layout.
+
+    The monolithic objects are left untouched, so switching STATE_LAYOUT back
+    to 'monolithic' keeps working (without the changes made while sharded).
+
+    Returns:
+        dict: Number of owners, users and objects written.
+    """
+    users_data = s3_manager.load_info(bucket, USERS_FILE_KEY) or {}
+    playlist_info = s3_manager.load_info(bucket, PLAYLIST_INFO_FILE_KEY) or {}
+
+    owners = json_manager.split_users_info(users_data)
+    shards = json_manager.split_playlist_info(playlist_info, shard_count)
+
+    objects = {
+        json_manager.shard_key(USERS_SHARD_PREFIX, owner_id): owner_info
+        for owner_id, owner_info in owners.items()
+    }
+    objects.update({
+        json_manager.shard_key(PLAYLIST_INFO_SHARD_PREFIX, shard_id): shard
+        for shard_id, shard in shards.items()
+    })
+    manifests = {
+        json_manager.manifest_key(USERS_SHARD_PREFIX): json_manager.make_manifest(owners),
+        json_manager.manifest_key(PLAYLIST_INFO_SHARD_PREFIX): json_manager.make_manifest(shards, shard_count),
+    }
+
+    if not dry_run:
+        s3_manager.save_many(bucket, objects, indent=None)
+        # Manifests last, so a reader never sees a manifest that lists missing shards.
+        s3_manager.save_many(bucket, manifests)
+
+    return {
+        "owners": len(owners),
+        "users": len(playlist_info),
+        "objects": len(objects) + len(manifests),
+        "dry_run": dry_run,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Migrate S3 state to the sharded layout.")
+    parser.add_argument("--shard-count", type=int, default=STATE_SHARD_COUNT)
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be written.")
+    args = parser.parse_args()
+
+    result = migrate(S3Manager(), JsonManager(), BUCKET_NAME, args.shard_count, args.dry_run)
+    print(json.dumps(result, ensure_ascii=False, indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
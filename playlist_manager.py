@@ -1,8 +1,55 @@
 from __future__ import annotations
-from typing import List, Dict, Any, Optional, TYPE_CHECKING
+import hashlib
+from typing import List, Dict, Any, Iterator, Optional, Tuple, TYPE_CHECKING
 if TYPE_CHECKING:
     from spotipy import Spotify
 
+# Spotify accepts at most 100 items per playlist write request.
+PLAYLIST_WRITE_LIMIT = 100
+
+# Spotify returns at most 100 playlist items per page. Only the track URIs
+# and the next page link are requested to keep the responses small.
+PLAYLIST_READ_LIMIT = 100
+PLAYLIST_ITEM_FIELDS = 'items(track(uri)),next'
+
+# Spotify returns at most 50 of the user's playlists per page.
+PLAYLIST_LIST_LIMIT = 50
+
+class SyncStats:
+    """
+    Result of synchronizing a playlist with a list of track URIs.
+
+    Attributes:
+        strategy (str): 'none' when nothing changed, 'replace' when the playlist
+                        was rewritten, or 'incremental' when only the differences
+                        were applied.
+        api_calls (int): Number of Spotify write requests used.
+        removed (int): Number of track URIs removed.
+        inserted (int): Number of track URIs inserted.
+        moved (int): Number of reorder requests.
+        snapshot_id (str | None): Playlist snapshot ID returned by the last write.
+    """
+    def __init__(self, strategy: str = 'none', api_calls: int = 0, removed: int = 0, inserted: int = 0, moved: int = 0, snapshot_id: Optional[str] = None):
+        self.strategy = strategy
+        self.api_calls = api_calls
+        self.removed = removed
+        self.inserted = inserted
+        self.moved = moved
+        self.snapshot_id = snapshot_id
+
+    @property
+    def modified(self) -> bool:
+        """
+        True if at least one write request was sent.
+        """
+        return self.api_calls > 0
+
+    def __repr__(self) -> str:
+        return (
+            f"SyncStats(strategy={self.strategy!r}, api_calls={self.api_calls}, removed={self.removed}, "
+            f"inserted={self.inserted}, moved={self.moved}, snapshot_id={self.snapshot_id!r})"
+        )
+
 class PlaylistManager:
     """
     Manages playlist creation, updates, and metadata changes.
@@ -28,6 +75,7 @@ class PlaylistManager:
         Returns:
             Updated dictionary containing the new playlist URI.
         """
+        self._forget_playlist_state(data[user_id], data[user_id]["current_user_top_tracks_uris"][term])
         data[user_id]["current_user_top_tracks_uris"][term] = playlist_uri
         return data
     
@@ -39,9 +87,91 @@ class PlaylistManager:
         Returns:
             Updated dictionary containing the new playlist URI.
         """
+        self._forget_playlist_state(data[user_id], data[user_id]["artist_top_tracks_uris"][term])
         data[user_id]["artist_top_tracks_uris"][term] = playlist_uri
         return data
 
+    def tracks_hash(self, track_uris: List[str]) -> str:
+        """
+        Return a short, order-sensitive hash of a list of track URIs.
+        """
+        return hashlib.sha1("\n".join(track_uris).encode("utf-8")).hexdigest()
+
+    def get_playlist_state(self, data: Dict[str, Any], playlist_uri: str, user_id: str) -> Optional[Dict[str, str]]:
+        """
+        Return the stored snapshot ID and tracks hash of a playlist, if any.
+
+        Returns:
+            {"snapshot_id": ..., "tracks_hash": ...} or None if the playlist
+            was never recorded.
+        """
+        return data[user_id].get("playlist_states", {}).get(playlist_uri)
+
+    def record_playlist_state(self, data: Dict[str, Any], playlist_uri: str, snapshot_id: Optional[str], track_uris: List[str], user_id: str) -> Dict[str, Any]:
+        """
+        Store the snapshot ID of a playlist together with a hash of the tracks
+        it contains at that snapshot. This modifies the value of playlist info
+        json that is stored in S3.
+
+        A playlist whose snapshot ID is unknown is forgotten instead, so its
+        content is read again on the next run.
+
+        Returns:
+            Updated dictionary containing the playlist state.
+        """
+        states = data[user_id].setdefault("playlist_states", {})
+        if snapshot_id:
+            states[playlist_uri] = {
+                "snapshot_id": snapshot_id,
+                "tracks_hash": self.tracks_hash(track_uris)
+            }
+        else:
+            states.pop(playlist_uri, None)
+        return data
+
+    def record_sync_result(self, sp: Spotify, data: Dict[str, Any], playlist_uri: str, stats: SyncStats, track_uris: List[str], details_changed: bool, user_id: str) -> Dict[str, Any]:
+        """
+        Record the playlist state reached after update_tracks.
+
+        A description change made before the update creates a snapshot that
+        no track write reported back, so in that case the snapshot ID is
+        fetched on its own.
+
+        Returns:
+            Updated dictionary containing the playlist state.
+        """
+        snapshot_id = stats.snapshot_id
+        if details_changed and not stats.modified:
+            snapshot_id = self.get_snapshot_id(sp, playlist_uri)
+        return self.record_playlist_state(data, playlist_uri, snapshot_id, track_uris, user_id)
+
+    def _forget_playlist_state(self, user_data: Dict[str, Any], playlist_uri: str):
+        if playlist_uri:
+            user_data.get("playlist_states", {}).pop(playlist_uri, None)
+
+    def iter_songs_uri(self, sp: Spotify, playlist_uri: str) -> Iterator[str]:
+        """
+        Stream the track URIs of a playlist page by page.
+
+        The next page is only requested once the previous one has been
+        consumed, so a caller that stops iterating early saves the remaining
+        requests. Items without a track (e.g. removed local files) are skipped.
+
+        Args:
+            sp: The authenticated Spotify client.
+            playlist_uri: The playlist's URI.
+
+        Yields:
+            Track URIs in playlist order.
+        """
+        page = sp.playlist_items(playlist_id=playlist_uri, fields=PLAYLIST_ITEM_FIELDS, limit=PLAYLIST_READ_LIMIT)
+        while page:
+            for song in page['items']:
+                track = song.get('track')
+                if track and track.get('uri'):
+                    yield track['uri']
+            page = sp.next(page) if page.get('next') else None
+
     def get_songs_uri(self, sp: Spotify, playlist_uri: str) -> List[str]:
         """
         Retrieve all track URIs currently inside the given playlist.
@@ -53,27 +183,82 @@ class PlaylistManager:
         Returns:
             A list of track URIs inside the playlist.
         """
-        prev_track_uris = []
-        songs = sp.playlist_items(playlist_id=playlist_uri)
-        for song in songs['items']:
-            uri = song['track']['uri']
-            prev_track_uris.append(uri)
-        return prev_track_uris
+        return list(self.iter_songs_uri(sp, playlist_uri))
+
+    def read_content(self, sp: Spotify, playlist_uri: str, track_uris: List[str]) -> List[str]:
+        """
+        Read as much of a playlist as its update to track_uris needs.
+
+        A list that fits into a single replace request is written unless the
+        playlist already equals it, so reading stops at the first page that
+        contains a difference; the URIs read up to the difference are
+        returned, which then differ from track_uris. A longer list needs the
+        whole content to plan a minimal edit.
+
+        Args:
+            sp: The authenticated Spotify client.
+            playlist_uri: The playlist's URI.
+            track_uris: Track URIs the playlist should contain.
+
+        Returns:
+            The playlist's track URIs, or for a short list the ones read up to
+            the first difference.
+        """
+        if len(track_uris) > PLAYLIST_WRITE_LIMIT:
+            return self.get_songs_uri(sp, playlist_uri)
+        read = []
+        for uri in self.iter_songs_uri(sp, playlist_uri):
+            read.append(uri)
+            if len(read) > len(track_uris) or track_uris[len(read) - 1] != uri:
+                break
+        return read
 
     def get_my_playlists(self, sp: Spotify) -> Dict[str, Any]:
         """
-        Get all playlists owned by the user.
+        Get all playlists of the user, following every page of the listing.
+
+        Args:
+            sp: The authenticated Spotify client.
+
+        Returns:
+            A dictionary whose 'items' contains every playlist object returned by the Spotify API.
+        """
+        results = sp.current_user_playlists(limit=PLAYLIST_LIST_LIMIT)
+        items = []
+        while results:
+            items.extend(item for item in results['items'] if item)
+            results = sp.next(results) if results.get('next') else None
+        return {'items': items, 'total': len(items)}
+
+    def build_playlist_index(self, sp: Spotify) -> Dict[str, Dict[str, Any]]:
+        """
+        Build an index of all the user's playlists keyed by playlist URI.
+
+        The index is built once per user and run, shared by all playlist
+        generators, and updated in place by make_playlist.
 
         Args:
             sp: The authenticated Spotify client.
 
         Returns:
-            A dictionary of user playlists data returned by the Spotify API.
+            Playlist objects keyed by their URI.
         """
-        results = sp.current_user_playlists()
-        return results
+        return {playlist['uri']: playlist for playlist in self.get_my_playlists(sp)['items']}
 
-    def make_playlist(self, sp: Spotify, name: str, public=False, collaborative=False, description: Optional[str]=None) -> Dict[str, Any]:
+    def get_snapshot_id(self, sp: Spotify, playlist_uri: str) -> Optional[str]:
+        """
+        Fetch only the current snapshot ID of a playlist.
+
+        Args:
+            sp: The authenticated Spotify client.
+            playlist_uri: The playlist's URI.
+
+        Returns:
+            The playlist's snapshot ID.
+        """
+        return (sp.playlist(playlist_id=playlist_uri, fields='snapshot_id') or {}).get('snapshot_id')
+
+    def make_playlist(self, sp: Spotify, name: str, public=False, collaborative=False, description: Optional[str]=None, playlist_index: Optional[Dict[str, Dict[str, Any]]]=None, user_id: Optional[str]=None) -> Dict[str, Any]:
         """
         Create a new playlist for the user.
 
@@ -83,46 +268,246 @@ class PlaylistManager:
             public: Whether the playlist is public.
             collaborative: Whether the playlist is collaborative.
             description: Playlist description text.
+            playlist_index: Index from build_playlist_index to add the new playlist to (optional).
+            user_id: The user's Spotify ID. Saves a `me` request when given.
 
         Returns:
             The created playlist object.
         """
-        new_playlist = sp.user_playlist_create(user=sp.me()['id'], name=name, public=public, collaborative=collaborative, description=description)
+        new_playlist = sp.user_playlist_create(user=user_id or sp.me()['id'], name=name, public=public, collaborative=collaborative, description=description)
+        if playlist_index is not None:
+            playlist_index[new_playlist['uri']] = new_playlist
         return new_playlist
 
-    def delete_all_songs(self, sp: Spotify, playlist_uri: str, prev_track_uris: List[str]):
+    def change_playlist_details(self, sp: Spotify, playlist_uri: str, name=None, public=None, collaborative=None, description: Optional[str]=None):
         """
-        Remove all tracks from a playlist before updating it.
+        Update playlist metadata (name, public settings, description).
 
         Args:
             sp: The authenticated Spotify client.
-            playlist_uri: URI of the playlist to clear.
-            prev_track_uris: List of URIs to remove.
+            playlist_uri: Playlist to update.
+            name: New playlist name (optional).
+            public: Change public visibility (optional).
+            collaborative: Change collaborative setting (optional).
+            description: Change playlist description (optional).
         """
-        if prev_track_uris:
-            sp.playlist_remove_all_occurrences_of_items(playlist_id=playlist_uri, items=prev_track_uris)
+        sp.playlist_change_details(playlist_id=playlist_uri, name=name, public=public, collaborative=collaborative, description=description)
 
-    def add_to_playlist(self, sp: Spotify, track_uris: List[str], playlist_uri: str):
+    def update_description(self, sp: Spotify, playlist: Dict[str, Any], description: str) -> bool:
         """
-        Add a list of tracks to a playlist.
+        Change a playlist's description unless it is already up to date.
+
+        Every change creates a new playlist snapshot, so skipping unchanged
+        descriptions also keeps the stored snapshot ID valid.
 
         Args:
             sp: The authenticated Spotify client.
-            track_uris: Track URIs to add.
-            playlist_uri: Playlist to append tracks to.
+            playlist: Playlist object as returned by Spotify (needs 'uri' and 'description').
+            description: The wanted description.
+
+        Returns:
+            True if the description was changed.
         """
-        sp.playlist_add_items(playlist_id=playlist_uri, items=track_uris)
+        if playlist.get('description') == description:
+            return False
+        self.change_playlist_details(sp, playlist['uri'], description=description)
+        playlist['description'] = description
+        return True
 
-    def change_playlist_details(self, sp: Spotify, playlist_uri: str, name=None, public=None, collaborative=None, description: Optional[str]=None):
+    def plan_sync(self, prev_track_uris: List[str], track_uris: List[str]) -> Tuple[str, List[Tuple]]:
         """
-        Update playlist metadata (name, public settings, description).
+        Compute the cheapest list of write operations that turns a playlist
+        containing prev_track_uris into one containing track_uris.
+
+        Two strategies are compared:
+          - replace: one playlist_replace_items call with the first 100 tracks,
+            followed by playlist_add_items calls for the rest.
+          - incremental: remove the tracks that disappeared, then walk the target
+            order and insert new runs of tracks or move runs of existing tracks
+            into place. Only used when neither list contains duplicates.
+
+        Args:
+            prev_track_uris: Track URIs currently in the playlist, in order.
+            track_uris: Track URIs the playlist should contain, in order.
+
+        Returns:
+            The chosen strategy name and its operations. Every operation is one
+            write request: ('replace', items), ('add', items, position),
+            ('remove', items) or ('reorder', range_start, insert_before, range_length).
+        """
+        if prev_track_uris == track_uris:
+            return 'none', []
+
+        replace_ops = [('replace', track_uris[:PLAYLIST_WRITE_LIMIT])]
+        for i in range(PLAYLIST_WRITE_LIMIT, len(track_uris), PLAYLIST_WRITE_LIMIT):
+            replace_ops.append(('add', track_uris[i:i + PLAYLIST_WRITE_LIMIT], None))
+
+        if len(set(prev_track_uris)) != len(prev_track_uris) or len(set(track_uris)) != len(track_uris):
+            return 'replace', replace_ops
+
+        # On a tie the incremental script wins because it keeps unchanged tracks in place.
+        incremental_ops = self._plan_incremental(prev_track_uris, track_uris, len(replace_ops) + 1)
+        if incremental_ops is not None and len(incremental_ops) <= len(replace_ops):
+            return 'incremental', incremental_ops
+        return 'replace', replace_ops
+
+    def _plan_incremental(self, prev_track_uris: List[str], track_uris: List[str], budget: int) -> Optional[List[Tuple]]:
+        """
+        Build the incremental edit script, giving up (None) once it needs
+        `budget` requests or more.
+        """
+        target = set(track_uris)
+        removed = [uri for uri in prev_track_uris if uri not in target]
+        ops = [
+            ('remove', removed[i:i + PLAYLIST_WRITE_LIMIT])
+            for i in range(0, len(removed), PLAYLIST_WRITE_LIMIT)
+        ]
+
+        # Simulate the playlist after the removals and fix it position by position.
+        current = [uri for uri in prev_track_uris if uri in target]
+        present = set(current)
+        i = 0
+        while i < len(track_uris):
+            if len(ops) >= budget:
+                return None
+            if i < len(current) and current[i] == track_uris[i]:
+                i += 1
+                continue
+            if track_uris[i] not in present:
+                end = i
+                while end < len(track_uris) and end - i < PLAYLIST_WRITE_LIMIT and track_uris[end] not in present:
+                    end += 1
+                run = track_uris[i:end]
+                ops.append(('add', run, i))
+                current[i:i] = run
+                i = end
+                continue
+            start = current.index(track_uris[i], i)
+            length = 1
+            while (start + length < len(current) and i + length < len(track_uris)
+                   and current[start + length] == track_uris[i + length]):
+                length += 1
+            ops.append(('reorder', start, i, length))
+            current[i:i] = current[start:start + length]
+            del current[start + length:start + 2 * length]
+            i += length
+        return ops
+
+    def apply_sync(self, sp: Spotify, playlist_uri: str, strategy: str, ops: List[Tuple]) -> SyncStats:
+        """
+        Send the operations computed by plan_sync to Spotify.
 
         Args:
             sp: The authenticated Spotify client.
             playlist_uri: Playlist to update.
-            name: New playlist name (optional).
-            public: Change public visibility (optional).
-            collaborative: Change collaborative setting (optional).
-            description: Change playlist description (optional).
+            strategy: Strategy name returned by plan_sync.
+            ops: Operations returned by plan_sync.
+
+        Returns:
+            SyncStats describing the requests that were sent.
+        """
+        stats = SyncStats(strategy=strategy)
+        for op in ops:
+            kind = op[0]
+            if kind == 'replace':
+                result = sp.playlist_replace_items(playlist_id=playlist_uri, items=op[1])
+                stats.inserted += len(op[1])
+            elif kind == 'add':
+                result = sp.playlist_add_items(playlist_id=playlist_uri, items=op[1], position=op[2])
+                stats.inserted += len(op[1])
+            elif kind == 'remove':
+                result = sp.playlist_remove_all_occurrences_of_items(playlist_id=playlist_uri, items=op[1])
+                stats.removed += len(op[1])
+            elif kind == 'reorder':
+                result = sp.playlist_reorder_items(playlist_id=playlist_uri, range_start=op[1], insert_before=op[2], range_length=op[3])
+                stats.moved += 1
+            else:
+                raise ValueError(f"Unknown playlist operation: {kind}")
+            stats.api_calls += 1
+            if result and result.get('snapshot_id'):
+                stats.snapshot_id = result['snapshot_id']
+        return stats
+
+    def needs_read(self, track_uris: List[str], snapshot_id: Optional[str] = None, state: Optional[Dict[str, str]] = None) -> bool:
+        """
+        Tell whether the playlist's content has to be read (read_content) to
+        synchronize it with track_uris, so the read can be done up front.
+
+        Args:
+            track_uris: Track URIs the playlist should contain.
+            snapshot_id: The playlist's current snapshot ID, if known.
+            state: The stored state from get_playlist_state, if any.
+
+        Returns:
+            True if the current content is needed.
+        """
+        known = bool(snapshot_id) and state is not None and state.get('snapshot_id') == snapshot_id
+        if not known:
+            return True
+        if state.get('tracks_hash') == self.tracks_hash(track_uris):
+            return False
+        return len(track_uris) > PLAYLIST_WRITE_LIMIT and state.get('tracks_hash') != self.tracks_hash([])
+
+    def plan_update(self, track_uris: List[str], snapshot_id: Optional[str] = None, state: Optional[Dict[str, str]] = None, prev_track_uris: Optional[List[str]] = None) -> Tuple[str, List[Tuple]]:
+        """
+        Compute the write operations update_tracks sends, without sending
+        anything. The playlist's content read by read_content has to be given
+        whenever needs_read is True.
+
+        Args:
+            track_uris: Track URIs the playlist should contain.
+            snapshot_id: The playlist's current snapshot ID, if known.
+            state: The stored state from get_playlist_state, if any.
+            prev_track_uris: The playlist's track URIs returned by read_content, if read.
+
+        Returns:
+            The strategy name and its operations, as returned by plan_sync.
+        """
+        known = bool(snapshot_id) and state is not None and state.get('snapshot_id') == snapshot_id
+        if known and state.get('tracks_hash') == self.tracks_hash(track_uris):
+            return 'none', []
+
+        if len(track_uris) <= PLAYLIST_WRITE_LIMIT:
+            if not known and prev_track_uris == track_uris:
+                return 'none', []
+            return 'replace', [('replace', track_uris)]
+        if known and state.get('tracks_hash') == self.tracks_hash([]):
+            prev_track_uris = []
+        if prev_track_uris is None:
+            raise ValueError("The playlist's current content is needed to plan its update.")
+        return self.plan_sync(prev_track_uris, track_uris)
+
+    def update_tracks(self, sp: Spotify, playlist_uri: str, track_uris: List[str], snapshot_id: Optional[str] = None, state: Optional[Dict[str, str]] = None, prev_track_uris: Optional[List[str]] = None) -> SyncStats:
+        """
+        Synchronize the playlist with track_uris, reading it only when needed.
+
+        If the playlist's current snapshot ID equals the one stored in `state`,
+        its content is known from the stored tracks hash: an equal hash means
+        nothing changed and nothing is read, and a list that fits into a single
+        replace request (or a known empty playlist) is written without reading.
+
+        Otherwise the content is read with read_content: when the new list
+        fits into a single replace request, only up to the first difference,
+        and then replaced; longer lists read the whole playlist to plan a
+        minimal edit. Content that was already read (see needs_read) is
+        passed as prev_track_uris and not read again.
+
+        Args:
+            sp: The authenticated Spotify client.
+            playlist_uri: Playlist to update.
+            track_uris: Track URIs the playlist should contain.
+            snapshot_id: The playlist's current snapshot ID, if known.
+            state: The stored state from get_playlist_state, if any.
+            prev_track_uris: The playlist's track URIs returned by read_content, if already read.
+
+        Returns:
+            SyncStats with the number of API calls used. Its snapshot_id is the
+            snapshot after the update.
         """
-        sp.playlist_change_details(playlist_id=playlist_uri, name=name, public=public, collaborative=collaborative, description=description)
\ No newline at end of file
+        if prev_track_uris is None and self.needs_read(track_uris, snapshot_id, state):
+            prev_track_uris = self.read_content(sp, playlist_uri, track_uris)
+        strategy, ops = self.plan_update(track_uris, snapshot_id, state, prev_track_uris)
+        stats = self.apply_sync(sp, playlist_uri, strategy, ops)
+        if not stats.modified:
+            stats.snapshot_id = snapshot_id
+        return stats
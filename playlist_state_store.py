@@ -0,0 +1,329 @@
+from __future__ import annotations
+import copy
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from settings import BUCKET_NAME, PLAYLIST_INFO_FILE_KEY, PLAYLIST_INFO_SHARD_PREFIX, STATE_CHECKPOINT_INTERVAL, STATE_LAYOUT, STATE_SHARD_COUNT
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from s3_manager import S3Manager
+    from json_manager import JsonManager
+
+logger = logging.getLogger(__name__)
+
+class PlaylistStateStore:
+    """
+    Holds the playlist info json (PLAYLIST_INFO_FILE_KEY) for one run and
+    writes it back to S3 only when something changed.
+
+    Every user is processed on its own working copy (checkout), which is
+    compared with the stored entry when the user is done (commit). Only
+    changed users mark the document dirty, so a run without changes does not
+    write at all and a run with changes writes once, at the end (flush).
+    With checkpoint_interval > 0 the document is also flushed after every
+    that many committed users, so a crashed run loses at most that much work.
+
+    Runs may overlap (a scheduled run and a local one, or fan-out workers),
+    so flush writes with optimistic concurrency: the write only succeeds if
+    the object still has the ETag that was read. Otherwise the current
+    object is read again, the entries of this store's changed users are put
+    over it, leaving every other user as the other writer stored it, and the
+    write is tried again (S3Manager.update_info, CONDITIONAL_WRITE_RETRIES).
+
+    Workers keep committing while a flush is writing: flush takes a copy of
+    the changed documents under the lock and does the S3 requests outside
+    it, and only one flush writes at a time. A checkpoint that comes due
+    while another flush is writing is left to the next commit.
+
+    Attributes:
+        s3_manager (S3Manager): Helper class for S3 read/write operations.
+        json_manager (JsonManager): Creates the entries of new users.
+        bucket (str): S3 bucket name.
+        key (str): S3 object key of the playlist info json.
+        checkpoint_interval (int): Committed users between intermediate flushes, 0 to disable.
+        dirty_users (set): Users whose entries changed since the last flush.
+        writes (int): Number of S3 writes done by this store.
+    """
+    def __init__(self, s3_manager: S3Manager, json_manager: JsonManager, bucket: str = BUCKET_NAME, key: str = PLAYLIST_INFO_FILE_KEY, checkpoint_interval: int = STATE_CHECKPOINT_INTERVAL):
+        """
+        Parameters:
+            s3_manager (S3Manager): Helper class for S3 read/write operations.
+            json_manager (JsonManager): Creates the entries of new users.
+            bucket (str): S3 bucket name.
+            key (str): S3 object key of the playlist info json.
+            checkpoint_interval (int): Committed users between intermediate flushes, 0 to disable.
+        """
+        self.s3_manager = s3_manager
+        self.json_manager = json_manager
+        self.bucket = bucket
+        self.key = key
+        self.checkpoint_interval = checkpoint_interval
+        self.dirty_users: Set[str] = set()
+        self.writes = 0
+        self._data: Dict[str, Any] = {}
+        self._commits_since_flush = 0
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+
+    def load(self) -> Dict[str, Any]:
+        """
+        Load the playlist info json from S3. A missing object is treated as empty.
+        """
+        data = self.s3_manager.load_info(self.bucket, self.key, cache=True)
+        with self._lock:
+            self._data = data or {}
+            self.dirty_users.clear()
+            self._commits_since_flush = 0
+            return self._data
+
+    def checkout(self, user_id: str) -> Dict[str, Dict]:
+        """
+        Return a working copy {user_id: entry} for one user.
+        A new user gets the default structure from JsonManager.
+
+        The copy can be changed freely by the playlist generators; nothing is
+        stored until it is passed to commit.
+        """
+        with self._lock:
+            working = {}
+            entry = self._get_entry(user_id)
+            if entry is None:
+                working = self.json_manager.make_new_user(working, user_id)
+            else:
+                working[user_id] = copy.deepcopy(entry)
+            return working
+
+    def commit(self, user_id: str, working: Dict[str, Dict]) -> bool:
+        """
+        Store a user's working copy if it differs from the stored entry.
+
+        Returns:
+            bool: True if the entry changed.
+        """
+        entry = working[user_id]
+        with self._lock:
+            changed = self._dump(self._get_entry(user_id)) != self._dump(entry)
+            if changed:
+                self._set_entry(user_id, entry)
+                self.dirty_users.add(user_id)
+            self._commits_since_flush += 1
+            checkpoint = self.checkpoint_interval > 0 and self._commits_since_flush >= self.checkpoint_interval
+        if checkpoint:
+            self.flush(wait=False)
+        return changed
+
+    def flush(self, wait: bool = True) -> bool:
+        """
+        Write the document to S3 if any user changed since the last flush.
+
+        Parameters:
+            wait (bool): Wait for a flush that is already writing; otherwise leave the write to it and the next flush.
+
+        Returns:
+            bool: True if the document was written.
+        """
+        if not self._flush_lock.acquire(blocking=wait):
+            return False
+        try:
+            with self._lock:
+                self._commits_since_flush = 0
+                if not self.dirty_users:
+                    return False
+                dirty_users = sorted(self.dirty_users)
+                self.dirty_users.clear()
+                pending = self._snapshot(dirty_users)
+            logger.info("Saving playlist info for %d changed user(s).", len(dirty_users))
+            try:
+                written = self._write(pending)
+            except Exception:
+                with self._lock:
+                    self.dirty_users.update(dirty_users)
+                raise
+            with self._lock:
+                self._adopt(written)
+                self.writes += 1
+            return True
+        finally:
+            self._flush_lock.release()
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the stored entry of a user, or None.
+        """
+        with self._lock:
+            return self._get_entry(user_id)
+
+    def preload(self, user_ids: Iterable[str]):
+        """
+        Prepare the entries of the given users. The whole document is already
+        in memory, so this does nothing; sharded stores load shards here.
+        """
+        pass
+
+    def _get_entry(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self._data.get(user_id)
+
+    def _set_entry(self, user_id: str, entry: Dict[str, Any]):
+        self._data[user_id] = entry
+
+    def _merge(self, key: str, stored: Optional[Dict[str, Any]], local: Dict[str, Any], user_ids: List[str]) -> Dict[str, Any]:
+        """
+        Put the entries of the given users from local over a document that
+        another writer changed. With stored being local itself (nobody else
+        wrote), it is returned as it is.
+        """
+        if stored is local:
+            return local
+        merged = stored or {}
+        merged.update({user_id: local[user_id] for user_id in user_ids})
+        logger.info("%s was changed by another run; merged %d changed user(s) into it.", key, len(user_ids))
+        return merged
+
+    def _snapshot(self, dirty_users: List[str]) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Copy what flush writes, under the lock. Entries are replaced, never
+        changed in place, so a shallow copy of the document is enough.
+        """
+        return dict(self._data), dirty_users
+
+    def _write(self, pending: Tuple[Dict[str, Any], List[str]]) -> Dict[str, Any]:
+        local, dirty_users = pending
+        return self.s3_manager.update_info(
+            self.bucket,
+            self.key,
+            lambda stored: self._merge(self.key, stored, local, dirty_users),
+            data=local,
+            etag=self.s3_manager.etag(self.bucket, self.key)
+        )
+
+    def _adopt(self, written: Dict[str, Any]):
+        """
+        Take the written document as the stored one, under the lock, keeping
+        the users that changed again while it was written.
+        """
+        written.update({user_id: self._data[user_id] for user_id in self.dirty_users})
+        self._data = written
+
+    def _dump(self, entry: Optional[Dict[str, Any]]) -> str:
+        return json.dumps(entry, sort_keys=True)
+
+
+class ShardedPlaylistStateStore(PlaylistStateStore):
+    """
+    PlaylistStateStore for the 'sharded' STATE_LAYOUT.
+
+    Users are spread over hash buckets (JsonManager.shard_of), each stored as
+    its own object under PLAYLIST_INFO_SHARD_PREFIX, and manifest.json lists
+    the buckets that exist. Only the manifest is read on load; a bucket is
+    read the first time one of its users is needed, and flush only writes the
+    buckets of changed users (plus the manifest when a bucket was added).
+    """
+    def __init__(self, s3_manager: S3Manager, json_manager: JsonManager, bucket: str = BUCKET_NAME, prefix: str = PLAYLIST_INFO_SHARD_PREFIX, shard_count: int = STATE_SHARD_COUNT, checkpoint_interval: int = STATE_CHECKPOINT_INTERVAL):
+        """
+        Parameters:
+            s3_manager (S3Manager): Helper class for S3 read/write operations.
+            json_manager (JsonManager): Creates the entries of new users and names the shards.
+            bucket (str): S3 bucket name.
+            prefix (str): S3 key prefix of the shards and the manifest.
+            shard_count (int): Number of hash buckets for a layout without manifest yet.
+            checkpoint_interval (int): Committed users between intermediate flushes, 0 to disable.
+        """
+        super().__init__(s3_manager, json_manager, bucket, json_manager.manifest_key(prefix), checkpoint_interval)
+        self.prefix = prefix
+        self.shard_count = shard_count
+        self._manifest: Dict[str, Any] = {}
+        self._shards: Dict[str, Dict[str, Any]] = {}
+
+    def load(self) -> Dict[str, Any]:
+        """
+        Load only the manifest. The shard count recorded there wins over the
+        configured one, so existing users keep their buckets.
+        """
+        manifest = self.s3_manager.load_info(self.bucket, self.key, cache=True)
+        with self._lock:
+            self._manifest = manifest or self.json_manager.make_manifest([], self.shard_count)
+            self.shard_count = self._manifest.get("shard_count") or self.shard_count
+            self._shards = {}
+            self.dirty_users.clear()
+            self._commits_since_flush = 0
+            return self._manifest
+
+    def preload(self, user_ids: Iterable[str]):
+        """
+        Read the buckets of the given users concurrently, skipping buckets
+        that are already loaded or do not exist yet.
+        """
+        with self._lock:
+            existing = set(self._manifest.get("shards", []))
+            wanted = {self.json_manager.shard_of(user_id, self.shard_count) for user_id in user_ids}
+            missing = [shard_id for shard_id in sorted(wanted) if shard_id not in self._shards and shard_id in existing]
+        loaded = self.s3_manager.load_many(self.bucket, [self.json_manager.shard_key(self.prefix, shard_id) for shard_id in missing], cache=True)
+        with self._lock:
+            for shard_id in missing:
+                self._shards.setdefault(shard_id, loaded.get(self.json_manager.shard_key(self.prefix, shard_id)) or {})
+
+    def _shard(self, user_id: str) -> Dict[str, Any]:
+        shard_id = self.json_manager.shard_of(user_id, self.shard_count)
+        if shard_id not in self._shards:
+            data = None
+            if shard_id in self._manifest.get("shards", []):
+                data = self.s3_manager.load_info(self.bucket, self.json_manager.shard_key(self.prefix, shard_id), cache=True)
+            self._shards[shard_id] = data or {}
+        return self._shards[shard_id]
+
+    def _get_entry(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self._shard(user_id).get(user_id)
+
+    def _set_entry(self, user_id: str, entry: Dict[str, Any]):
+        self._shard(user_id)[user_id] = entry
+
+    def _snapshot(self, dirty_users: List[str]) -> Dict[str, Tuple[Dict[str, Any], List[str]]]:
+        dirty_shards: Dict[str, List[str]] = {}
+        for user_id in dirty_users:
+            dirty_shards.setdefault(self.json_manager.shard_of(user_id, self.shard_count), []).append(user_id)
+        return {shard_id: (dict(self._shards[shard_id]), user_ids) for shard_id, user_ids in dirty_shards.items()}
+
+    def _write(self, pending: Dict[str, Tuple[Dict[str, Any], List[str]]]) -> Tuple[Dict[str, Dict[str, Any]], Optional[Dict[str, Any]]]:
+        def write_shard(shard_id: str) -> Dict[str, Any]:
+            key = self.json_manager.shard_key(self.prefix, shard_id)
+            local, user_ids = pending[shard_id]
+            return self.s3_manager.update_info(
+                self.bucket,
+                key,
+                lambda stored: self._merge(key, stored, local, user_ids),
+                indent=None,
+                data=local,
+                etag=self.s3_manager.etag(self.bucket, key)
+            )
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.s3_manager.max_workers, len(pending)))) as executor:
+            written = dict(zip(pending, executor.map(write_shard, pending)))
+
+        # Only flush changes the manifest, and flushes write one at a time.
+        manifest = None
+        if not set(pending) <= set(self._manifest.get("shards", [])):
+            def update_manifest(stored: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+                stored_shards = set((stored or {}).get("shards", []))
+                if stored_shards.issuperset(pending):
+                    return None
+                return self.json_manager.make_manifest(stored_shards | set(pending), self.shard_count)
+            manifest = self.s3_manager.update_info(self.bucket, self.key, update_manifest)
+        return written, manifest
+
+    def _adopt(self, written: Tuple[Dict[str, Dict[str, Any]], Optional[Dict[str, Any]]]):
+        shards, manifest = written
+        for shard_id, shard in shards.items():
+            local = self._shards[shard_id]
+            shard.update({user_id: local[user_id] for user_id in self.dirty_users if user_id in local})
+            self._shards[shard_id] = shard
+        self._manifest = manifest or self._manifest
+
+
+def make_state_store(s3_manager: S3Manager, json_manager: JsonManager) -> PlaylistStateStore:
+    """
+    Create the state store for the configured STATE_LAYOUT.
+    """
+    if STATE_LAYOUT == 'sharded':
+        return ShardedPlaylistStateStore(s3_manager, json_manager)
+    return PlaylistStateStore(s3_manager, json_manager)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+import time
+from settings import ADAPTIVE_REFRESH, ADAPTIVE_REFRESH_MAX_FACTOR, REFRESH_SLACK_SECONDS, TERM_REFRESH_INTERVALS
+from typing import Any, Callable, Dict, List, Optional
+
+'''
+Playlist kinds with their own schedules, named after the entry's uri maps.
+'''
+KIND_TOP_TRACKS: str = "current_user_top_tracks_uris"
+KIND_TOP_ARTISTS_TRACKS: str = "artist_top_tracks_uris"
+TERMS = ["short_term", "medium_term", "long_term"]
+
+class RefreshSchedule:
+    """
+    Decides which of a user's playlists are due for a refresh.
+
+    Every term has its own interval (TERM_REFRESH_INTERVALS). The last run of
+    every playlist is kept in the user's entry under "refresh":
+
+        {"current_user_top_tracks_uris": {"short_term": {"last_run": 1700000000, "unchanged_runs": 2}}, ...}
+
+    A playlist that has no recorded run, or no playlist URI yet, is always due.
+
+    With adaptive=True the interval of a playlist grows with the number of
+    runs in a row that did not change it (doubling per run, at most
+    max_factor times the configured interval) and falls back to the configured
+    interval as soon as it changes again.
+    """
+    def __init__(self, intervals: Optional[Dict[str, int]] = None, adaptive: bool = ADAPTIVE_REFRESH, max_factor: int = ADAPTIVE_REFRESH_MAX_FACTOR, slack: int = REFRESH_SLACK_SECONDS, clock: Callable[[], float] = time.time):
+        """
+        Parameters:
+            intervals (dict | None): Seconds between refreshes per term; TERM_REFRESH_INTERVALS if None.
+                                     Terms that are not listed are refreshed on every run.
+            adaptive (bool): Lengthen the interval of playlists that rarely change.
+            max_factor (int): Largest multiple of the configured interval with adaptive=True.
+            slack (int): Seconds a run may come early and still count as due, so that
+                         a daily schedule is not skipped when it fires a little early.
+            clock (Callable): Returns the current UNIX time. Replaceable in tests.
+        """
+        self.intervals = TERM_REFRESH_INTERVALS if intervals is None else intervals
+        self.adaptive = adaptive
+        self.max_factor = max(1, max_factor)
+        self.slack = slack
+        self.clock = clock
+
+    def interval(self, term: str, unchanged_runs: int = 0) -> float:
+        """
+        Return the seconds between refreshes of a playlist of the given term.
+        """
+        interval = self.intervals.get(term, 0)
+        if self.adaptive and unchanged_runs > 0:
+            interval *= min(2 ** unchanged_runs, self.max_factor)
+        return interval
+
+    def due_terms(self, entry: Optional[Dict[str, Any]], kind: str) -> List[str]:
+        """
+        Return the terms of a playlist kind that are due in a user's entry.
+        A new user (entry None) is due for every term.
+        """
+        if entry is None:
+            return list(TERMS)
+        now = self.clock()
+        schedule = entry.get("refresh", {}).get(kind, {})
+        due = []
+        for term, playlist_uri in entry.get(kind, {}).items():
+            last = schedule.get(term)
+            if not playlist_uri or not last:
+                due.append(term)
+            elif now - last.get("last_run", 0) >= self.interval(term, last.get("unchanged_runs", 0)) - self.slack:
+                due.append(term)
+        return due
+
+    def has_due_work(self, entry: Optional[Dict[str, Any]]) -> bool:
+        """
+        Check whether any playlist of a user's entry is due.
+        """
+        return any(self.due_terms(entry, kind) for kind in (KIND_TOP_TRACKS, KIND_TOP_ARTISTS_TRACKS))
+
+    def record(self, entry: Dict[str, Any], kind: str, term: str, changed: bool):
+        """
+        Record a refresh of a playlist in a user's entry.
+
+        Parameters:
+            changed (bool): Whether the refresh changed the playlist's tracks.
+        """
+        schedule = entry.setdefault("refresh", {}).setdefault(kind, {})
+        previous = schedule.get(term, {})
+        schedule[term] = {
+            "last_run": int(self.clock()),
+            "unchanged_runs": 0 if changed else previous.get("unchanged_runs", 0) + 1
+        }
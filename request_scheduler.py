@@ -0,0 +1,394 @@
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from settings import SPOTIFY_MAX_RETRIES, SPOTIFY_MAX_RETRY_AFTER_SECONDS, SPOTIFY_REQUESTS_PER_SECOND, SPOTIFY_REQUEST_BURST
+from tracing import tracer
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+'''
+Request priorities; lower runs first. A retried request is moved behind
+the first attempts of the same kind by PRIORITY_RETRY.
+'''
+PRIORITY_READ: int = 0
+PRIORITY_WRITE: int = 1
+PRIORITY_RETRY: int = 2
+
+'''
+spotipy methods that change data on Spotify. Every other method is a read.
+'''
+WRITE_METHODS = frozenset([
+    "user_playlist_create",
+    "playlist_change_details",
+    "playlist_add_items",
+    "playlist_replace_items",
+    "playlist_reorder_items",
+    "playlist_remove_all_occurrences_of_items",
+    "playlist_remove_specific_occurrences_of_items",
+])
+
+class RequestScheduler:
+    """
+    Schedules the Spotify Web API requests of one owner's application.
+
+    Spotify rate-limits every application separately, so every owner gets
+    one scheduler shared by all of its users' threads. A request first takes
+    a token from a token bucket (rate requests per second, at most burst
+    at once). Waiting requests are served by priority: reads before writes,
+    and retries after first attempts.
+
+    A 429 response pauses the whole owner for its Retry-After seconds, since
+    every further request would be throttled as well, and the request is
+    retried up to max_retries times. Other owners are not affected.
+
+    Coroutines of the async client (call_async) wait in the same queue and
+    take tokens from the same bucket as threads, without blocking their
+    event loop.
+
+    Attributes:
+        calls (int): Requests sent.
+        throttles (int): 429 responses received.
+        retries (int): Requests sent again after a 429.
+        wait_seconds (float): Total time requests waited for their turn.
+    """
+    def __init__(self, rate: float = SPOTIFY_REQUESTS_PER_SECOND, burst: int = SPOTIFY_REQUEST_BURST, max_retries: int = SPOTIFY_MAX_RETRIES, max_retry_after: float = SPOTIFY_MAX_RETRY_AFTER_SECONDS, clock: Callable[[], float] = time.monotonic):
+        """
+        Parameters:
+            rate (float): Requests per second allowed on average.
+            burst (int): Requests allowed at once after a quiet period.
+            max_retries (int): Retries of a request answered with 429.
+            max_retry_after (float): Longest Retry-After that is waited for; a longer
+                                     one raises the 429 error instead.
+            clock (Callable): Monotonic time in seconds. Replaceable in tests.
+        """
+        self.rate = max(rate, 0.001)
+        self.burst = max(1, burst)
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.clock = clock
+        self.calls = 0
+        self.throttles = 0
+        self.retries = 0
+        self.wait_seconds = 0.0
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._waiting: List[Tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self, now: float):
+        self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority: int = PRIORITY_READ):
+        """
+        Block until a request of the given priority may be sent.
+        """
+        start = self.clock()
+        ticket = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    acquired, timeout = self._try_acquire(ticket)
+                    if acquired:
+                        break
+                    self._condition.wait(timeout)
+            finally:
+                self._leave(ticket, start)
+
+    async def acquire_async(self, priority: int = PRIORITY_READ):
+        """
+        Wait until a request of the given priority may be sent, sleeping on
+        the event loop instead of blocking it. A coroutine that is not first
+        in line checks again every 1 / rate seconds (at most 50 ms).
+        """
+        start = self.clock()
+        ticket = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+        try:
+            while True:
+                with self._condition:
+                    acquired, timeout = self._try_acquire(ticket)
+                if acquired:
+                    break
+                await asyncio.sleep(min(0.05, 1 / self.rate) if timeout is None else timeout)
+        finally:
+            with self._condition:
+                self._leave(ticket, start)
+
+    def _try_acquire(self, ticket: Tuple[int, int]) -> Tuple[bool, Optional[float]]:
+        """
+        Take a token for ticket if it is first in line and one is available.
+        Called with the condition held.
+
+        Returns:
+            (True, None) when acquired, otherwise (False, seconds until the
+            ticket may try again, or None while other tickets are ahead).
+        """
+        now = self.clock()
+        self._refill(now)
+        if self._waiting[0] != ticket:
+            return False, None
+        timeout = self._blocked_until - now
+        if timeout > 0:
+            return False, timeout
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True, None
+        return False, (1 - self._tokens) / self.rate
+
+    def _leave(self, ticket: Tuple[int, int], start: float):
+        """
+        Remove ticket from the queue. Called with the condition held.
+        """
+        self._waiting.remove(ticket)
+        heapq.heapify(self._waiting)
+        # Wake the next request in line.
+        self._condition.notify_all()
+        self.wait_seconds += self.clock() - start
+
+    def throttle(self, retry_after: float):
+        """
+        Pause all requests of this owner for retry_after seconds.
+        """
+        with self._condition:
+            now = self.clock()
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+            self._tokens = 0.0
+            self._updated = now
+            self.throttles += 1
+            self._condition.notify_all()
+        tracer.count("spotify.throttles")
+
+    def retry_after(self, error: Exception) -> float:
+        """
+        Return the Retry-After of a 429 error in seconds, 1 if it is missing.
+        """
+        headers = getattr(error, "headers", None) or {}
+        try:
+            return max(0.0, float(headers.get("Retry-After", 1)))
+        except (TypeError, ValueError):
+            return 1.0
+
+    def call(self, function: Callable[..., Any], *args: Any, priority: int = PRIORITY_READ, **kwargs: Any) -> Any:
+        """
+        Call a Spotify API function when the scheduler allows it.
+
+        Raises:
+            SpotifyException: The last 429 error after max_retries retries, a 429
+                              with a Retry-After above max_retry_after, or any other error.
+        """
+        attempt = 0
+        while True:
+            self.acquire(priority + (PRIORITY_RETRY if attempt else 0))
+            with self._condition:
+                self.calls += 1
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+                attempt += 1
+
+    async def call_async(self, function: Callable[..., Awaitable[Any]], *args: Any, priority: int = PRIORITY_READ, **kwargs: Any) -> Any:
+        """
+        Await a coroutine function of the async client when the scheduler
+        allows it. Same retries and errors as call.
+        """
+        attempt = 0
+        while True:
+            await self.acquire_async(priority + (PRIORITY_RETRY if attempt else 0))
+            with self._condition:
+                self.calls += 1
+            try:
+                return await function(*args, **kwargs)
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+                attempt += 1
+
+    def _should_retry(self, error: Exception, attempt: int) -> bool:
+        """
+        Decide whether a failed request is sent again. A 429 that is retried
+        pauses the owner first.
+        """
+        # spotipy (and AsyncSpotify) raise SpotifyException with the response's status and headers.
+        if getattr(error, "http_status", None) != 429 or attempt >= self.max_retries:
+            return False
+        retry_after = self.retry_after(error)
+        if retry_after > self.max_retry_after:
+            return False
+        logger.warning("Rate limited by Spotify, pausing for %.1f s (retry %d).", retry_after, attempt + 1)
+        self.throttle(retry_after)
+        with self._condition:
+            self.retries += 1
+        return True
+
+    def reset_stats(self):
+        """
+        Set the metrics back to zero, e.g. at the start of a run.
+        """
+        with self._condition:
+            self.calls = 0
+            self.throttles = 0
+            self.retries = 0
+            self.wait_seconds = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the scheduler's metrics.
+        """
+        with self._condition:
+            return {
+                "calls": self.calls,
+                "throttles": self.throttles,
+                "retries": self.retries,
+                "wait_seconds": round(self.wait_seconds, 3),
+            }
+
+
+class SchedulerPool:
+    """
+    Keeps one RequestScheduler per owner.
+    """
+    def __init__(self, scheduler_factory: Callable[[], RequestScheduler] = RequestScheduler):
+        """
+        Parameters:
+            scheduler_factory (Callable): Creates the scheduler of a new owner.
+        """
+        self.scheduler_factory = scheduler_factory
+        self._schedulers: Dict[str, RequestScheduler] = {}
+        self._lock = threading.Lock()
+
+    def get(self, owner_id: str) -> RequestScheduler:
+        """
+        Return the owner's scheduler, creating it on first use.
+        """
+        with self._lock:
+            scheduler = self._schedulers.get(owner_id)
+            if scheduler is None:
+                scheduler = self.scheduler_factory()
+                self._schedulers[owner_id] = scheduler
+            return scheduler
+
+    def reset_stats(self):
+        """
+        Set the metrics of every owner's scheduler back to zero.
+        """
+        with self._lock:
+            schedulers = list(self._schedulers.values())
+        for scheduler in schedulers:
+            scheduler.reset_stats()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Return the metrics of every owner's scheduler.
+        """
+        with self._lock:
+            schedulers = dict(self._schedulers)
+        return {owner_id: scheduler.stats() for owner_id, scheduler in schedulers.items()}
+
+
+class ScheduledSpotify:
+    """
+    Wraps a Spotify client so that every API method goes through a RequestScheduler.
+
+    The wrapper has the same methods as the client; writes (WRITE_METHODS)
+    are scheduled after reads. Attributes that are not methods are returned
+    unchanged. Every call is traced as a 'spotify.<method>' span, including
+    the time it waited for the scheduler.
+
+    A read-only wrapper (plan mode) refuses every write method, so a bug in
+    the planning path cannot change a playlist.
+
+    gather() sends a batch of independent calls at once: as coroutines on the
+    event loop of an async client (BlockingSpotify), otherwise on a thread pool.
+
+    Attributes:
+        calls (int): Number of API calls sent through this wrapper.
+    """
+    def __init__(self, sp: Any, scheduler: RequestScheduler, read_only: bool = False):
+        """
+        Parameters:
+            sp (spotipy.Spotify): The client to wrap.
+            scheduler (RequestScheduler): The scheduler of the client's owner.
+            read_only (bool): Raise PermissionError instead of sending a write.
+        """
+        self.sp = sp
+        self.scheduler = scheduler
+        self.read_only = read_only
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self.sp, name)
+        if not callable(attribute):
+            return attribute
+        priority = self._check(name)
+
+        def scheduled(*args: Any, **kwargs: Any) -> Any:
+            with self._lock:
+                self.calls += 1
+            with tracer.span(f"spotify.{name}"):
+                return self.scheduler.call(attribute, *args, priority=priority, **kwargs)
+        return scheduled
+
+    def _check(self, name: str) -> int:
+        if self.read_only and name in WRITE_METHODS:
+            raise PermissionError(f"{name} is a write and this Spotify client is read-only.")
+        return PRIORITY_WRITE if name in WRITE_METHODS else PRIORITY_READ
+
+    def gather(self, calls: Sequence[Tuple[str, Sequence[Any], Dict[str, Any]]], max_workers: int) -> List[Any]:
+        """
+        Send several independent API calls concurrently, each through the scheduler.
+
+        Parameters:
+            calls (list): (method name, args, kwargs) of every call.
+            max_workers (int): Most calls in flight at once.
+
+        Returns:
+            list: The result of every call, in the order of calls.
+
+        Raises:
+            Exception: The error of the first failed call, after all calls finished.
+        """
+        priorities = [self._check(name) for name, _, _ in calls]
+        with self._lock:
+            self.calls += len(calls)
+        if not calls:
+            return []
+
+        gather = getattr(self.sp, "gather", None)
+        if gather is None:
+            def call(index: int) -> Any:
+                name, args, kwargs = calls[index]
+                with tracer.span(f"spotify.{name}"):
+                    return self.scheduler.call(getattr(self.sp, name), *args, priority=priorities[index], **kwargs)
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(calls)))) as executor:
+                futures = [executor.submit(tracer.wrap(call), index) for index in range(len(calls))]
+            return [future.result() for future in futures]
+
+        # The coroutines run on the event loop thread, so their spans are
+        # recorded here, in the thread (and under the tags) of the caller.
+        durations: List[Tuple[str, float]] = []
+
+        async def scheduled(name: str, method: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+            start = tracer.clock()
+            try:
+                return await self.scheduler.call_async(method, *args, priority=self._check(name), **kwargs)
+            finally:
+                durations.append((name, (tracer.clock() - start) * 1000))
+        try:
+            return gather(calls, max_workers, wrap=scheduled)
+        finally:
+            for name, elapsed_ms in durations:
+                tracer.record(f"spotify.{name}", elapsed_ms)
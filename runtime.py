@@ -0,0 +1,178 @@
+from __future__ import annotations
+import atexit
+import threading
+from settings import ARTIST_FETCH_WORKERS, MAX_WORKERS_PER_OWNER, SPOTIFY_CLIENT, TOKEN_BACKEND
+from typing import Any, Callable, Dict, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    import requests
+    from refresh_schedule import RefreshSchedule
+    from s3_manager import S3Manager
+    from json_manager import JsonManager
+    from token_manager import TokenManager
+
+# Objects that live as long as the Lambda container.
+#
+# AWS Lambda keeps module globals between invocations of a warm container.
+# Everything created here is built on the first invocation and reused by the
+# following ones: the boto3 client (inside S3Manager, together with its
+# ETag-validated JSON cache), the managers, the per-owner SpotifyOAuth
+# clients (inside TokenManager), the per-owner request schedulers (so a
+# Retry-After pause carries over), the artist cache and one pooled
+# requests.Session per owner.
+#
+# Importing this module is cheap on purpose: the project modules, boto3,
+# requests and spotipy are imported by the functions below when they are
+# first needed, so a cold start only pays for what the invocation uses
+# (a coordinator invocation, for example, never imports spotipy).
+
+_lock = threading.Lock()
+_sessions: Dict[str, requests.Session] = {}
+_components: Optional[Dict[str, Any]] = None
+_event_loop_thread: Optional[Any] = None
+
+def get_session(owner_id: str) -> requests.Session:
+    """
+    Return the owner's pooled HTTP session, creating it on first use.
+
+    All users of an owner share the session's connection pool, so warm
+    invocations and concurrent users reuse open TLS connections to Spotify.
+    The retry policy matches spotipy's default session, except that 429
+    responses are left to the RequestScheduler instead of sleeping here.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    with _lock:
+        session = _sessions.get(owner_id)
+        if session is None:
+            session = requests.Session()
+            retry = Retry(
+                total=3,
+                connect=None,
+                read=False,
+                allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+                status=3,
+                backoff_factor=0.3,
+                status_forcelist=(500, 502, 503, 504)
+            )
+            adapter = HTTPAdapter(
+                pool_connections=2,
+                pool_maxsize=max(1, MAX_WORKERS_PER_OWNER * ARTIST_FETCH_WORKERS),
+                max_retries=retry
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[owner_id] = session
+        return session
+
+def get_event_loop_thread() -> Any:
+    """
+    Return the event loop and aiohttp session shared by all async clients,
+    starting them on first use.
+    """
+    global _event_loop_thread
+    from async_spotify import EventLoopThread
+
+    with _lock:
+        if _event_loop_thread is None:
+            _event_loop_thread = EventLoopThread()
+            atexit.register(_event_loop_thread.close)
+        return _event_loop_thread
+
+def make_spotify(owner_id: str, token_info: Dict[str, Any]) -> Any:
+    """
+    Build a Spotify client for a prepared access token: a spotipy client on the
+    owner's pooled session, or with SPOTIFY_CLIENT = 'async' an AsyncSpotify
+    client on the shared event loop behind a synchronous facade.
+    """
+    if SPOTIFY_CLIENT == 'async':
+        from async_spotify import AsyncSpotify, BlockingSpotify
+        loop_thread = get_event_loop_thread()
+        # Rate limits are handled by the RequestScheduler around the client.
+        return BlockingSpotify(AsyncSpotify(token_info['access_token'], loop_thread.session, max_retries=0), loop_thread)
+
+    import spotipy
+    return spotipy.Spotify(auth=token_info['access_token'], requests_session=get_session(owner_id))
+
+def make_token_manager(s3_manager: S3Manager, json_manager: JsonManager) -> TokenManager:
+    """
+    Build the TokenManager of the configured TOKEN_BACKEND, refreshing tokens
+    on the owners' pooled sessions.
+    """
+    from token_manager import TokenManager
+
+    token_vault = None
+    if TOKEN_BACKEND == 'vault':
+        from token_vault import TokenVault
+        token_vault = TokenVault(s3_manager, json_manager)
+    return TokenManager(s3_manager, token_vault=token_vault, session_factory=get_session)
+
+def use_components(components: Optional[Dict[str, Any]]):
+    """
+    Replace the components returned by get_components, e.g. with ones built by
+    build_components on a fake backend (see benchmarks/). None builds them
+    again on the next call.
+    """
+    global _components
+    with _lock:
+        _components = components
+
+def get_components() -> Dict[str, Any]:
+    """
+    Return the managers of the workflow, building them once per container.
+
+    Returns:
+        dict: s3_manager, json_manager, playlist_manager, artist_tracks_cache,
+              spotify_top_tracks, spotify_top_artists_tracks and spotify_main.
+    """
+    global _components
+    with _lock:
+        if _components is None:
+            _components = build_components()
+        return _components
+
+def build_components(s3_client: Any = None, spotify_factory: Optional[Callable[..., Any]] = None, refresh_schedule: Optional[RefreshSchedule] = None) -> Dict[str, Any]:
+    """
+    Build the managers of the workflow.
+
+    Parameters:
+        s3_client: S3 client for the S3Manager. A new boto3 client if None.
+        spotify_factory: Returns a Spotify client for (owner_id, token_info). make_spotify if None.
+        refresh_schedule (RefreshSchedule | None): Schedule of SpotifyMain. TERM_REFRESH_INTERVALS if None.
+    """
+    from artist_tracks_cache import ArtistTracksCache
+    from json_manager import JsonManager
+    from playlist_manager import PlaylistManager
+    from s3_manager import S3Manager
+    from spotify_main import SpotifyMain
+    from spotify_top_artists_tracks import SpotifyTopArtistsTracks
+    from spotify_top_tracks import SpotifyTopTracks
+    from request_scheduler import SchedulerPool
+
+    s3_manager = S3Manager(client=s3_client)
+    json_manager = JsonManager()
+    playlist_manager = PlaylistManager()
+    artist_tracks_cache = ArtistTracksCache()
+    spotify_top_tracks = SpotifyTopTracks(playlist_manager)
+    spotify_top_artists_tracks = SpotifyTopArtistsTracks(playlist_manager, artist_tracks_cache)
+    spotify_main = SpotifyMain(
+        s3_manager,
+        json_manager,
+        spotify_top_tracks,
+        spotify_top_artists_tracks,
+        spotify_factory=spotify_factory or make_spotify,
+        token_manager=make_token_manager(s3_manager, json_manager),
+        schedulers=SchedulerPool(),
+        refresh_schedule=refresh_schedule
+    )
+    return {
+        "s3_manager": s3_manager,
+        "json_manager": json_manager,
+        "playlist_manager": playlist_manager,
+        "artist_tracks_cache": artist_tracks_cache,
+        "spotify_top_tracks": spotify_top_tracks,
+        "spotify_top_artists_tracks": spotify_top_artists_tracks,
+        "spotify_main": spotify_main,
+    }
+
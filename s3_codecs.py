@@ -0,0 +1,187 @@
+from __future__ import annotations
+import gzip
+import json
+import zlib
+from settings import S3_CODEC, S3_GZIP_LEVEL
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+# Serialization formats of the JSON documents S3Manager stores.
+#
+# The format of a write is chosen by the key suffix (.gz, .msgpack) or, for
+# other keys, by S3_CODEC. It is recorded in the object's ContentType and
+# ContentEncoding, so reads detect it by themselves and objects written in an
+# older format (e.g. indented JSON) stay readable after S3_CODEC changes.
+#
+# orjson and msgpack are optional: orjson speeds up every JSON read when it
+# is installed, and the 'orjson' and 'msgpack' codecs need their package.
+
+GZIP_MAGIC = b"\x1f\x8b"
+MSGPACK_CONTENT_TYPES = frozenset(["application/msgpack", "application/x-msgpack"])
+
+_optional_modules: Dict[str, Any] = {}
+
+def _optional(name: str) -> Any:
+    """
+    Import an optional package once; None if it is not installed.
+    """
+    if name not in _optional_modules:
+        try:
+            _optional_modules[name] = __import__(name)
+        except ImportError:
+            _optional_modules[name] = None
+    return _optional_modules[name]
+
+def loads_json(body: bytes) -> Any:
+    """
+    Parse JSON bytes, with orjson if it is installed.
+    """
+    orjson = _optional("orjson")
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class JsonCodec:
+    """
+    UTF-8 JSON, indented by default so that the files stay easy to edit by hand.
+    """
+    name = "json"
+    content_type = "application/json"
+    content_encoding: Optional[str] = None
+
+    def __init__(self, indent: Optional[int] = 4):
+        """
+        Parameters:
+            indent (int | None): JSON indentation, None for compact JSON.
+        """
+        self.indent = indent
+
+    def encode(self, data: Any) -> bytes:
+        separators = None if self.indent is not None else (',', ':')
+        return json.dumps(data, ensure_ascii=False, indent=self.indent, separators=separators).encode("utf-8")
+
+    def decode(self, body: bytes) -> Any:
+        return loads_json(body)
+
+
+class CompactJsonCodec(JsonCodec):
+    """
+    JSON without whitespace.
+    """
+    name = "compact"
+
+    def __init__(self, indent: Optional[int] = None):
+        super().__init__(None)
+
+
+class GzipJsonCodec(CompactJsonCodec):
+    """
+    Compact JSON compressed with gzip (ContentEncoding: gzip).
+    """
+    name = "gzip"
+    content_encoding = "gzip"
+
+    def encode(self, data: Any) -> bytes:
+        # mtime=0 keeps the output, and so the ETag, identical for identical data.
+        return gzip.compress(super().encode(data), compresslevel=S3_GZIP_LEVEL, mtime=0)
+
+    def decode(self, body: bytes) -> Any:
+        return super().decode(gzip.decompress(body))
+
+
+class OrjsonCodec(CompactJsonCodec):
+    """
+    Compact JSON written by orjson. The output is plain JSON.
+    """
+    name = "orjson"
+
+    def encode(self, data: Any) -> bytes:
+        orjson = _optional("orjson")
+        if orjson is None:
+            raise ImportError("S3_CODEC 'orjson' needs the orjson package.")
+        return orjson.dumps(data)
+
+
+class MsgpackCodec:
+    """
+    MessagePack, a binary format. Files in this format cannot be edited by hand.
+    """
+    name = "msgpack"
+    content_type = "application/x-msgpack"
+    content_encoding: Optional[str] = None
+
+    def __init__(self, indent: Optional[int] = None):
+        pass
+
+    def _msgpack(self) -> Any:
+        msgpack = _optional("msgpack")
+        if msgpack is None:
+            raise ImportError("The 'msgpack' codec needs the msgpack package.")
+        return msgpack
+
+    def encode(self, data: Any) -> bytes:
+        return self._msgpack().packb(data, use_bin_type=True)
+
+    def decode(self, body: bytes) -> Any:
+        return self._msgpack().unpackb(body, raw=False)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, CompactJsonCodec, GzipJsonCodec, OrjsonCodec, MsgpackCodec)}
+
+'''
+Key suffixes that select a codec regardless of S3_CODEC.
+'''
+SUFFIX_CODECS = {".gz": "gzip", ".msgpack": "msgpack"}
+
+def get_codec(name: Optional[str] = None, key: Optional[str] = None, indent: Optional[int] = 4) -> Any:
+    """
+    Return the codec for a write: by name, else by the key's suffix, else S3_CODEC.
+
+    indent only applies to the 'json' codec.
+    """
+    if name is None and key is not None:
+        name = next((codec for suffix, codec in SUFFIX_CODECS.items() if key.endswith(suffix)), None)
+    name = name or S3_CODEC
+    if name not in CODECS:
+        raise ValueError(f"Unknown S3 codec '{name}'. Use one of {sorted(CODECS)}.")
+    return CODECS[name](indent)
+
+def decode_body(body: bytes, content_type: Optional[str] = None, content_encoding: Optional[str] = None) -> Any:
+    """
+    Decode an object body written by any codec.
+
+    gzip is recognized by ContentEncoding or by its magic bytes, MessagePack by
+    its ContentType; everything else is JSON.
+    """
+    if content_encoding == "gzip" or body[:2] == GZIP_MAGIC:
+        body = gzip.decompress(body)
+    if is_msgpack(content_type):
+        return MsgpackCodec().decode(body)
+    return loads_json(body)
+
+def decode_chunks(chunks: Iterable[bytes], content_encoding: Optional[str] = None) -> Iterator[bytes]:
+    """
+    Yield the decompressed chunks of a streamed body, which may be gzip-compressed.
+    """
+    chunks = iter(chunks)
+    # Read at least the two bytes of the gzip magic number.
+    first = b""
+    for chunk in chunks:
+        first += chunk
+        if len(first) >= len(GZIP_MAGIC):
+            break
+    if content_encoding != "gzip" and first[:2] != GZIP_MAGIC:
+        yield first
+        yield from chunks
+        return
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    yield decompressor.decompress(first)
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+def is_msgpack(content_type: Optional[str]) -> bool:
+    """
+    Check whether a ContentType marks a MessagePack object.
+    """
+    return (content_type or "").split(";")[0].strip() in MSGPACK_CONTENT_TYPES
@@ -1,7 +1,15 @@
-import json
-import boto3
-from typing import Optional, Dict, Any
+import copy
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable, Iterable, Iterator, Tuple
 from botocore.exceptions import ClientError
+from json_stream import iter_object_items
+from s3_codecs import decode_body, decode_chunks, get_codec, is_msgpack
+from settings import S3_CLIENT_LIBRARY, STREAM_CHUNK_BYTES, CONDITIONAL_WRITE_RETRIES
+from spotify_error import ConflictError
+from tracing import tracer
 
 class S3Manager:
     """
@@ -10,37 +18,260 @@ class S3Manager:
     - users name json file (USERS_FILE_KEY)
     - playlist uris data json file (PLAYLIST_INFO_FILE_KEY)
     - token cache files (.cache-{user_id})
+
+    Objects loaded with cache=True are kept parsed in memory together with
+    their ETag. Loading them again (e.g. in a warm Lambda container) sends a
+    conditional GET (IfNoneMatch) and reuses the parsed copy when S3 answers
+    304 Not Modified.
+
+    Objects are written with the codec selected by s3_codecs.get_codec
+    (S3_CODEC or the key suffix) and read in whatever format they were written.
+
+    The ETag of every object loaded or saved is remembered (etag).
+    update_info changes an object with optimistic concurrency: it writes
+    only if the object is unchanged since it was read (If-Match on its ETag,
+    If-None-Match for a new object) and starts over when it was changed.
+
+    Requests are traced as 's3.get' and 's3.put' spans, with the bytes read
+    and written and the ETag cache hits in the tracer's counters.
     """
-    def __init__(self):
+    def __init__(self, max_workers: int = 8, client: Any = None):
         '''
-        Using boto3 client for S3 operations inside AWS Lambda
+        Using boto3 client for S3 operations inside AWS Lambda.
+        max_workers bounds the concurrent requests of load_many and save_many.
+        client replaces the boto3 client, e.g. with the local stand-in of benchmarks/.
         '''
-        self.s3 = boto3.client("s3")
+        self.s3 = client if client is not None else self._make_client()
+        self.max_workers = max_workers
+        self._cache: Dict[Tuple[str, str], Tuple[str, Any]] = {}
+        self._etags: Dict[Tuple[str, str], str] = {}
+        self._cache_lock = threading.Lock()
 
-    def load_info(self, bucket_name: str, key: str) -> Optional[Dict[str, Any]]:
+    def _make_client(self):
+        """
+        Create the S3 client. boto3 is imported here, not at module level, so
+        that importing this module stays cheap. With S3_CLIENT_LIBRARY =
+        'botocore' the client is created by botocore directly, which skips
+        importing boto3 and s3transfer; the client is the same.
+        """
+        if S3_CLIENT_LIBRARY == 'botocore':
+            import botocore.session
+            return botocore.session.get_session().create_client("s3")
+        import boto3
+        return boto3.client("s3")
+
+    def load_info(self, bucket_name: str, key: str, cache: bool = False) -> Optional[Dict[str, Any]]:
         """
         Loads a JSON file from S3 and returns it as a Python dict.
-        Returns an empty dict if the file does not exist.
+        Returns None if the file does not exist.
+
+        With cache=True the parsed object is kept with its ETag and only
+        downloaded again when it changed in S3. The caller always gets its
+        own copy.
         """
+        with self._cache_lock:
+            cached = self._cache.get((bucket_name, key)) if cache else None
         try:
-            obj = self.s3.get_object(Bucket=bucket_name, Key=key)
-            data = obj["Body"].read().decode("utf-8")
-            return json.loads(data)
+            with tracer.span("s3.get"):
+                if cached is not None:
+                    obj = self.s3.get_object(Bucket=bucket_name, Key=key, IfNoneMatch=cached[0])
+                else:
+                    obj = self.s3.get_object(Bucket=bucket_name, Key=key)
+                body = obj["Body"].read()
+            tracer.count("s3.bytes_read", len(body))
+            data = decode_body(body, obj.get("ContentType"), obj.get("ContentEncoding"))
         except self.s3.exceptions.NoSuchKey:
             print("No cache found in S3.")
+            with self._cache_lock:
+                self._cache.pop((bucket_name, key), None)
+                self._etags.pop((bucket_name, key), None)
             return None
+        except ClientError as e:
+            if cached is not None and self._is_not_modified(e):
+                tracer.count("s3.cache_hits")
+                with self._cache_lock:
+                    self._etags[(bucket_name, key)] = cached[0]
+                return copy.deepcopy(cached[1])
+            raise
+        if cache:
+            tracer.count("s3.cache_misses")
+        self._remember_etag(bucket_name, key, obj.get("ETag"))
+        if cache and obj.get("ETag"):
+            with self._cache_lock:
+                self._cache[(bucket_name, key)] = (obj["ETag"], copy.deepcopy(data))
+        return data
 
-    def save_info(self, bucket_name: str, key: str, data: dict):
+    def _remember_etag(self, bucket_name: str, key: str, etag: Optional[str]):
+        with self._cache_lock:
+            if etag:
+                self._etags[(bucket_name, key)] = etag
+            else:
+                self._etags.pop((bucket_name, key), None)
+
+    def etag(self, bucket_name: str, key: str) -> Optional[str]:
+        """
+        Return the ETag of an object as last loaded or saved by this manager,
+        None if it is unknown or the object did not exist.
         """
-        Saves a Python dict to S3 as a JSON file.
+        with self._cache_lock:
+            return self._etags.get((bucket_name, key))
+
+    def _is_not_modified(self, error: ClientError) -> bool:
+        code = str(error.response.get("Error", {}).get("Code", ""))
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return code in ("304", "NotModified") or status == 304
+
+    def _is_conflict(self, error: ClientError) -> bool:
+        code = str(error.response.get("Error", {}).get("Code", ""))
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return code in ("PreconditionFailed", "ConditionalRequestConflict") or status in (409, 412)
+
+    def load_versioned(self, bucket_name: str, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Loads a JSON file from S3 together with its ETag.
+        Returns (None, None) if the file does not exist.
+        """
+        try:
+            with tracer.span("s3.get"):
+                obj = self.s3.get_object(Bucket=bucket_name, Key=key)
+                body = obj["Body"].read()
+        except self.s3.exceptions.NoSuchKey:
+            self._remember_etag(bucket_name, key, None)
+            return None, None
+        tracer.count("s3.bytes_read", len(body))
+        self._remember_etag(bucket_name, key, obj.get("ETag"))
+        return decode_body(body, obj.get("ContentType"), obj.get("ContentEncoding")), obj.get("ETag")
+
+    def save_info(self, bucket_name: str, key: str, data: dict, indent: Optional[int] = 4, codec: Optional[str] = None, if_match: Optional[str] = None, if_none_match: Optional[str] = None) -> Optional[str]:
+        """
+        Saves a Python dict to S3 as a JSON file and returns the new ETag.
+        Pass indent=None to write compact JSON (only applies to the 'json' codec).
+        Pass codec to override the codec chosen by S3_CODEC and the key suffix.
+
+        Pass if_match (an ETag) to write only if the object is unchanged, or
+        if_none_match='*' to write only if it does not exist yet.
+
+        Raises:
+            ConflictError: If the condition of if_match or if_none_match failed.
         """
+        encoder = get_codec(codec, key, indent)
+        params = {
+            "Bucket": bucket_name,
+            "Key": key,
+            "Body": encoder.encode(data),
+            "ContentType": encoder.content_type
+        }
+        if encoder.content_encoding:
+            params["ContentEncoding"] = encoder.content_encoding
+        if if_match is not None:
+            params["IfMatch"] = if_match
+        if if_none_match is not None:
+            params["IfNoneMatch"] = if_none_match
         try:
-            self.s3.put_object(
-                Bucket=bucket_name,
-                Key=key,
-                Body=json.dumps(data, ensure_ascii=False, indent=4),
-                ContentType="application/json"
-            )
+            with tracer.span("s3.put"):
+                response = self.s3.put_object(**params)
+            tracer.count("s3.bytes_written", len(params["Body"]))
+            self._remember_etag(bucket_name, key, (response or {}).get("ETag"))
+            # Keep a cached object in step with what was just written.
+            with self._cache_lock:
+                if (bucket_name, key) in self._cache:
+                    if response and response.get("ETag"):
+                        self._cache[(bucket_name, key)] = (response["ETag"], copy.deepcopy(data))
+                    else:
+                        del self._cache[(bucket_name, key)]
         except ClientError as e:
+            if (if_match is not None or if_none_match is not None) and self._is_conflict(e):
+                raise ConflictError(key) from e
             print(f"Data could not be saved: {e}")
-            raise
\ No newline at end of file
+            raise
+        return (response or {}).get("ETag")
+
+    def update_info(self, bucket_name: str, key: str, update: Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]], indent: Optional[int] = 4, max_retries: int = CONDITIONAL_WRITE_RETRIES, data: Optional[Dict[str, Any]] = None, etag: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Read a JSON file, change it and write it back, unless it was changed in
+        the meantime; then read it again and repeat, up to max_retries times.
+
+        Parameters:
+            update (Callable): Gets the current data (None if the file does not exist)
+                               and returns the data to write, or None to write nothing.
+                               It may change its argument. It may run several times,
+                               so it must only depend on its argument.
+            data, etag: A version of the file that was already read, with its ETag.
+                        The first attempt starts from it instead of reading the file.
+
+        Returns:
+            dict | None: The data that is now stored.
+
+        Raises:
+            ConflictError: If the file was still being changed after max_retries retries.
+        """
+        attempt = 0
+        while True:
+            if etag is None or attempt > 0:
+                data, etag = self.load_versioned(bucket_name, key)
+            updated = update(data)
+            if updated is None:
+                return data
+            try:
+                if etag is None:
+                    self.save_info(bucket_name, key, updated, indent=indent, if_none_match="*")
+                else:
+                    self.save_info(bucket_name, key, updated, indent=indent, if_match=etag)
+                return updated
+            except ConflictError:
+                if attempt >= max_retries:
+                    raise
+                attempt += 1
+                tracer.count("s3.conflicts")
+                # Back off a little, so that competing writers do not collide again.
+                time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+    def iter_items(self, bucket_name: str, key: str, field: str, chunk_size: int = STREAM_CHUNK_BYTES) -> Iterator[Tuple[str, Any]]:
+        """
+        Stream the (key, value) pairs of the object under a top-level field of
+        a JSON file, e.g. the owners of the users file, without loading the
+        whole file. Pairs are yielded while the body is still downloading.
+        Yields nothing if the file does not exist.
+
+        MessagePack files cannot be streamed and are loaded in one piece.
+        """
+        try:
+            with tracer.span("s3.get"):
+                obj = self.s3.get_object(Bucket=bucket_name, Key=key)
+        except self.s3.exceptions.NoSuchKey:
+            print("No cache found in S3.")
+            return
+        body = obj["Body"]
+        if is_msgpack(obj.get("ContentType")):
+            raw = body.read()
+            tracer.count("s3.bytes_read", len(raw))
+            data = decode_body(raw, obj.get("ContentType"), obj.get("ContentEncoding")) or {}
+            yield from data.get(field, {}).items()
+            return
+
+        def read_chunk() -> bytes:
+            chunk = body.read(chunk_size)
+            tracer.count("s3.bytes_read", len(chunk))
+            return chunk
+        chunks = iter(read_chunk, b"")
+        yield from iter_object_items(decode_chunks(chunks, obj.get("ContentEncoding")), field)
+
+    def load_many(self, bucket_name: str, keys: Iterable[str], cache: bool = False) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Loads several JSON files concurrently.
+        Returns a dict keyed by object key; missing objects map to None.
+        """
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(keys)))) as executor:
+            return dict(zip(keys, executor.map(lambda key: self.load_info(bucket_name, key, cache=cache), keys)))
+
+    def save_many(self, bucket_name: str, items: Dict[str, dict], indent: Optional[int] = 4):
+        """
+        Saves several Python dicts to S3 concurrently, keyed by object key.
+        """
+        if not items:
+            return
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(items)))) as executor:
+            list(executor.map(lambda item: self.save_info(bucket_name, item[0], item[1], indent=indent), items.items()))
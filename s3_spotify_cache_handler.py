@@ -74,6 +74,9 @@ class S3SpotifyCacheHandler(CacheHandler):
         Notes:
             AWS Lambda instances are ephemeral. Saving the token to S3 ensures
             future Lambda executions retain the same authenticated session.
+            Nothing is written when the token did not change.
         """
+        if token_info == self.cache_data:
+            return
         self.cache_data = token_info
         self.s3_manager.save_info(self.bucket, self.key, token_info)
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+from typing import Dict
 
 '''
 Number of top tracks to fetch for each user.
@@ -10,6 +11,178 @@ Number of top artists to fetch for each user.
 '''
 TOP_ARTIST_NUM: int = 20
 
+'''
+Maximum number of users processed at the same time in one run.
+Set to 1 to process users one after another.
+'''
+MAX_WORKERS: int = 4
+
+'''
+Maximum number of users of the same owner processed at the same time.
+Every owner has its own Spotify application and rate limit, so this keeps
+one owner with many users from exhausting its application's quota.
+'''
+MAX_WORKERS_PER_OWNER: int = 2
+
+'''
+Number of threads used to fetch artists' top tracks for one user.
+'''
+ARTIST_FETCH_WORKERS: int = 8
+
+'''
+Number of requests of one user sent at the same time by the planning stage
+(user_plan.UserPlanner): the reads of both playlist generators and the
+writes of the user's playlists. Every request still goes through the
+owner's RequestScheduler, so this does not raise the request rate.
+'''
+PLAN_WORKERS: int = 6
+
+'''
+Market (ISO 3166-1 alpha-2 country code) used for artists' top tracks.
+'''
+ARTIST_TOP_TRACKS_MARKET: str = 'US'
+
+'''
+Lifetime in seconds of a cached artist's top tracks, and the maximum number
+of artists kept in the shared cache.
+'''
+ARTIST_CACHE_TTL_SECONDS: int = 24 * 60 * 60
+ARTIST_CACHE_MAX_ENTRIES: int = 5000
+
+'''
+Rate limit of the Spotify Web API requests of one owner's application
+(see request_scheduler.py): average requests per second and requests
+allowed at once. A 429 response pauses the owner for its Retry-After and
+the request is retried at most SPOTIFY_MAX_RETRIES times; a Retry-After
+longer than SPOTIFY_MAX_RETRY_AFTER_SECONDS fails the request instead.
+'''
+SPOTIFY_REQUESTS_PER_SECOND: float = 10.0
+SPOTIFY_REQUEST_BURST: int = 20
+SPOTIFY_MAX_RETRIES: int = 3
+SPOTIFY_MAX_RETRY_AFTER_SECONDS: int = 60
+
+'''
+HTTP client of the Spotify Web API.
+
+'spotipy': spotipy.Spotify on a pooled requests.Session per owner.
+'async':   async_spotify.AsyncSpotify (needs aiohttp). The requests of all
+           users run on one asyncio event loop with one connection pool of
+           at most ASYNC_HTTP_CONNECTION_LIMIT connections.
+
+SPOTIFY_API_BASE_URL can point to a local fake server for the async client.
+ASYNC_HTTP_TIMEOUT_SECONDS is the total time one request of the async client
+may take, including connecting and reading the response.
+'''
+SPOTIFY_CLIENT: str = 'spotipy'
+SPOTIFY_API_BASE_URL: str = 'https://api.spotify.com/v1/'
+ASYNC_HTTP_CONNECTION_LIMIT: int = 32
+ASYNC_HTTP_TIMEOUT_SECONDS: float = 5
+
+'''
+Seconds between refreshes of the playlists of each term. A run skips the
+playlists that are not due, and users with no due playlist entirely, so an
+invocation can run often without refreshing everything every time. A term
+that is missing here is refreshed on every run.
+
+A run that starts up to REFRESH_SLACK_SECONDS early still counts as due.
+With ADAPTIVE_REFRESH, the interval of a playlist doubles with every refresh
+in a row that did not change it, up to ADAPTIVE_REFRESH_MAX_FACTOR times the
+configured interval.
+'''
+TERM_REFRESH_INTERVALS: Dict[str, int] = {
+  'short_term': 24 * 60 * 60,
+  'medium_term': 7 * 24 * 60 * 60,
+  'long_term': 30 * 24 * 60 * 60,
+}
+REFRESH_SLACK_SECONDS: int = 60 * 60
+ADAPTIVE_REFRESH: bool = False
+ADAPTIVE_REFRESH_MAX_FACTOR: int = 4
+
+'''
+Tokens that expire within this many seconds are refreshed before a run.
+A Lambda invocation lasts at most 15 minutes, so a token that is valid for
+that long does not expire during the run.
+'''
+TOKEN_EXPIRY_MARGIN_SECONDS: int = 15 * 60
+
+'''
+Maximum number of tokens refreshed at the same time.
+'''
+TOKEN_REFRESH_WORKERS: int = 8
+
+'''
+Where OAuth tokens are stored in S3.
+
+'per_user': One `.cache-{user_id}` object per user.
+'vault':    All tokens in TOKEN_VAULT_SHARDS objects under TOKEN_VAULT_PREFIX,
+            read once per run and written only when a token was refreshed.
+            Users missing from the vault are adopted from their `.cache-{user_id}`.
+'''
+TOKEN_BACKEND: str = 'per_user'
+TOKEN_VAULT_PREFIX: str = '.token-vault/'
+TOKEN_VAULT_SHARDS: int = 1
+
+'''
+Retries of a conditional S3 write (If-Match on the ETag that was read) that
+lost against a concurrent writer, e.g. when users are registered while the
+users file is being changed. Each retry reads the object again.
+'''
+CONDITIONAL_WRITE_RETRIES: int = 5
+
+'''
+Library used to create the S3 client.
+
+'boto3':    boto3.client("s3").
+'botocore': botocore's session creates the same client without importing
+            boto3 and s3transfer, which shortens the cold start of the Lambda.
+'''
+S3_CLIENT_LIBRARY: str = 'boto3'
+
+'''
+Format of the documents S3Manager writes (see s3_codecs.py). Reads detect
+the format of every object, so this can be changed at any time.
+
+'json':    Indented JSON, easy to edit by hand (compact where the code asks for it).
+'compact': JSON without whitespace.
+'gzip':    Compact JSON compressed with gzip (level S3_GZIP_LEVEL).
+'orjson':  Compact JSON written by orjson (needs orjson).
+'msgpack': MessagePack (needs msgpack).
+
+Keys ending in .gz or .msgpack always use gzip or msgpack.
+'''
+S3_CODEC: str = 'json'
+S3_GZIP_LEVEL: int = 6
+
+'''
+With USERS_STREAMING = True a run reads the users file owner by owner while
+it downloads (STREAM_CHUNK_BYTES at a time) and starts processing an owner's
+users as soon as the owner is read, instead of loading the whole file first.
+Peak memory stays bounded by one owner's entry, but users of different
+owners are no longer interleaved.
+'''
+USERS_STREAMING: bool = False
+STREAM_CHUNK_BYTES: int = 64 * 1024
+
+'''
+Budget in milliseconds for importing lambda_function.py, checked by
+benchmarks/import_benchmark.py. Heavy libraries (spotipy, requests, boto3)
+are imported lazily, when they are first needed, and do not count here.
+'''
+IMPORT_BUDGET_MS: int = 50
+
+'''
+Run instrumentation (tracing.py). With TRACING_ENABLED every invocation
+returns a run report in its response body: wall time per stage, term and
+Spotify endpoint, S3 bytes read and written and cache hit rates, plus the
+TRACING_TOP_USERS slowest users. The report is also logged as one JSON line
+and as CloudWatch Embedded Metric Format metrics in TRACING_NAMESPACE.
+Off by default; a deployment turns it on with the environment variable
+TracingEnabled=true.
+'''
+TRACING_ENABLED: bool = os.environ.get('TracingEnabled', '').lower() in ('1', 'true', 'yes')
+TRACING_TOP_USERS: int = 10
+TRACING_NAMESPACE: str = 'SpotifyTopPlaylists'
+
 """
 Your S3 bucket name.
 All Spotify-related cache, user lists, and playlist info
@@ -36,6 +209,46 @@ This file stores top_track and top artists tracks playlists uris
 """
 PLAYLIST_INFO_FILE_KEY: str = 'playlists_info.json'
 
+"""
+Created automatically.
+
+This file stores the artists' top tracks shared by all users between runs.
+"""
+ARTIST_CACHE_FILE_KEY: str = 'artist_top_tracks_cache.json'
+
+'''
+The playlist info json is written once at the end of a run, and only if a
+user's entry changed. Set this to N > 0 to also write it after every N
+processed users, so a crashed run loses at most N users' changes.
+'''
+STATE_CHECKPOINT_INTERVAL: int = 0
+
+"""
+Layout of the users file and the playlist info file in S3.
+
+'monolithic': USERS_FILE_KEY and PLAYLIST_INFO_FILE_KEY hold everything.
+'sharded':    Every owner's user list is its own object under USERS_SHARD_PREFIX
+              and the playlist info is split into STATE_SHARD_COUNT hash buckets
+              under PLAYLIST_INFO_SHARD_PREFIX. A small manifest.json under each
+              prefix lists the existing shards. Run migrate_state.py once to copy
+              the monolithic files into this layout.
+"""
+STATE_LAYOUT: str = 'monolithic'
+STATE_SHARD_COUNT: int = 64
+USERS_SHARD_PREFIX: str = 'playlist_update_users/'
+PLAYLIST_INFO_SHARD_PREFIX: str = 'playlists_info/'
+
+'''
+Number of worker invocations a coordinator invocation ({"mode": "coordinator"})
+splits the users into, and the Lambda function that receives them (defaults
+to the running function). Use STATE_LAYOUT = 'sharded' with fan-out, so that
+workers write separate objects. In plan mode the coordinator waits for its
+workers' plans, at most FAN_OUT_WAIT_TIMEOUT_SECONDS (the Lambda maximum).
+'''
+FAN_OUT_SHARDS: int = 4
+FAN_OUT_FUNCTION_NAME: str = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', None)
+FAN_OUT_WAIT_TIMEOUT_SECONDS: int = 900
+
 SCOPE = (
   "user-read-recently-played "
   "user-read-playback-state "
@@ -1,16 +1,24 @@
+import argparse
+import json
 import os
+import sys
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 from spotipy.cache_handler import MemoryCacheHandler
 
+from json_manager import JsonManager
 from s3_manager import S3Manager
 from s3_spotify_cache_handler import S3SpotifyCacheHandler
-from settings import BUCKET_NAME, SCOPE, USERS_FILE_KEY
+from settings import BUCKET_NAME, SCOPE, TOKEN_BACKEND
+from token_vault import TokenVault, VaultCacheHandler
+from users_store import UsersStore
 
 class Auth:
     def __init__(self, owner_id: str):
         self.owner_id = owner_id
         self.s3_manager = S3Manager()
+        self.json_manager = JsonManager()
+        self.users_store = UsersStore(self.s3_manager, self.json_manager)
         self.scope = SCOPE
 
     def get_required_environment(self, name: str):
@@ -54,30 +62,18 @@ class Auth:
         return spotipy.Spotify(auth_manager=oauth), token_info
 
     def load_users_info_file(self):
-        return self.s3_manager.load_info(BUCKET_NAME, USERS_FILE_KEY)
+        return self.users_store.load()
     def save_user_info(self, data: dict | None, user_id: str):
-        data = data or {}
-        owners = data.setdefault("owners", {})
-
-        for owner_data in owners.values():
-            users = owner_data.get("users", [])
-
-            owner_data["users"] = [
-                user
-                for user in users
-                if user.get("id") != user_id
-            ]
-
-        users = (
-            owners
-            .setdefault(self.owner_id, {})
-            .setdefault("users", [])
-        )
-
-        users.append({"id": user_id})
-        self.s3_manager.save_info(BUCKET_NAME, USERS_FILE_KEY, data)
+        # data is the users file read earlier; the registration reads the
+        # current file itself, so a concurrent change is not overwritten.
+        self.users_store.register({self.owner_id: [user_id]})
 
     def save_user_cache(self, user_id, token_info):
+        if TOKEN_BACKEND == 'vault':
+            vault = TokenVault(self.s3_manager, self.json_manager)
+            VaultCacheHandler(vault, user_id).save_token_to_cache(token_info)
+            vault.flush()
+            return
         s3_cache_handler = S3SpotifyCacheHandler(
             self.s3_manager,
             BUCKET_NAME,
@@ -87,16 +83,71 @@ class Auth:
             token_info
         )
 
+    def save_user_caches(self, token_infos: dict):
+        # All token caches are written concurrently, or into the vault with one flush.
+        if TOKEN_BACKEND == 'vault':
+            vault = TokenVault(self.s3_manager, self.json_manager)
+            for user_id, token_info in token_infos.items():
+                vault.put(user_id, token_info)
+            vault.flush()
+            return
+        self.s3_manager.save_many(BUCKET_NAME, {
+            f".cache-{user_id}": token_info
+            for user_id, token_info in token_infos.items()
+        })
+
+    def register_many(self, token_infos: dict) -> int:
+        """
+        Register many authenticated users under this owner at once.
+
+        Parameters:
+            token_infos (dict): Completed token info keyed by Spotify user ID.
+
+        Returns:
+            int: Number of owners whose user list changed.
+        """
+        if not token_infos:
+            return 0
+        # Tokens first: a registered user without a token would be skipped by every run.
+        self.save_user_caches(token_infos)
+        return self.users_store.register({self.owner_id: list(token_infos)})
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Authenticate Spotify users and register them under an owner.")
+    parser.add_argument("--owner", default="22cunbuveglybbsdtu6djzu4a", help="Owner whose Spotify application is used.")
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=1,
+        help="Authenticate this many users one after another and register them together."
+    )
+    parser.add_argument(
+        "--tokens-file",
+        metavar="PATH",
+        help="Register the completed token infos of a JSON file {user_id: token_info} instead of signing in."
+    )
+    args = parser.parse_args()
+
+    auth = Auth(args.owner)
+    if args.tokens_file:
+        with open(args.tokens_file, encoding="utf-8") as f:
+            token_infos = json.load(f)
+    else:
+        token_infos = {}
+        for number in range(args.count):
+            if args.count > 1:
+                print(f"Sign in user {number + 1} of {args.count}.")
+            sp, token_info = auth.authenticate()
+            profile = sp.me()
+            token_infos[profile["id"]] = token_info
+            print(f"Hello {profile['display_name']}")
+
+    auth.register_many(token_infos)
+    for user_id in token_infos:
+        print(f"{user_id} under owner {args.owner}")
+    print(f"{len(token_infos)} user(s) were registered successfully.")
+    return 0
+
+
 if __name__ == "__main__":
-    owner_id = "22cunbuveglybbsdtu6djzu4a"
-    auth = Auth(owner_id)
-    sp, token_info = auth.authenticate()
-    profile = sp.me()
-    user_id = profile["id"]
-    display_name = profile["display_name"]
-    data = auth.load_users_info_file()
-    auth.save_user_cache(user_id, token_info)
-    auth.save_user_info(data, user_id)
-    print(f"Hello {display_name}")
-    print(f"{display_name} under owner {owner_id}")
-    print("You were registed successfully.")
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
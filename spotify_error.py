@@ -2,4 +2,10 @@ class InvalidGrantError(Exception):
     def __init__(self, user_id: str):
         super().__init__(
             f"User '{user_id}' must reauthenticate with Spotify. Run spotify_auth.py with an owner id"
-        )
\ No newline at end of file
+        )
+
+class ConflictError(Exception):
+    def __init__(self, key: str):
+        super().__init__(
+            f"S3 object '{key}' was changed by someone else since it was read."
+        )
@@ -1,14 +1,21 @@
 from __future__ import annotations
-import spotipy
-from s3_spotify_cache_handler import S3SpotifyCacheHandler
-from settings import *
+from settings import MAX_WORKERS, MAX_WORKERS_PER_OWNER, USERS_STREAMING
 import os
 import logging
-from spotipy.exceptions import SpotifyOauthError
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
 from spotify_error import InvalidGrantError
+from request_scheduler import ScheduledSpotify, SchedulerPool
+from refresh_schedule import KIND_TOP_ARTISTS_TRACKS, KIND_TOP_TRACKS, RefreshSchedule
+from playlist_state_store import PlaylistStateStore, make_state_store
+from users_store import UsersStore
+from user_plan import UserPlanner
+from tracing import tracer
 
-from typing import TYPE_CHECKING
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
 if TYPE_CHECKING:
+    from token_manager import TokenManager
     from s3_manager import S3Manager
     from json_manager import JsonManager
     from spotify_top_tracks import SpotifyTopTracks
@@ -36,10 +43,15 @@ class SpotifyMain:
     Responsibilities:
     - Load user id and playlist info from S3
     - Initialize Spotify clients for each user
-    - Handle token caching via S3
-    - Execute top tracks and top artists playlist generation
+    - Load and refresh the users' tokens in one batch (TokenManager)
+    - Execute top tracks and top artists playlist generation, planning both
+      generators' reads per user in parallel waves (UserPlanner)
+    - Process users concurrently with a bounded worker pool
+    - Route every Spotify request through its owner's RequestScheduler
+    - Refresh only the playlists that are due (RefreshSchedule)
+    - Trace the stages of a run (tracing.tracer)
     """
-    def __init__(self, s3_manager: S3Manager, json_manager: JsonManager, spotify_top_tracks: SpotifyTopTracks, spotify_top_artists_tracks: SpotifyTopArtistsTracks):
+    def __init__(self, s3_manager: S3Manager, json_manager: JsonManager, spotify_top_tracks: SpotifyTopTracks, spotify_top_artists_tracks: SpotifyTopArtistsTracks, spotify_factory: Optional[Callable[..., Any]] = None, token_manager: Optional[TokenManager] = None, schedulers: Optional[SchedulerPool] = None, refresh_schedule: Optional[RefreshSchedule] = None):
         """
         Constructor for SpotifyMain.
         
@@ -47,103 +59,268 @@ class SpotifyMain:
         :param json_manager: Handles creation of JSON structures
         :param spotify_top_tracks: Logic for generating user top track playlists
         :param spotify_top_artists_tracks: Logic for generating top artist tracks playlists
+        :param spotify_factory: Optional callable returning a Spotify client for
+                                (owner_id, token_info). Defaults to runtime.make_spotify;
+                                tests can pass a fake.
+        :param token_manager: Loads and refreshes tokens. runtime.make_token_manager if not given.
+        :param schedulers: Rate-limits the owners' Spotify requests. A new pool if not given.
+        :param refresh_schedule: Decides which playlists are due. TERM_REFRESH_INTERVALS if not given.
         """
-        self.scope = SCOPE
         self.s3_manager = s3_manager
         self.json_manager = json_manager
         self.spotify_top_tracks = spotify_top_tracks
         self.spotify_top_artists_tracks = spotify_top_artists_tracks
-    
-    def run(self):
+        # The clients, sessions and token managers of a warm container are all
+        # built by runtime, so they are constructed in one place only.
+        import runtime
+        self.spotify_factory = spotify_factory or runtime.make_spotify
+        self.token_manager = token_manager or runtime.make_token_manager(s3_manager, json_manager)
+        self.schedulers = schedulers or SchedulerPool()
+        self.refresh_schedule = refresh_schedule or RefreshSchedule()
+        self.planner = UserPlanner(spotify_top_tracks, spotify_top_artists_tracks)
+
+    def run(self, user_ids: Optional[Iterable[str]] = None, owner_ids: Optional[Iterable[str]] = None, plan: bool = False) -> Optional[Dict[str, Any]]:
         """
         Main execution function.
+
+        :param user_ids: Only process these users (fan-out worker mode). All users if None.
+        :param owner_ids: Only read these owners' users, if known. All owners if None.
+        :param plan: Plan mode: send every read and compute the playlist changes,
+                     but write nothing to Spotify and nothing to S3. Expired tokens
+                     are refreshed in memory only. The exception is a token for which
+                     Spotify issued a new refresh token: the stored one may no longer
+                     be accepted, so it is saved and its user marked "token_saved".
+        :return: In plan mode, the planned changes of every processed user
+                 (UserPlanner.preview) with the number of reads it took and
+                 whether its token had to be saved, keyed by user ID. None otherwise.
         
         Workflow:
-        1. Load user info and playlist URIs from S3.
-        2. For each registered user:
+        1. Load user info and playlist URIs from S3 (in the configured STATE_LAYOUT).
+        2. Collect the registered users of every owner with complete credentials.
+        3. Process the users with a pool of at most MAX_WORKERS threads and at most
+           MAX_WORKERS_PER_OWNER users of one owner at the same time, after loading
+           all tokens and refreshing the expired ones in one batch. Users with
+           no playlist due for a refresh are skipped before their token is loaded:
             - Check if the user is new. If the user is new, create json data.
-            - Load Spotify API credentials from environment variables.
-            - Load/refresh Spotify token via S3-based cache.
-            - Run top tracks and top artists playlist creation.
-            - Save playlist uris on s3.
+            - Run top tracks and top artists playlist creation for the due terms.
+            - Record the user's changed playlist uris.
+        4. Save the playlist uris on S3 once, if any user changed
+           (and at STATE_CHECKPOINT_INTERVAL checkpoints).
+
+        With USERS_STREAMING, the users file is read owner by owner and every
+        owner's users are started (steps 2 and 3) as soon as the owner is read.
+
+        A failing user does not stop the other users. The first unexpected error
+        is raised again once every user has been processed.
         """
+        plans: Optional[Dict[str, Any]] = {} if plan else None
+        users_store = UsersStore(self.s3_manager, self.json_manager)
+        state_store = make_state_store(self.s3_manager, self.json_manager)
+
         # Load user id and playlist info from S3
-        users_data = self.s3_manager.load_info(BUCKET_NAME, USERS_FILE_KEY)
-        playlist_uri_data = self.s3_manager.load_info(BUCKET_NAME, PLAYLIST_INFO_FILE_KEY)
+        if USERS_STREAMING:
+            with tracer.span("state.load"):
+                state_store.load()
+            job_batches = self.stream_jobs(users_store.iter_owners(owner_ids))
+        else:
+            with tracer.span("users.load"):
+                users_data = users_store.load(owner_ids)
 
-        if not users_data:
-            logger.warning("No user data.")
-            return
+            if not users_data:
+                logger.warning("No user data.")
+                return plans
+
+            with tracer.span("state.load"):
+                state_store.load()
+            job_batches = iter([self.collect_jobs(users_data)])
+
+        if user_ids is not None:
+            selected = set(user_ids)
+            job_batches = ([job for job in jobs if job[2] in selected] for jobs in job_batches)
+
+        self.token_manager.reset()
+        # The schedulers outlive a run in a warm container; report this run only.
+        self.schedulers.reset_stats()
+        try:
+            self.run_jobs(job_batches, state_store, plans)
+        finally:
+            # Save playlist URIs back to S3, also keeping finished users if a user failed.
+            # Plan mode commits nothing, so there is nothing to save.
+            if plans is None:
+                with tracer.span("state.flush"):
+                    state_store.flush()
+            for owner_id, stats in self.schedulers.stats().items():
+                logger.info("Spotify requests of %s: %s", owner_id, stats)
+        return plans
+
+    def owner_jobs(self, owner_id: str, owner_info: Dict[str, Any]) -> List[Tuple[str, Tuple[str, str, str], str]]:
+        """
+        Build the (owner_id, credentials, user_id) jobs of one owner's users.
+        An owner without complete credentials gets no jobs.
+        """
+        # Load user-specific Spotify credentials from environment variables stored in Lambda
+        client_id = os.environ.get(f'E{owner_id}ClientId', None)
+        client_secret = os.environ.get(f'E{owner_id}ClientSecret', None)
+        redirect_url = os.environ.get(f'E{owner_id}RedirectUrl', None)
 
-        for owner_id, owner_info in users_data.get('owners', {}).items():
-            # Load user-specific Spotify credentials from environment variables stored in Lambda
-            client_id = os.environ.get(f'E{owner_id}ClientId', None)
-            client_secret = os.environ.get(f'E{owner_id}ClientSecret', None)
-            redirect_url = os.environ.get(f'E{owner_id}RedirectUrl', None)
+        # If any credentials are missing, skip the user
+        if client_id is None or client_secret is None or redirect_url is None:
+            logger.warning(f"Skipping {owner_id} because no client id or client secret was found.")
+            return []
+        credentials = (client_id, client_secret, redirect_url)
 
-            # If any credentials are missing, skip the user
-            if client_id is None or client_secret is None or redirect_url is None:
-                logger.warning(f"Skipping {owner_id} because no client id or client secret was found.")
+        jobs = []
+        users = owner_info.get('users', [])
+        for user_info in users:
+            user_id = user_info.get('id', None)
+            if not user_id:
+                logger.warning(
+                    "No user ID for owner_id=%s.",
+                    owner_id
+                )
                 continue
-            users = owner_info.get('users', [])
-            for user_info in users:
-                user_id = user_info.get('id', None)
-                if not user_id:
-                    logger.warning(
-                        "No user ID for owner_id=%s.",
-                        owner_id
-                    )
-                    continue
+            jobs.append((owner_id, credentials, user_id))
+        return jobs
 
-                # Token cache stored in S3 instead of local filesystem
-                cache_handler = S3SpotifyCacheHandler(
-                                    s3_manager=self.s3_manager,
-                                    bucket=BUCKET_NAME,
-                                    key=f".cache-{user_id}"
-                                )
-
-                # Check if .cache file is on s3. If not, skip the user.
-                cache_data = cache_handler.get_cached_token()
-                if cache_data is None:
-                    print(f"[WARN] No token cache for {user_id}. Please authenticate this user first.")
+    def collect_jobs(self, users_data: Dict[str, Any]) -> List[Tuple[str, Tuple[str, str, str], str]]:
+        """
+        Build the list of (owner_id, credentials, user_id) jobs for this run.
+
+        Users of different owners are interleaved round-robin so that the worker
+        pool spreads its threads over all owners instead of draining one owner first.
+        The order is stable for the same users file.
+        """
+        jobs_per_owner = [
+            self.owner_jobs(owner_id, owner_info)
+            for owner_id, owner_info in users_data.get('owners', {}).items()
+        ]
+
+        return [
+            job
+            for jobs in zip_longest(*jobs_per_owner)
+            for job in jobs
+            if job is not None
+        ]
+
+    def stream_jobs(self, owners: Iterable[Tuple[str, Dict[str, Any]]]) -> Iterator[List[Tuple[str, Tuple[str, str, str], str]]]:
+        """
+        Yield the jobs of every owner as soon as the owner is read.
+        """
+        found = False
+        for owner_id, owner_info in owners:
+            found = True
+            yield self.owner_jobs(owner_id, owner_info)
+        if not found:
+            logger.warning("No user data.")
+
+    def run_jobs(self, job_batches: Iterable[List[Tuple[str, Tuple[str, str, str], str]]], state_store: PlaylistStateStore, plans: Optional[Dict[str, Any]] = None):
+        """
+        Process batches of jobs on a bounded worker pool.
+        With plans, the users are only planned (see run) into that dict.
+
+        The tokens and playlist states of a batch are prepared before its jobs
+        are submitted, so a later batch can still be loading while the jobs of
+        an earlier one run.
+
+        Every owner gets a semaphore of MAX_WORKERS_PER_OWNER slots, so at most
+        that many of its users talk to Spotify at the same time.
+        """
+        owner_slots: Dict[str, threading.BoundedSemaphore] = {}
+        tokens: Dict[str, Any] = {}
+
+        def work(owner_id: str, credentials: Tuple[str, str, str], user_id: str) -> bool:
+            with owner_slots[owner_id], tracer.span("user", user=user_id):
+                return self.process_user(owner_id, user_id, tokens.get(user_id), state_store, plans)
+
+        first_error = None
+        futures = []
+        with ThreadPoolExecutor(max_workers=max(1, MAX_WORKERS)) as executor:
+            for jobs in job_batches:
+                if not jobs:
+                    continue
+                for owner_id, _, _ in jobs:
+                    owner_slots.setdefault(owner_id, threading.BoundedSemaphore(max(1, MAX_WORKERS_PER_OWNER)))
+                with tracer.span("state.preload"):
+                    state_store.preload(user_id for _, _, user_id in jobs)
+                due_jobs = [job for job in jobs if self.refresh_schedule.has_due_work(state_store.get(job[2]))]
+                if len(due_jobs) < len(jobs):
+                    logger.info("Skipping %d user(s) with no playlist due.", len(jobs) - len(due_jobs))
+                tracer.count("users.skipped", len(jobs) - len(due_jobs))
+                jobs = due_jobs
+                if not jobs:
                     continue
-                
-                # Initialize authenticated Spotify client
-                sp_auth = spotipy.oauth2.SpotifyOAuth(client_id=client_id,
-                                                    client_secret=client_secret,
-                                                    redirect_uri=redirect_url,
-                                                    scope=self.scope,
-                                                    cache_handler=cache_handler,
-                                                    open_browser=False,
-                                                    show_dialog=True)
-                
-                sp = spotipy.Spotify(auth_manager=sp_auth)
-
-                # Log and check if the user is ready.
+                with tracer.span("tokens.prepare"):
+                    tokens.update(self.token_manager.prepare(jobs, persist=plans is None))
+                futures.extend(
+                    (user_id, executor.submit(work, owner_id, credentials, user_id))
+                    for owner_id, credentials, user_id in jobs
+                )
+            # Collect results in submission order so logs and errors are reproducible.
+            for user_id, future in futures:
                 try:
-                    username = sp.me()['display_name']
-                except SpotifyOauthError as e:
-                    error_code = getattr(e, "error", None)
-                    if error_code == "invalid_grant":
-                        invalid_grant_error = InvalidGrantError(user_id)
-                        logger.error(
-                            "%s: %s",
-                            type(invalid_grant_error).__name__,
-                            invalid_grant_error
-                        )
-                        continue
-                    raise
-
-                print(f"user_id: {user_id}, username: {username} is now logged in.")
-
-                # check if the user is new
-                if self.json_manager.is_new_user(playlist_uri_data, user_id):
-                    # if new, make playlist uri data
-                    playlist_uri_data = self.json_manager.make_new_user(playlist_uri_data, user_id)
-
-                # Generate playlists for this user
-                self.spotify_top_tracks.main(sp, user_id, playlist_uri_data)
-                self.spotify_top_artists_tracks.main(sp, user_id, playlist_uri_data)
-
-                # Save updated playlist URIs back to S3
-                self.s3_manager.save_info(BUCKET_NAME, PLAYLIST_INFO_FILE_KEY, playlist_uri_data)
\ No newline at end of file
+                    future.result()
+                except Exception as e:
+                    logger.exception("Processing user '%s' failed.", user_id)
+                    if first_error is None:
+                        first_error = e
+
+        if first_error is not None:
+            raise first_error
+
+    def process_user(self, owner_id: str, user_id: str, token_info: Any, state_store: PlaylistStateStore, plans: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Update the playlists of one user and record the playlist uris.
+
+        :param token_info: Token prepared by TokenManager.prepare, None if the user
+                           has no token cache, or the exception of a failed refresh.
+        :param plans: Plan mode: the user's planned changes are stored in this
+                      dict under its user ID instead of being applied.
+
+        Returns:
+            bool: True if the user was processed, False if it was skipped.
+        """
+        # Check if .cache file is on s3. If not, skip the user.
+        if token_info is None:
+            print(f"[WARN] No token cache for {user_id}. Please authenticate this user first.")
+            return False
+
+        # Log and skip users whose refresh token was revoked.
+        if isinstance(token_info, InvalidGrantError):
+            logger.error(
+                "%s: %s",
+                type(token_info).__name__,
+                token_info
+            )
+            return False
+        if isinstance(token_info, Exception):
+            raise token_info
+        
+        # Initialize authenticated Spotify client, rate-limited per owner (and read-only in plan mode)
+        sp = ScheduledSpotify(self.spotify_factory(owner_id, token_info), self.schedulers.get(owner_id), read_only=plans is not None)
+
+        # Work on a copy of this user's playlist uri data. If the user is new, it is created.
+        playlist_uri_data = state_store.checkout(user_id)
+
+        # Plan the due playlists of both generators: all reads are sent up front in
+        # parallel waves, sharing one listing of the user's playlists.
+        due_terms = {
+            kind: self.refresh_schedule.due_terms(playlist_uri_data[user_id], kind)
+            for kind in (KIND_TOP_TRACKS, KIND_TOP_ARTISTS_TRACKS)
+        }
+        plan = self.planner.plan(sp, user_id, playlist_uri_data, due_terms)
+        print(f"user_id: {user_id}, username: {plan.profile['display_name']} is now logged in.")
+
+        if plans is not None:
+            plans[user_id] = {"reads": sp.calls, "token_saved": user_id in self.token_manager.unavoidable_saves, "playlists": self.planner.preview(plan)}
+            return True
+
+        # Apply the writes of all playlists as one batch.
+        results = self.planner.apply(sp, plan, playlist_uri_data)
+        for kind, term_results in results.items():
+            for term, stats in term_results.items():
+                self.refresh_schedule.record(playlist_uri_data[user_id], kind, term, stats.modified)
+                tracer.count("playlists.modified" if stats.modified else "playlists.unchanged")
+
+        # Record the updated playlist URIs; they are saved to S3 at the end of the run.
+        state_store.commit(user_id, playlist_uri_data)
+        return True
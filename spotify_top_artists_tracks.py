@@ -1,108 +1,90 @@
 from __future__ import annotations
-from datetime import date
-from settings import *
-from typing import Dict, List, TYPE_CHECKING
+from settings import ARTIST_FETCH_WORKERS, ARTIST_TOP_TRACKS_MARKET, TOP_ARTIST_NUM
+from typing import Dict, Iterable, List, Optional, TYPE_CHECKING
 if TYPE_CHECKING:
+    from artist_tracks_cache import ArtistTracksCache
     from playlist_manager import PlaylistManager
-    from spotipy import Spotify
+    from request_scheduler import ScheduledSpotify
 
 class SpotifyTopArtistsTracks:
     """
-    This class handles the retrieval and updating of Spotify playlists
-    containing the top tracks from a user's top artists. 
+    This class handles the retrieval of the top tracks from a user's top
+    artists. The playlists themselves are created and updated by
+    user_plan.UserPlanner.
     """
-    def __init__(self, playlist_manager: PlaylistManager):
+    def __init__(self, playlist_manager: PlaylistManager, artist_tracks_cache: Optional[ArtistTracksCache] = None):
         """
         Initialize the SpotifyTopArtistsTracks instance.
 
         Parameters:
             playlist_manager (PlaylistManager): A helper class for Spotify playlist operations.
+            artist_tracks_cache (ArtistTracksCache | None): Cache of artists' top tracks shared
+                                                            by all users. Optional.
         """
         self.playlist_manager = playlist_manager
+        self.artist_tracks_cache = artist_tracks_cache
 
-    def get_top_artists(self, sp: Spotify, term: str) -> Dict:
+    def get_top_artists(self, sp: ScheduledSpotify, terms: Iterable[str]) -> Dict[str, Dict]:
         """
-        Retrieve a user's top artists from Spotify.
+        Retrieve a user's top artists for several time ranges at once.
 
         Parameters:
-            sp (Spotify): Authenticated Spotipy client.
-            term (str): Time range for top artists ('short_term', 'medium_term', 'long_term').
+            sp (ScheduledSpotify): Authenticated Spotify client; the requests of all
+                                   terms are sent together with sp.gather, as coroutines
+                                   on the shared event loop with the async client
+                                   (see async_spotify).
+            terms (Iterable[str]): Time ranges ('short_term', 'medium_term', 'long_term').
 
         Returns:
-            dict: Spotify API response containing top artists.
+            dict: Spotify API responses containing the top artists, keyed by term.
         """
-        return sp.current_user_top_artists(limit=TOP_ARTIST_NUM, offset=0, time_range=term)
-    
-    def get_top_artists_tracks(self, sp: Spotify, artist_id: str) -> Dict:
-        """
-        Retrieve the top tracks for a specific artist.
-
-        Parameters:
-            sp (Spotify): Authenticated Spotipy client.
-            artist_id (str): Spotify artist ID.
+        terms = list(terms)
+        calls = [("current_user_top_artists", (), {"limit": TOP_ARTIST_NUM, "offset": 0, "time_range": term}) for term in terms]
+        return dict(zip(terms, sp.gather(calls, len(calls))))
 
-        Returns:
-            dict: Spotify API response containing the artist's top tracks.
+    def get_artists_tracks(self, sp: ScheduledSpotify, artist_ids: Iterable[str]) -> Dict[str, List[str]]:
         """
-        return sp.artist_top_tracks(artist_id)
-    
-    def update_playlist(self, sp: Spotify, playlist_uri: str, term: str, prev_track_uris: List[str]) -> bool:
-        """
-        Update a playlist with top tracks from top artists.
-        Compares with previous tracks and only updates if changed.
+        Retrieve the top track URIs of every given artist, once per artist.
+
+        Artists usually appear in several time ranges, so the IDs are
+        deduplicated before fetching, and the requests are sent together with
+        sp.gather, at most ARTIST_FETCH_WORKERS at a time. Artists found in
+        the shared cache are not fetched at all.
 
         Parameters:
-            sp (Spotify): Authenticated Spotipy client.
-            playlist_uri (str): Playlist URI to update.
-            term (str): Time range for top artists.
-            prev_track_uris (List[str]): Previously stored track URIs.
+            sp (ScheduledSpotify): Authenticated Spotify client.
+            artist_ids (Iterable[str]): Spotify artist IDs, duplicates allowed.
 
         Returns:
-            bool: True if playlist was modified, False if no changes.
+            dict: Track URIs keyed by artist ID.
         """
-        artists = self.get_top_artists(sp, term)
-        playlist_tracks = []
-        for artist in artists['items']:
-            tracks = self.get_top_artists_tracks(sp, artist['id'])
-            for track in tracks['tracks']:
-                playlist_tracks.append(track['uri'])
-        if prev_track_uris == playlist_tracks:
-            return False
-        else:
-            for i in range(0, len(prev_track_uris), 100):
-                self.playlist_manager.delete_all_songs(sp, playlist_uri, prev_track_uris[i:i+100])
-            for i in range(0, len(playlist_tracks), 100):
-                self.playlist_manager.add_to_playlist(sp, playlist_tracks[i:i+100], playlist_uri)
-            return True
+        unique_ids = list(dict.fromkeys(artist_ids))
+        artists_tracks = {}
+        missing_ids = []
+        for artist_id in unique_ids:
+            cached = None
+            if self.artist_tracks_cache is not None:
+                cached = self.artist_tracks_cache.get(artist_id, ARTIST_TOP_TRACKS_MARKET)
+            if cached is None:
+                missing_ids.append(artist_id)
+            else:
+                artists_tracks[artist_id] = cached
+        if not missing_ids:
+            return artists_tracks
 
-    def main(self, sp: Spotify, user_id: str, playlist_uri_data: Dict[str, Dict]):
-        """
-        Main function to manage all top artists playlists for a user.
-        Creates new playlists or updates existing ones.
+        calls = [("artist_top_tracks", (artist_id,), {"country": ARTIST_TOP_TRACKS_MARKET}) for artist_id in missing_ids]
+        for artist_id, result in zip(missing_ids, sp.gather(calls, ARTIST_FETCH_WORKERS)):
+            track_uris = [track['uri'] for track in result['tracks']]
+            if self.artist_tracks_cache is not None:
+                self.artist_tracks_cache.put(artist_id, ARTIST_TOP_TRACKS_MARKET, track_uris)
+            artists_tracks[artist_id] = track_uris
+        return artists_tracks
 
-        Parameters:
-            sp (Spotify): Authenticated Spotipy client.
-            username (str): User ID.
-            playlist_uri_data (dict): Dictionary storing playlist URIs.
+    def build_playlist_tracks(self, artist_ids: List[str], artists_tracks: Dict[str, List[str]]) -> List[str]:
         """
-        today = date.today()
-        my_playlists = self.playlist_manager.get_my_playlists(sp)
-
-        for term, recorded_playlist_uri in list(playlist_uri_data[user_id]["artist_top_tracks_uris"].items()):
-            print(f"=====top artists {term}=====")
-            for my_playlist in my_playlists['items']:
-                if recorded_playlist_uri == my_playlist['uri']:
-                    print('playlist exists.')
-                    self.playlist_manager.change_playlist_details(sp, my_playlist['uri'], description=f'my {term} playlist on {today}')
-                    print("details are changed.")
-                    break
-            else:
-                my_playlist = self.playlist_manager.make_playlist(sp, name=f'{term} top artists tracks', description=f'my {term} playlist on {today}')
-                playlist_uri_data = self.playlist_manager.record_attu_playlist_uri(playlist_uri_data, my_playlist['uri'], term, user_id)
-                print("playlist is made.")
-
-            prev_track_uris = self.playlist_manager.get_songs_uri(sp, my_playlist['uri'])
-            if self.update_playlist(sp, my_playlist['uri'], term, prev_track_uris):
-                print("modified")
-            else:
-                print("NOT modified")
\ No newline at end of file
+        Concatenate the top tracks of the given artists in ranking order.
+        """
+        playlist_tracks = []
+        for artist_id in artist_ids:
+            playlist_tracks.extend(artists_tracks[artist_id])
+        return playlist_tracks
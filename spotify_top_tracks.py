@@ -1,14 +1,14 @@
 from __future__ import annotations
-from datetime import date
-from settings import *
-from typing import Dict, List, TYPE_CHECKING
+from settings import TOP_TRACK_NUM
+from typing import Dict, Iterable, List, TYPE_CHECKING
 if TYPE_CHECKING:
     from playlist_manager import PlaylistManager
-    from spotipy import Spotify
+    from request_scheduler import ScheduledSpotify
 
 class SpotifyTopTracks:
     """
-    Handles creating and updating Spotify playlists with a user's top tracks.
+    Provides the track lists of a user's top tracks playlists.
+    The playlists themselves are created and updated by user_plan.UserPlanner.
     """
     def __init__(self, playlist_manager: PlaylistManager):
         """
@@ -20,63 +20,21 @@ class SpotifyTopTracks:
         self.playlist_manager = playlist_manager
         
     
-    def update_playlist(self, sp: Spotify, term: str, prev_track_uris: List[str], playlist_uri: str) -> bool:
+    def get_top_tracks(self, sp: ScheduledSpotify, terms: Iterable[str]) -> Dict[str, List[str]]:
         """
-        Update a playlist with the user's top tracks.
-        If the playlist is unchanged from the previous version, nothing is done.
-        Otherwise, all songs in the playlist are deleted and new tracks are added.
+        Retrieve the URIs of the user's top tracks for several time ranges at once.
 
         Parameters:
-            sp (Spotify): Authenticated Spotipy client.
-            term (str): Time range for top tracks ('short_term', 'medium_term', 'long_term').
-            prev_track_uris (List[str]): Previously stored track URIs in the playlist.
-            playlist_uri (str): Playlist URI to update.
+            sp (ScheduledSpotify): Authenticated Spotify client; the requests of all
+                                   terms are sent together with sp.gather, as coroutines
+                                   on the shared event loop with the async client
+                                   (see async_spotify).
+            terms (Iterable[str]): Time ranges ('short_term', 'medium_term', 'long_term').
 
         Returns:
-            bool: True if the playlist was modified, False if no changes.
+            dict: Track URIs in ranking order, keyed by term.
         """
-        track_uris = []
-        results = sp.current_user_top_tracks(limit=TOP_TRACK_NUM, offset=0, time_range=term)
-        for number, result in enumerate(results['items']):
-            uri = result['uri']
-            track_uris.append(uri)
-        if prev_track_uris == track_uris:
-            return False
-        else:
-            self.playlist_manager.delete_all_songs(sp, playlist_uri, prev_track_uris)
-            self.playlist_manager.add_to_playlist(sp, track_uris, playlist_uri)
-            return True
-    
-    def main(self, sp: Spotify, user_id: str, playlist_uri_data: Dict[str, Dict]):
-        """
-        Main function to manage all top tracks playlists for a user.
-        Creates new playlists or updates existing ones.
-
-        Parameters:
-            sp (Spotify): Authenticated Spotipy client.
-            username (str): User ID.
-            playlist_uri_data (dict): Dictionary storing playlist URIs per user.
-        """
-        today = date.today()
-        my_playlists = self.playlist_manager.get_my_playlists(sp)
-
-        for term, recorded_playlist_uri in list(playlist_uri_data[user_id]["current_user_top_tracks_uris"].items()):
-            print(f"=====top song {term}=====")
-            for my_playlist in my_playlists['items']:
-                # if recored playlist uri's playlist does not exist, create a new playlist.
-                if recorded_playlist_uri == my_playlist['uri']:
-                    print('playlist exists.')
-                    self.playlist_manager.change_playlist_details(sp, my_playlist['uri'], description=f'my {term} playlist on {today}')
-                    print("details are changed.")
-                    break
-            else:
-                my_playlist = self.playlist_manager.make_playlist(sp, name=f'{term} top tracks', description=f'my {term} playlist on {today}')
-                playlist_uri_data = self.playlist_manager.record_cuttu_playlist_uri(playlist_uri_data, my_playlist['uri'], term, user_id)
-                print("playlist is made.")
-
-            prev_track_uris = self.playlist_manager.get_songs_uri(sp, my_playlist['uri'])
-            if self.update_playlist(sp, term, prev_track_uris, my_playlist['uri']):
-                print("modified")
-            else:
-                print("NOT modified.")
-            
\ No newline at end of file
+        terms = list(terms)
+        calls = [("current_user_top_tracks", (), {"limit": TOP_TRACK_NUM, "offset": 0, "time_range": term}) for term in terms]
+        results = sp.gather(calls, len(calls))
+        return {term: [track['uri'] for track in result['items']] for term, result in zip(terms, results)}
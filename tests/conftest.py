@@ -0,0 +1,43 @@
+import os
+import sys
+
+# The project is a flat set of Lambda modules; the checks import them, and the
+# fake Spotify and S3 backends of the benchmark, from the repository root.
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "benchmarks"))
+
+import pytest
+
+
+@pytest.fixture
+def fake_components():
+    """
+    Return a function that builds the workflow's components on the fake
+    Spotify and S3 of benchmarks/fake_backend.py, with user_count registered
+    users over owner_count owners, and makes lambda_handler use them.
+    Every playlist is due on every run.
+    """
+    import runtime
+    from fake_backend import FakeS3Client, FakeSpotifyAPI
+    from refresh_schedule import RefreshSchedule
+    from request_scheduler import RequestScheduler, SchedulerPool
+    from run_benchmark import populate
+
+    def build(user_count, owner_count=1, **spotify_options):
+        s3_client = FakeS3Client()
+        api = FakeSpotifyAPI(**spotify_options)
+        components = runtime.build_components(
+            s3_client=s3_client,
+            spotify_factory=lambda owner_id, token_info: api.client(token_info["access_token"].split("-", 1)[1]),
+            refresh_schedule=RefreshSchedule(intervals={})
+        )
+        components["spotify_main"].schedulers = SchedulerPool(lambda: RequestScheduler(rate=1e9, burst=1_000_000))
+        populate(components, user_count, owner_count)
+        components["fake_s3"] = s3_client
+        components["fake_spotify"] = api
+        runtime.use_components(components)
+        return components
+
+    yield build
+    runtime.use_components(None)
@@ -0,0 +1,53 @@
+from artist_tracks_cache import ArtistTracksCache
+
+
+class MemoryS3:
+    def __init__(self):
+        self.objects = {}
+
+    def save_info(self, bucket, key, data, indent=4):
+        self.objects[key] = data
+
+    def load_info(self, bucket, key, **kwargs):
+        return self.objects.get(key)
+
+
+def test_load_keeps_lru_order():
+    s3 = MemoryS3()
+    cache = ArtistTracksCache(max_entries=3)
+    for artist_id in ("b", "c", "a"):
+        cache.put(artist_id, "US", ["spotify:track:1"])
+    cache.save(s3, "bucket", "key")
+
+    loaded = ArtistTracksCache(max_entries=3)
+    loaded.load(s3, "bucket", "key")
+    assert [artist_id for artist_id, _ in loaded._entries] == ["b", "c", "a"]
+
+    # The least recently used artist goes first, not the most recent one.
+    loaded.put("z", "US", [])
+    assert [artist_id for artist_id, _ in loaded._entries] == ["c", "a", "z"]
+
+
+def test_load_puts_persisted_entries_before_newer_ones():
+    s3 = MemoryS3()
+    cache = ArtistTracksCache()
+    cache.put("old", "US", [])
+    cache.save(s3, "bucket", "key")
+
+    warm = ArtistTracksCache()
+    warm.put("new", "US", [])
+    warm.load(s3, "bucket", "key")
+    assert [artist_id for artist_id, _ in warm._entries] == ["old", "new"]
+
+
+def test_save_and_load_round_trip_uris():
+    s3 = MemoryS3()
+    uris = ["spotify:track:4uLU6hMCjMI75M1A2tKUQC", "spotify:local:artist:album:title:180"]
+    cache = ArtistTracksCache()
+    cache.put("a", "US", uris)
+    cache.save(s3, "bucket", "key")
+    assert s3.objects["key"]["entries"][0][3] == ["4uLU6hMCjMI75M1A2tKUQC", uris[1]]
+
+    loaded = ArtistTracksCache()
+    loaded.load(s3, "bucket", "key")
+    assert loaded.get("a", "US") == uris
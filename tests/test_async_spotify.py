@@ -0,0 +1,114 @@
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web
+from spotipy.exceptions import SpotifyException
+
+from async_spotify import AsyncSpotify, BlockingSpotify, EventLoopThread
+from playlist_manager import PlaylistManager
+from request_scheduler import RequestScheduler, ScheduledSpotify
+from spotify_top_artists_tracks import SpotifyTopArtistsTracks
+
+
+class FakeSpotifyServer:
+    """
+    Local Web API with a paginated playlist listing and artists that answer
+    429 a given number of times before their top tracks.
+    """
+    def __init__(self, playlist_count=5):
+        self.playlist_count = playlist_count
+        self.throttled = {}
+        self.retry_after = "0"
+        self.requests = []
+        self.app = web.Application()
+        self.app.router.add_get("/v1/me/playlists", self.playlists)
+        self.app.router.add_get("/v1/artists/{artist_id}/top-tracks", self.top_tracks)
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.base_url = f"http://127.0.0.1:{port}/v1/"
+
+    async def playlists(self, request):
+        self.requests.append(str(request.rel_url))
+        limit, offset = int(request.query["limit"]), int(request.query.get("offset", 0))
+        items = [{"uri": f"spotify:playlist:p{index}", "name": f"p{index}"} for index in range(offset, min(offset + limit, self.playlist_count))]
+        following = offset + limit
+        next_url = f"{self.base_url}me/playlists?limit={limit}&offset={following}" if following < self.playlist_count else None
+        return web.json_response({"items": items, "next": next_url, "total": self.playlist_count})
+
+    async def top_tracks(self, request):
+        artist_id = request.match_info["artist_id"]
+        self.requests.append(str(request.rel_url))
+        if self.throttled.get(artist_id, 0) > 0:
+            self.throttled[artist_id] -= 1
+            return web.json_response({"error": {"status": 429, "message": "API rate limit exceeded"}}, status=429, headers={"Retry-After": self.retry_after})
+        return web.json_response({"tracks": [{"uri": f"spotify:track:{artist_id}-{number}"} for number in range(3)]})
+
+
+@pytest.fixture(scope="module")
+def loop_thread():
+    loop_thread = EventLoopThread()
+    yield loop_thread
+    loop_thread.close()
+
+
+@pytest.fixture
+def server(loop_thread):
+    server = FakeSpotifyServer()
+    loop_thread.run(server.start())
+    yield server
+    loop_thread.run(server.runner.cleanup())
+
+
+def make_client(loop_thread, server, max_retries=0):
+    return BlockingSpotify(AsyncSpotify("token", loop_thread.session, base_url=server.base_url, max_retries=max_retries), loop_thread)
+
+
+def test_follows_every_page_of_the_playlist_listing(loop_thread, server, monkeypatch):
+    monkeypatch.setattr("playlist_manager.PLAYLIST_LIST_LIMIT", 2)
+
+    playlists = PlaylistManager().get_my_playlists(make_client(loop_thread, server))
+
+    assert [playlist["name"] for playlist in playlists["items"]] == [f"p{index}" for index in range(5)]
+    assert len(server.requests) == 3
+
+
+def test_client_retries_after_retry_after(loop_thread, server):
+    server.throttled["a1"] = 1
+
+    result = make_client(loop_thread, server, max_retries=1).artist_top_tracks("a1")
+
+    assert len(result["tracks"]) == 3
+    assert len(server.requests) == 2
+
+
+def test_scheduler_retries_gathered_calls(loop_thread, server):
+    server.throttled["a2"] = 2
+    scheduler = RequestScheduler(rate=1000, burst=10, max_retries=2)
+    sp = ScheduledSpotify(make_client(loop_thread, server), scheduler)
+
+    artists_tracks = SpotifyTopArtistsTracks(PlaylistManager()).get_artists_tracks(sp, ["a1", "a2", "a3", "a1"])
+
+    assert artists_tracks == {artist_id: [f"spotify:track:{artist_id}-{number}" for number in range(3)] for artist_id in ("a1", "a2", "a3")}
+    assert scheduler.stats()["throttles"] == 2
+    assert scheduler.stats()["retries"] == 2
+    assert scheduler.stats()["calls"] == 5
+    assert sp.calls == 3
+
+
+def test_long_retry_after_is_raised(loop_thread, server):
+    server.throttled["a1"] = 1
+    server.retry_after = "3600"
+    sp = ScheduledSpotify(make_client(loop_thread, server), RequestScheduler(rate=1000, burst=10))
+
+    with pytest.raises(SpotifyException) as error:
+        sp.gather([("artist_top_tracks", ("a1",), {}), ("artist_top_tracks", ("a2",), {})], 2)
+
+    assert error.value.http_status == 429
+    assert error.value.headers["Retry-After"] == "3600"
+    # The other call still finished before the error was raised.
+    assert "/v1/artists/a2/top-tracks?market=US" in server.requests
@@ -0,0 +1,138 @@
+import io
+import json
+
+import fan_out
+import playlist_state_store
+from fan_out import InProcessDispatcher, LambdaDispatcher, MODE_COORDINATOR, partition_users, state_shard_count
+from lambda_function import lambda_handler
+from settings import BUCKET_NAME, PLAYLIST_INFO_SHARD_PREFIX, STATE_SHARD_COUNT
+from users_store import UsersStore
+
+
+class RecordingDispatcher(InProcessDispatcher):
+    def __init__(self, handler):
+        super().__init__(handler)
+        self.events = []
+
+    def dispatch(self, events, wait=False):
+        self.events.extend(events)
+        self.waited = wait
+        return super().dispatch(events, wait)
+
+
+def use_sharded_state(monkeypatch, components, shard_count):
+    monkeypatch.setattr(playlist_state_store, "STATE_LAYOUT", "sharded")
+    monkeypatch.setattr(fan_out, "STATE_LAYOUT", "sharded")
+    json_manager = components["json_manager"]
+    # An existing layout whose shard count differs from STATE_SHARD_COUNT, as after migrate_state --shard-count.
+    components["s3_manager"].save_info(BUCKET_NAME, json_manager.manifest_key(PLAYLIST_INFO_SHARD_PREFIX), json_manager.make_manifest([], shard_count))
+
+
+def test_partition_uses_manifest_shard_count(monkeypatch, fake_components):
+    components = fake_components(200, owner_count=3)
+    use_sharded_state(monkeypatch, components, 8)
+    json_manager = components["json_manager"]
+    assert STATE_SHARD_COUNT != 8
+    assert state_shard_count(components["s3_manager"], json_manager) == 8
+
+    users_data = UsersStore(components["s3_manager"], json_manager).load()
+    events = partition_users(users_data, json_manager, 3, state_shard_count(components["s3_manager"], json_manager))
+
+    worker_users = [set(event["user_ids"]) for event in events]
+    worker_buckets = [{json_manager.shard_of(user_id, 8) for user_id in users} for users in worker_users]
+    for index, buckets in enumerate(worker_buckets):
+        for other in worker_buckets[index + 1:]:
+            assert not buckets & other
+    assert sum(len(users) for users in worker_users) == len(set().union(*worker_users)) == 200
+
+
+def test_coordinator_gives_workers_disjoint_users(monkeypatch, fake_components):
+    components = fake_components(120, owner_count=4)
+    use_sharded_state(monkeypatch, components, 8)
+    dispatcher = RecordingDispatcher(lambda_handler)
+
+    response = lambda_handler({"mode": MODE_COORDINATOR, "shards": 3}, None, dispatcher=dispatcher)
+
+    assert response["statusCode"] == 200
+    body = json.loads(response["body"])
+    assert not dispatcher.waited
+    assert [result["statusCode"] for result in body["results"]] == [200] * len(dispatcher.events)
+    assert body["failed"] == 0
+    worker_users = [set(event["user_ids"]) for event in dispatcher.events]
+    assert len(worker_users) == 3
+    for index, users in enumerate(worker_users):
+        for other in worker_users[index + 1:]:
+            assert not users & other
+    assert len(set().union(*worker_users)) == 120
+
+    # No two workers wrote the same state shard, and every user was stored.
+    assert components["fake_s3"].stats()["conflicts"] == 0
+    json_manager = components["json_manager"]
+    manifest = components["s3_manager"].load_info(BUCKET_NAME, json_manager.manifest_key(PLAYLIST_INFO_SHARD_PREFIX))
+    assert manifest["shard_count"] == 8
+    stored = {}
+    for shard_id in manifest["shards"]:
+        stored.update(components["s3_manager"].load_info(BUCKET_NAME, json_manager.shard_key(PLAYLIST_INFO_SHARD_PREFIX, shard_id)))
+    assert set(stored) == set().union(*worker_users)
+
+
+def test_plan_coordinator_returns_the_workers_plans(monkeypatch, fake_components):
+    components = fake_components(30, owner_count=2)
+    use_sharded_state(monkeypatch, components, 8)
+    components["fake_s3"].reset_stats()
+    dispatcher = RecordingDispatcher(lambda_handler)
+
+    body = json.loads(lambda_handler({"mode": MODE_COORDINATOR, "shards": 3, "plan": True}, None, dispatcher=dispatcher)["body"])
+
+    assert dispatcher.waited
+    assert all(event["plan"] for event in dispatcher.events)
+    assert body["message"] == "Planned"
+    assert body["failed"] == 0
+    assert set(body["plan"]["users"]) == {f"user{index:06d}" for index in range(30)}
+    assert body["plan"]["totals"]["users"] == 30
+    assert components["fake_s3"].stats()["puts"] == 0
+
+
+class StubLambdaClient:
+    def __init__(self, responses):
+        self.responses = responses
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        event = json.loads(Payload)
+        self.invocations.append((FunctionName, InvocationType, event))
+        return self.responses(event, InvocationType)
+
+
+def test_lambda_dispatcher_fires_and_forgets(monkeypatch):
+    import boto3
+
+    client = StubLambdaClient(lambda event, invocation_type: {"StatusCode": 202})
+    created = []
+    monkeypatch.setattr(boto3, "client", lambda service, **kwargs: created.append((service, kwargs)) or client)
+    events = [{"mode": "worker", "user_ids": ["a"]}, {"mode": "worker", "user_ids": ["b"]}]
+
+    results = LambdaDispatcher("spotify").dispatch(events)
+
+    assert created[0][0] == "lambda"
+    assert created[0][1]["config"].retries == {"max_attempts": 0}
+
+    assert results == [{"statusCode": 202}, {"statusCode": 202}]
+    assert sorted(client.invocations, key=lambda invocation: invocation[2]["user_ids"]) == [("spotify", "Event", event) for event in events]
+
+
+def test_lambda_dispatcher_waits_for_the_workers_responses():
+    def responses(event, invocation_type):
+        if event["user_ids"] == ["b"]:
+            return {"StatusCode": 200, "FunctionError": "Unhandled", "Payload": io.BytesIO(b'{"errorMessage": "Task timed out"}')}
+        payload = {"statusCode": 200, "body": json.dumps({"message": "Planned"})}
+        return {"StatusCode": 200, "Payload": io.BytesIO(json.dumps(payload).encode())}
+    client = StubLambdaClient(responses)
+    events = [{"mode": "worker", "user_ids": ["a"]}, {"mode": "worker", "user_ids": ["b"]}]
+
+    results = LambdaDispatcher("spotify", client=client).dispatch(events, wait=True)
+
+    assert {invocation[1] for invocation in client.invocations} == {"RequestResponse"}
+    assert results[0] == {"statusCode": 200, "body": json.dumps({"message": "Planned"})}
+    assert results[1]["statusCode"] == 500
+    assert json.loads(results[1]["body"]) == {"error": "Task timed out"}
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from fake_backend import FakeS3Client
+from json_stream import iter_object_items
+from s3_manager import S3Manager
+
+DOCUMENT = {
+    "version": 2.5,
+    "owners": {
+        "owner0": {"users": [{"id": "user1"}, {"id": "ü-€-😀"}]},
+        "owner1": {"users": []},
+        "owner2": {"limit": 10.25, "nested": {"a": [1, -2, 3e3, True, None]}},
+    },
+    "trailer": ["x", {"y": "}"}],
+}
+
+
+def chunked(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("indent", [None, 4])
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 10_000])
+def test_items_survive_any_chunk_split(indent, size):
+    body = json.dumps(DOCUMENT, ensure_ascii=False, indent=indent).encode("utf-8")
+
+    assert list(iter_object_items(chunked(body, size), "owners")) == list(DOCUMENT["owners"].items())
+
+
+def test_number_split_across_chunks_is_read_whole():
+    assert list(iter_object_items([b'{"owners": {"a": 0', b'.5', b'}}'], "owners")) == [("a", 0.5)]
+
+
+@pytest.mark.parametrize("body", [b'{}', b'{"other": 1}', b'{"owners": {}}'])
+def test_missing_or_empty_field_yields_nothing(body):
+    assert list(iter_object_items(chunked(body, 1), "owners")) == []
+
+
+@pytest.mark.parametrize("body", [b'[]', b'{"owners": [1, 2]}', b'{"owners": {"a": 1'])
+def test_malformed_document_is_rejected(body):
+    with pytest.raises(ValueError):
+        list(iter_object_items([body], "owners"))
+
+
+def test_first_items_come_before_the_download_ends():
+    body = json.dumps({"owners": {f"owner{index}": {"users": []} for index in range(100)}}).encode("utf-8")
+    chunks = chunked(body, 16)
+    read = []
+
+    def download():
+        for chunk in chunks:
+            read.append(chunk)
+            yield chunk
+
+    items = iter_object_items(download(), "owners")
+    assert next(items) == ("owner0", {"users": []})
+    assert len(read) < len(chunks) // 10
+
+
+@pytest.mark.parametrize("codec", ["json", "gzip"])
+def test_s3_manager_streams_stored_files(codec):
+    s3_manager = S3Manager(client=FakeS3Client())
+    s3_manager.save_info("bucket", "users.json", DOCUMENT, codec=codec)
+
+    assert list(s3_manager.iter_items("bucket", "users.json", "owners", chunk_size=5)) == list(DOCUMENT["owners"].items())
+    assert list(s3_manager.iter_items("bucket", "missing.json", "owners")) == []
@@ -0,0 +1,53 @@
+from fake_backend import FakeS3Client
+from json_manager import JsonManager
+from migrate_state import migrate
+from playlist_state_store import ShardedPlaylistStateStore
+from s3_manager import S3Manager
+from settings import PLAYLIST_INFO_FILE_KEY, USERS_FILE_KEY
+from users_store import UsersStore
+
+
+def monolithic_state(s3_manager, json_manager, owner_count=3, user_count=40):
+    owners = {f"owner{owner}": {"users": []} for owner in range(owner_count)}
+    playlist_info = {}
+    for index in range(user_count):
+        user_id = f"user{index:06d}"
+        owners[f"owner{index % owner_count}"]["users"].append({"id": user_id})
+        playlist_info.update(json_manager.make_new_user({}, user_id))
+        playlist_info[user_id]["current_user_top_tracks_uris"]["short_term"] = f"spotify:playlist:{index}"
+    s3_manager.save_info("bucket", USERS_FILE_KEY, {"owners": owners})
+    s3_manager.save_info("bucket", PLAYLIST_INFO_FILE_KEY, playlist_info)
+    return owners, playlist_info
+
+
+def test_sharded_layout_reads_back_the_monolithic_state():
+    s3_manager, json_manager = S3Manager(client=FakeS3Client()), JsonManager()
+    owners, playlist_info = monolithic_state(s3_manager, json_manager)
+
+    result = migrate(s3_manager, json_manager, "bucket", shard_count=8)
+
+    assert result["owners"] == 3
+    assert result["users"] == 40
+    users_store = UsersStore(s3_manager, json_manager, bucket="bucket", layout="sharded")
+    assert users_store.load() == {"owners": owners}
+    assert users_store.load(["owner1"]) == {"owners": {"owner1": owners["owner1"]}}
+
+    state_store = ShardedPlaylistStateStore(s3_manager, json_manager, bucket="bucket", shard_count=64)
+    state_store.load()
+    # The manifest's shard count wins, so every user is found in its bucket.
+    assert state_store.shard_count == 8
+    state_store.preload(playlist_info)
+    assert {user_id: state_store.get(user_id) for user_id in playlist_info} == playlist_info
+
+
+def test_dry_run_writes_nothing():
+    client = FakeS3Client()
+    s3_manager, json_manager = S3Manager(client=client), JsonManager()
+    monolithic_state(s3_manager, json_manager)
+    client.reset_stats()
+
+    result = migrate(s3_manager, json_manager, "bucket", shard_count=8, dry_run=True)
+
+    assert result["dry_run"]
+    assert result["objects"] > 2
+    assert client.stats()["puts"] == 0
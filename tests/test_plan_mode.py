@@ -0,0 +1,82 @@
+import json
+import time
+
+import pytest
+
+from lambda_function import lambda_handler
+
+
+class FakeOAuth:
+    def __init__(self, rotated=()):
+        self.rotated = set(rotated)
+
+    def refresh_access_token(self, refresh_token):
+        user_id = refresh_token.split("-", 1)[1]
+        return {
+            "access_token": f"token-{user_id}",
+            "refresh_token": f"refresh-{user_id}-new" if user_id in self.rotated else refresh_token,
+            "token_type": "Bearer",
+            "expires_at": int(time.time()) + 3600,
+        }
+
+
+def expire_tokens(components, monkeypatch, oauth):
+    token_manager = components["spotify_main"].token_manager
+    # Every stored token (valid for a year) looks expired two years from now.
+    monkeypatch.setattr(token_manager, "clock", lambda: time.time() + 2 * 365 * 24 * 3600)
+    monkeypatch.setattr(token_manager, "get_oauth", lambda owner_id, credentials: oauth)
+    return token_manager
+
+
+@pytest.mark.parametrize("token_backend", ["per_user", "vault"])
+def test_plan_mode_writes_nothing_to_s3(fake_components, monkeypatch, token_backend):
+    monkeypatch.setattr("runtime.TOKEN_BACKEND", token_backend)
+    components = fake_components(6, owner_count=2)
+    token_manager = expire_tokens(components, monkeypatch, FakeOAuth())
+    components["fake_s3"].reset_stats()
+
+    response = lambda_handler({"plan": True}, None)
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 200
+    assert body["plan"]["totals"]["users"] == 6
+    assert body["plan"]["totals"]["tokens_saved"] == 0
+    assert token_manager.refreshed == 6
+    assert components["fake_s3"].stats()["puts"] == 0
+
+
+def test_plan_mode_does_not_flush_tokens_adopted_into_the_vault(fake_components):
+    from settings import TOKEN_VAULT_PREFIX
+    from token_vault import TokenVault
+
+    def vault_keys():
+        return [key for key in components["fake_s3"]._objects if key.startswith(TOKEN_VAULT_PREFIX)]
+
+    # The users' tokens are per-user caches; a vault adopts them on first read.
+    components = fake_components(6, owner_count=2)
+    token_manager = components["spotify_main"].token_manager
+    token_manager.token_vault = TokenVault(components["s3_manager"], components["json_manager"])
+    components["fake_s3"].reset_stats()
+
+    body = json.loads(lambda_handler({"plan": True}, None)["body"])
+
+    assert body["plan"]["totals"]["users"] == 6
+    assert components["fake_s3"].stats()["puts"] == 0
+    assert vault_keys() == []
+
+    # A normal run does write the adopted tokens.
+    lambda_handler({}, None)
+    assert vault_keys()
+
+
+def test_plan_mode_saves_only_replaced_refresh_tokens(fake_components, monkeypatch):
+    components = fake_components(6, owner_count=2)
+    token_manager = expire_tokens(components, monkeypatch, FakeOAuth(rotated={"user000002"}))
+    components["fake_s3"].reset_stats()
+
+    body = json.loads(lambda_handler({"plan": True}, None)["body"])
+
+    assert body["plan"]["totals"]["tokens_saved"] == 1
+    assert [user_id for user_id, user_plan in body["plan"]["users"].items() if user_plan["token_saved"]] == ["user000002"]
+    assert components["fake_s3"].stats()["puts"] == 1
+    assert token_manager.load_tokens(["user000002"])["user000002"]["refresh_token"] == "refresh-user000002-new"
@@ -0,0 +1,284 @@
+import random
+
+import pytest
+
+from playlist_manager import PLAYLIST_WRITE_LIMIT, PlaylistManager
+
+
+class ListPlaylist:
+    """
+    A playlist as a plain list, changed by the write methods apply_sync sends.
+    """
+    def __init__(self, track_uris):
+        self.tracks = list(track_uris)
+        self.requests = 0
+
+    def playlist_replace_items(self, playlist_id, items):
+        assert len(items) <= PLAYLIST_WRITE_LIMIT
+        self.tracks = list(items)
+        return self._written()
+
+    def playlist_add_items(self, playlist_id, items, position=None):
+        assert len(items) <= PLAYLIST_WRITE_LIMIT
+        if position is None:
+            self.tracks.extend(items)
+        else:
+            self.tracks[position:position] = items
+        return self._written()
+
+    def playlist_remove_all_occurrences_of_items(self, playlist_id, items):
+        assert len(items) <= PLAYLIST_WRITE_LIMIT
+        removed = set(items)
+        self.tracks = [uri for uri in self.tracks if uri not in removed]
+        return self._written()
+
+    def playlist_reorder_items(self, playlist_id, range_start, insert_before, range_length=1):
+        moved = self.tracks[range_start:range_start + range_length]
+        del self.tracks[range_start:range_start + range_length]
+        if insert_before > range_start:
+            insert_before -= range_length
+        self.tracks[insert_before:insert_before] = moved
+        return self._written()
+
+    def _written(self):
+        self.requests += 1
+        return {"snapshot_id": f"snapshot-{self.requests}"}
+
+
+def tracks(*numbers):
+    return [f"spotify:track:{number}" for number in numbers]
+
+
+def sync(prev_track_uris, track_uris):
+    manager = PlaylistManager()
+    strategy, ops = manager.plan_sync(prev_track_uris, track_uris)
+    playlist = ListPlaylist(prev_track_uris)
+    stats = manager.apply_sync(playlist, "spotify:playlist:p", strategy, ops)
+    assert playlist.tracks == track_uris
+    assert stats.api_calls == playlist.requests == len(ops)
+    return strategy, ops
+
+
+def test_identical_lists_need_no_request():
+    assert sync(tracks(*range(150)), tracks(*range(150))) == ("none", [])
+
+
+def test_pure_append_is_one_add():
+    strategy, ops = sync(tracks(*range(150)), tracks(*range(160)))
+    assert strategy == "incremental"
+    assert ops == [("add", tracks(*range(150, 160)), 150)]
+
+
+def test_pure_removal_is_one_remove():
+    strategy, ops = sync(tracks(*range(150)), tracks(*range(0, 150, 2)))
+    assert strategy == "incremental"
+    assert ops == [("remove", tracks(*range(1, 150, 2)))]
+
+
+def test_moved_track_is_one_reorder():
+    strategy, ops = sync(tracks(*range(150)), tracks(0, 120, *range(1, 120), *range(121, 150)))
+    assert strategy == "incremental"
+    assert ops == [("reorder", 120, 1, 1)]
+
+
+def test_moved_run_is_one_reorder():
+    strategy, ops = sync(tracks(*range(150)), tracks(*range(100, 110), *range(100), *range(110, 150)))
+    assert strategy == "incremental"
+    assert ops == [("reorder", 100, 0, 10)]
+
+
+def test_duplicate_uris_are_replaced():
+    strategy, ops = sync(tracks(*range(150), 3), tracks(*range(1, 151)))
+    assert strategy == "replace"
+    assert len(ops) == 2
+
+
+def test_long_list_with_few_changes_stays_incremental():
+    prev_track_uris = tracks(*range(250))
+    track_uris = [uri for uri in prev_track_uris if uri not in tracks(10, 20, 30)] + tracks(1000, 1001)
+    strategy, ops = sync(prev_track_uris, track_uris)
+    assert strategy == "incremental"
+    # The full replace of 249 tracks would take 3 requests.
+    assert [op[0] for op in ops] == ["remove", "add"]
+
+
+def test_new_list_falls_back_to_replace():
+    strategy, ops = sync(tracks(*range(250)), tracks(*range(1000, 1250)))
+    assert strategy == "replace"
+    assert [op[0] for op in ops] == ["replace", "add", "add"]
+    assert [len(op[1]) for op in ops] == [100, 100, 50]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_edits_reach_the_target_within_the_replace_cost(seed):
+    generator = random.Random(seed)
+    prev_track_uris = tracks(*generator.sample(range(400), generator.randint(0, 250)))
+    track_uris = list(prev_track_uris)
+    for _ in range(generator.randint(1, 6)):
+        edit = generator.choice(("remove", "add", "move"))
+        if edit == "remove" and track_uris:
+            del track_uris[generator.randrange(len(track_uris))]
+        elif edit == "add":
+            new_uri = tracks(1000 + generator.randrange(1000))[0]
+            if new_uri not in track_uris:
+                track_uris.insert(generator.randint(0, len(track_uris)), new_uri)
+        elif track_uris:
+            track_uris.insert(generator.randint(0, len(track_uris) - 1), track_uris.pop(generator.randrange(len(track_uris))))
+
+    strategy, ops = sync(prev_track_uris, track_uris)
+    replace_requests = max(1, -(-len(track_uris) // PLAYLIST_WRITE_LIMIT))
+    assert len(ops) <= replace_requests
+
+
+class PagedPlaylist:
+    """
+    A playlist read in pages of 100 items, counting the pages requested.
+    """
+    def __init__(self, track_uris):
+        self.tracks = list(track_uris)
+        self.pages = 0
+
+    def playlist_items(self, playlist_id, fields=None, limit=100, offset=0):
+        self.pages += 1
+        items = [{"track": {"uri": uri}} for uri in self.tracks[offset:offset + limit]]
+        following = offset + limit
+        return {"items": items, "next": following if following < len(self.tracks) else None, "offset": offset, "limit": limit}
+
+    def next(self, page):
+        return self.playlist_items(None, limit=page["limit"], offset=page["next"])
+
+
+def test_short_list_is_read_up_to_the_first_difference():
+    playlist = PagedPlaylist(tracks(*range(350)))
+    track_uris = tracks(*range(50))
+
+    read = PlaylistManager().read_content(playlist, "spotify:playlist:p", track_uris)
+
+    assert read != track_uris
+    assert playlist.pages == 1
+    assert PlaylistManager().plan_update(track_uris, prev_track_uris=read) == ("replace", [("replace", track_uris)])
+
+
+def test_long_list_is_read_completely():
+    playlist = PagedPlaylist(tracks(*range(350)))
+
+    read = PlaylistManager().read_content(playlist, "spotify:playlist:p", tracks(*range(1, 351)))
+
+    assert read == tracks(*range(350))
+    assert playlist.pages == 4
+
+
+class Untouched:
+    """
+    A client that fails on any request.
+    """
+    def __getattr__(self, name):
+        raise AssertionError(f"unexpected request: {name}")
+
+
+def recorded_state(track_uris, snapshot_id="snapshot-1"):
+    manager = PlaylistManager()
+    data = manager.record_playlist_state({"u": {}}, "spotify:playlist:p", snapshot_id, track_uris, "u")
+    return manager.get_playlist_state(data, "spotify:playlist:p", "u")
+
+
+def test_tracks_hash_depends_on_the_order():
+    manager = PlaylistManager()
+    assert manager.tracks_hash(tracks(1, 2)) == manager.tracks_hash(tracks(1, 2))
+    assert manager.tracks_hash(tracks(1, 2)) != manager.tracks_hash(tracks(2, 1))
+
+
+def test_unknown_snapshot_forgets_the_state():
+    manager = PlaylistManager()
+    data = manager.record_playlist_state({"u": {}}, "spotify:playlist:p", "snapshot-1", tracks(1), "u")
+    manager.record_playlist_state(data, "spotify:playlist:p", None, tracks(2), "u")
+    assert manager.get_playlist_state(data, "spotify:playlist:p", "u") is None
+
+
+@pytest.mark.parametrize("snapshot_id, track_uris, expected", [
+    ("snapshot-1", tracks(*range(150)), False),  # unchanged
+    ("snapshot-1", tracks(*range(50)), False),   # fits into one replace
+    ("snapshot-1", tracks(*range(151)), True),   # edited, long
+    ("snapshot-2", tracks(*range(150)), True),   # changed by someone else
+    (None, tracks(*range(150)), True),
+])
+def test_needs_read_only_without_a_known_content(snapshot_id, track_uris, expected):
+    state = recorded_state(tracks(*range(150)))
+    assert PlaylistManager().needs_read(track_uris, snapshot_id, state) is expected
+
+
+def test_known_empty_playlist_is_filled_without_reading():
+    state = recorded_state([])
+    track_uris = tracks(*range(150))
+    manager = PlaylistManager()
+
+    assert not manager.needs_read(track_uris, "snapshot-1", state)
+    assert manager.plan_update(track_uris, "snapshot-1", state) == ("incremental", [("add", track_uris[:100], 0), ("add", track_uris[100:], 100)])
+
+
+def test_unchanged_snapshot_and_hash_skip_the_playlist():
+    state = recorded_state(tracks(*range(150)))
+
+    stats = PlaylistManager().update_tracks(Untouched(), "spotify:playlist:p", tracks(*range(150)), "snapshot-1", state)
+
+    assert stats.api_calls == 0
+    assert stats.snapshot_id == "snapshot-1"
+
+
+def test_changed_snapshot_reads_the_playlist_again():
+    state = recorded_state(tracks(*range(150)))
+    playlist = PagedPlaylist(tracks(*range(150)))
+
+    strategy, ops = PlaylistManager().plan_update(
+        tracks(*range(150)), "snapshot-2", state,
+        prev_track_uris=PlaylistManager().read_content(playlist, "spotify:playlist:p", tracks(*range(150)))
+    )
+
+    assert playlist.pages == 2
+    assert (strategy, ops) == ("none", [])
+
+
+class PlaylistListing:
+    """
+    A user's playlists listed in pages, with playlist creation.
+    """
+    def __init__(self, count, page_size=2):
+        self.playlists = [{"uri": f"spotify:playlist:{index}", "name": f"p{index}"} for index in range(count)]
+        self.page_size = page_size
+        self.pages = 0
+
+    def current_user_playlists(self, limit=50, offset=0):
+        self.pages += 1
+        following = offset + self.page_size
+        return {"items": self.playlists[offset:following], "next": following if following < len(self.playlists) else None}
+
+    def next(self, page):
+        return self.current_user_playlists(offset=page["next"])
+
+    def user_playlist_create(self, user, name, public=True, collaborative=False, description=""):
+        playlist = {"uri": f"spotify:playlist:{user}-{name}", "name": name}
+        self.playlists.append(playlist)
+        return playlist
+
+    def me(self):
+        raise AssertionError("the user ID is known")
+
+
+def test_playlist_index_holds_every_page():
+    sp = PlaylistListing(5)
+
+    index = PlaylistManager().build_playlist_index(sp)
+
+    assert list(index) == [f"spotify:playlist:{number}" for number in range(5)]
+    assert sp.pages == 3
+
+
+def test_new_playlist_joins_the_index_without_me():
+    sp = PlaylistListing(1)
+    manager = PlaylistManager()
+    index = manager.build_playlist_index(sp)
+
+    playlist = manager.make_playlist(sp, "short_term top tracks", playlist_index=index, user_id="u")
+
+    assert index[playlist["uri"]] is playlist
+    assert len(index) == 2
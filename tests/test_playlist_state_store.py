@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+from fake_backend import FakeS3Client
+from json_manager import JsonManager
+from playlist_state_store import PlaylistStateStore, ShardedPlaylistStateStore
+from s3_manager import S3Manager
+
+
+class BlockingS3Client(FakeS3Client):
+    """
+    FakeS3Client whose writes wait until they are released.
+    """
+    def __init__(self):
+        super().__init__()
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def put_object(self, **kwargs):
+        self.writing.set()
+        assert self.release.wait(5)
+        return super().put_object(**kwargs)
+
+
+def make_store(layout, client, checkpoint_interval=0):
+    s3_manager = S3Manager(client=client)
+    if layout == "sharded":
+        store = ShardedPlaylistStateStore(s3_manager, JsonManager(), bucket="bucket", shard_count=4, checkpoint_interval=checkpoint_interval)
+    else:
+        store = PlaylistStateStore(s3_manager, JsonManager(), bucket="bucket", key="playlist_info.json", checkpoint_interval=checkpoint_interval)
+    store.load()
+    return store
+
+
+def change(store, user_id, value):
+    working = store.checkout(user_id)
+    working[user_id]["marker"] = value
+    return store.commit(user_id, working)
+
+
+@pytest.mark.parametrize("layout", ["single", "sharded"])
+def test_commits_go_on_while_a_flush_is_writing(layout):
+    client = BlockingS3Client()
+    store = make_store(layout, client)
+    change(store, "user1", 1)
+
+    flusher = threading.Thread(target=store.flush)
+    flusher.start()
+    assert client.writing.wait(5)
+
+    # The flush is waiting for S3; other users still commit.
+    committer = threading.Thread(target=change, args=(store, "user2", 2))
+    committer.start()
+    committer.join(1)
+    assert not committer.is_alive()
+    assert store.dirty_users == {"user2"}
+
+    client.release.set()
+    flusher.join(5)
+    assert store.writes == 1
+    assert store.get("user2")["marker"] == 2
+    assert store.dirty_users == {"user2"}
+
+    assert store.flush()
+    reloaded = make_store(layout, client)
+    reloaded.preload(["user1", "user2"])
+    assert reloaded.get("user1")["marker"] == 1
+    assert reloaded.get("user2")["marker"] == 2
+
+
+def test_checkpoint_is_skipped_while_another_flush_is_writing():
+    client = BlockingS3Client()
+    store = make_store("single", client, checkpoint_interval=1)
+
+    committer = threading.Thread(target=change, args=(store, "user1", 1))
+    committer.start()
+    assert client.writing.wait(5)
+
+    # user1's checkpoint is writing; user2's checkpoint does not wait for it.
+    assert change(store, "user2", 2)
+    assert store.dirty_users == {"user2"}
+
+    client.release.set()
+    committer.join(5)
+    assert store.writes == 1
+    assert store.flush()
+    assert store.writes == 2
@@ -0,0 +1,91 @@
+from json_manager import JsonManager
+from refresh_schedule import KIND_TOP_ARTISTS_TRACKS, KIND_TOP_TRACKS, TERMS, RefreshSchedule
+
+DAY = 24 * 3600
+INTERVALS = {"short_term": DAY, "medium_term": 7 * DAY, "long_term": 30 * DAY}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000
+
+    def __call__(self):
+        return self.now
+
+
+def make_schedule(adaptive=True, max_factor=4, slack=0):
+    clock = FakeClock()
+    return RefreshSchedule(intervals=INTERVALS, adaptive=adaptive, max_factor=max_factor, slack=slack, clock=clock), clock
+
+
+def user_entry():
+    entry = JsonManager().make_new_user({}, "u")["u"]
+    for kind in (KIND_TOP_TRACKS, KIND_TOP_ARTISTS_TRACKS):
+        entry[kind] = {term: f"spotify:playlist:{kind}-{term}" for term in TERMS}
+    return entry
+
+
+def refresh_all(schedule, entry, changed):
+    for term in TERMS:
+        schedule.record(entry, KIND_TOP_TRACKS, term, changed)
+
+
+def test_new_users_and_playlists_are_always_due():
+    schedule, _ = make_schedule()
+    assert schedule.due_terms(None, KIND_TOP_TRACKS) == TERMS
+    assert schedule.due_terms(JsonManager().make_new_user({}, "u")["u"], KIND_TOP_TRACKS) == TERMS
+
+    entry = user_entry()
+    refresh_all(schedule, entry, changed=True)
+    entry[KIND_TOP_TRACKS]["long_term"] = ""
+    assert schedule.due_terms(entry, KIND_TOP_TRACKS) == ["long_term"]
+
+
+def test_each_term_follows_its_own_interval():
+    schedule, clock = make_schedule()
+    entry = user_entry()
+    refresh_all(schedule, entry, changed=True)
+
+    assert schedule.due_terms(entry, KIND_TOP_TRACKS) == []
+    clock.now += DAY
+    assert schedule.due_terms(entry, KIND_TOP_TRACKS) == ["short_term"]
+    clock.now += 6 * DAY
+    assert schedule.due_terms(entry, KIND_TOP_TRACKS) == ["short_term", "medium_term"]
+    assert schedule.has_due_work(entry)
+
+
+def test_unchanged_playlists_wait_longer_up_to_the_cap():
+    schedule, clock = make_schedule(max_factor=4)
+    entry = user_entry()
+    waits = []
+    for _ in range(4):
+        schedule.record(entry, KIND_TOP_TRACKS, "short_term", changed=False)
+        start = clock.now
+        while "short_term" not in schedule.due_terms(entry, KIND_TOP_TRACKS):
+            clock.now += 3600
+        waits.append((clock.now - start) // DAY)
+
+    assert waits == [2, 4, 4, 4]
+
+    # A change brings the configured interval back.
+    schedule.record(entry, KIND_TOP_TRACKS, "short_term", changed=True)
+    clock.now += DAY
+    assert "short_term" in schedule.due_terms(entry, KIND_TOP_TRACKS)
+
+
+def test_fixed_schedule_ignores_unchanged_runs():
+    schedule, clock = make_schedule(adaptive=False)
+    entry = user_entry()
+    for _ in range(3):
+        schedule.record(entry, KIND_TOP_TRACKS, "short_term", changed=False)
+    clock.now += DAY
+    assert "short_term" in schedule.due_terms(entry, KIND_TOP_TRACKS)
+
+
+def test_slack_lets_an_early_run_count():
+    schedule, clock = make_schedule(slack=600)
+    entry = user_entry()
+    refresh_all(schedule, entry, changed=True)
+
+    clock.now += DAY - 300
+    assert schedule.due_terms(entry, KIND_TOP_TRACKS) == ["short_term"]
@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+from spotipy.exceptions import SpotifyException
+
+from request_scheduler import PRIORITY_READ, PRIORITY_WRITE, RequestScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class ClockCondition(threading.Condition):
+    """
+    A condition whose waits pass on the fake clock instead of sleeping.
+    Only for a single thread.
+    """
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+        self.waits = []
+
+    def wait(self, timeout=None):
+        assert timeout is not None, "a single thread would wait forever"
+        self.waits.append(timeout)
+        self.clock.now += timeout
+        return True
+
+
+def make_scheduler(**options):
+    clock = FakeClock()
+    scheduler = RequestScheduler(clock=clock, **options)
+    scheduler._condition = ClockCondition(clock)
+    return scheduler, clock
+
+
+def throttled(retry_after="2"):
+    return SpotifyException(429, -1, "API rate limit exceeded", headers={"Retry-After": retry_after})
+
+
+def test_bucket_allows_a_burst_then_the_rate():
+    # A rate of 4 keeps the fake clock's steps exact in binary.
+    scheduler, clock = make_scheduler(rate=4, burst=3)
+
+    for _ in range(3):
+        scheduler.acquire()
+    assert clock.now == 100.0
+
+    scheduler.acquire()
+    scheduler.acquire()
+    assert clock.now == 100.5
+
+
+def test_retry_after_pauses_the_owner_and_retries():
+    scheduler, clock = make_scheduler(rate=1000, burst=10, max_retries=1)
+    answers = [throttled("2"), "ok"]
+
+    def request():
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    assert scheduler.call(request) == "ok"
+    assert clock.now >= 102.0
+    assert scheduler.stats()["calls"] == 2
+    assert scheduler.stats()["throttles"] == 1
+    assert scheduler.stats()["retries"] == 1
+
+
+@pytest.mark.parametrize("options, retry_after", [
+    ({"max_retries": 0}, "2"),
+    ({"max_retries": 3, "max_retry_after": 10}, "60"),
+])
+def test_429_is_raised_without_retry(options, retry_after):
+    scheduler, clock = make_scheduler(**options)
+
+    def request():
+        raise throttled(retry_after)
+
+    with pytest.raises(SpotifyException):
+        scheduler.call(request)
+    assert scheduler.stats()["calls"] == 1
+    assert scheduler.stats()["throttles"] == 0
+
+
+def test_missing_or_bad_retry_after_means_one_second():
+    scheduler = RequestScheduler()
+    assert scheduler.retry_after(SpotifyException(429, -1, "", headers={})) == 1.0
+    assert scheduler.retry_after(SpotifyException(429, -1, "", headers={"Retry-After": "soon"})) == 1.0
+
+
+def test_reads_are_served_before_waiting_writes():
+    scheduler = RequestScheduler(rate=1000, burst=10)
+    scheduler.throttle(0.2)
+    order = []
+
+    def send(kind, priority):
+        scheduler.call(order.append, kind, priority=priority)
+
+    writer = threading.Thread(target=send, args=("write", PRIORITY_WRITE))
+    writer.start()
+    while len(scheduler._waiting) < 1:
+        time.sleep(0.001)
+    reader = threading.Thread(target=send, args=("read", PRIORITY_READ))
+    reader.start()
+    while len(scheduler._waiting) < 2:
+        time.sleep(0.001)
+
+    writer.join(5)
+    reader.join(5)
+    assert order == ["read", "write"]
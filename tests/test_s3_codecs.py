@@ -0,0 +1,56 @@
+import pytest
+
+import s3_codecs
+from fake_backend import FakeS3Client
+from s3_codecs import CODECS, decode_body, decode_chunks, get_codec
+from s3_manager import S3Manager
+
+DATA = {"owners": {"owner0": {"users": [{"id": "user000001"}, {"id": "é ü"}]}}, "count": 3, "empty": None}
+OPTIONAL = {"orjson": "orjson", "msgpack": "msgpack"}
+
+
+@pytest.fixture(params=sorted(CODECS))
+def codec(request):
+    if request.param in OPTIONAL:
+        pytest.importorskip(OPTIONAL[request.param])
+    return get_codec(request.param)
+
+
+def test_codec_round_trips(codec):
+    body = codec.encode(DATA)
+
+    assert codec.decode(body) == DATA
+    # Readers only know the object's metadata, not the codec.
+    assert decode_body(body, codec.content_type, codec.content_encoding) == DATA
+
+
+def test_codec_output_is_stable(codec):
+    assert codec.encode(DATA) == codec.encode(dict(DATA))
+
+
+def test_s3_manager_round_trips_every_codec(codec):
+    s3_manager = S3Manager(client=FakeS3Client())
+
+    s3_manager.save_info("bucket", "state.json", DATA, codec=codec.name)
+
+    assert s3_manager.load_info("bucket", "state.json") == DATA
+
+
+def test_key_suffix_selects_the_codec():
+    assert get_codec(key="tokens/00.json.gz").name == "gzip"
+    assert get_codec(key="tokens/00.msgpack").name == "msgpack"
+    assert get_codec("compact", key="tokens/00.json.gz").name == "compact"
+    with pytest.raises(ValueError):
+        get_codec("yaml")
+
+
+def test_gzip_is_detected_without_metadata():
+    body = get_codec("gzip").encode(DATA)
+    assert decode_body(body) == DATA
+    assert b"".join(decode_chunks([body[:1], body[1:5], body[5:]])) == get_codec("compact").encode(DATA)
+
+
+def test_missing_optional_package_is_reported(monkeypatch):
+    monkeypatch.setitem(s3_codecs._optional_modules, "msgpack", None)
+    with pytest.raises(ImportError):
+        get_codec("msgpack").encode(DATA)
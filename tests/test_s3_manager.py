@@ -0,0 +1,106 @@
+import pytest
+
+from fake_backend import FakeS3Client
+from s3_manager import S3Manager
+from spotify_error import ConflictError
+
+
+class RacingS3Client(FakeS3Client):
+    """
+    FakeS3Client where another writer changes the object right before each
+    of the next `races` conditional writes, so those writes fail with 412.
+    """
+    def __init__(self):
+        super().__init__()
+        self.races = 0
+        self.conditions = []
+
+    def put_object(self, Key, Body, **kwargs):
+        conditional = "IfMatch" in kwargs or "IfNoneMatch" in kwargs
+        if conditional:
+            self.conditions.append(kwargs.get("IfMatch") or kwargs.get("IfNoneMatch"))
+        if conditional and self.races > 0:
+            self.races -= 1
+            super().put_object(Bucket=kwargs["Bucket"], Key=Key, Body=b'{"other": %d}' % self.races)
+        return super().put_object(Key=Key, Body=Body, **kwargs)
+
+
+def add_mine(seen):
+    def update(data):
+        seen.append(dict(data or {}))
+        data = data or {}
+        data["mine"] = 1
+        return data
+    return update
+
+
+def test_unchanged_object_is_written_once_with_if_match():
+    client = RacingS3Client()
+    s3_manager = S3Manager(client=client)
+    etag = s3_manager.save_info("bucket", "state.json", {"a": 1})
+    seen = []
+
+    assert s3_manager.update_info("bucket", "state.json", add_mine(seen)) == {"a": 1, "mine": 1}
+    assert client.conditions == [etag]
+    assert seen == [{"a": 1}]
+
+
+def test_conflict_rereads_and_applies_the_update_again():
+    client = RacingS3Client()
+    s3_manager = S3Manager(client=client)
+    s3_manager.save_info("bucket", "state.json", {"a": 1})
+    client.races = 1
+    seen = []
+
+    stored = s3_manager.update_info("bucket", "state.json", add_mine(seen))
+
+    assert seen == [{"a": 1}, {"other": 0}]
+    assert stored == {"other": 0, "mine": 1}
+    assert s3_manager.load_info("bucket", "state.json") == stored
+    assert client.stats()["conflicts"] == 1
+
+
+def test_new_object_is_created_only_once():
+    client = RacingS3Client()
+    s3_manager = S3Manager(client=client)
+    client.races = 1
+    seen = []
+
+    assert s3_manager.update_info("bucket", "new.json", add_mine(seen)) == {"other": 0, "mine": 1}
+    assert client.conditions[0] == "*"
+    assert seen == [{}, {"other": 0}]
+
+
+def test_known_version_skips_the_first_read():
+    client = RacingS3Client()
+    s3_manager = S3Manager(client=client)
+    s3_manager.save_info("bucket", "state.json", {"a": 1})
+    data, etag = s3_manager.load_versioned("bucket", "state.json")
+    client.reset_stats()
+
+    s3_manager.update_info("bucket", "state.json", add_mine([]), data=data, etag=etag)
+
+    assert client.stats()["gets"] == 0
+    assert client.stats()["puts"] == 1
+
+
+def test_no_update_writes_nothing():
+    client = RacingS3Client()
+    s3_manager = S3Manager(client=client)
+    s3_manager.save_info("bucket", "state.json", {"a": 1})
+    client.reset_stats()
+
+    assert s3_manager.update_info("bucket", "state.json", lambda data: None) == {"a": 1}
+    assert client.stats()["puts"] == 0
+
+
+def test_conflict_is_raised_after_the_retries():
+    client = RacingS3Client()
+    s3_manager = S3Manager(client=client)
+    s3_manager.save_info("bucket", "state.json", {"a": 1})
+    client.races = 10
+    seen = []
+
+    with pytest.raises(ConflictError):
+        s3_manager.update_info("bucket", "state.json", add_mine(seen), max_retries=2)
+    assert len(seen) == 3
@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+import spotify_main
+from settings import BUCKET_NAME, PLAYLIST_INFO_FILE_KEY
+
+
+def stored_users(components):
+    return set(components["s3_manager"].load_info(BUCKET_NAME, PLAYLIST_INFO_FILE_KEY) or {})
+
+
+def test_failing_user_does_not_stop_the_others(fake_components):
+    components = fake_components(12, owner_count=3)
+    main = components["spotify_main"]
+    make_client = main.spotify_factory
+
+    def spotify_factory(owner_id, token_info):
+        if token_info["access_token"] == "token-user000005":
+            raise RuntimeError("broken client")
+        return make_client(owner_id, token_info)
+    main.spotify_factory = spotify_factory
+
+    # The first unexpected error is raised once every user has been processed.
+    with pytest.raises(RuntimeError, match="broken client"):
+        main.run()
+
+    assert stored_users(components) == {f"user{index:06d}" for index in range(12)} - {"user000005"}
+    assert all(len(playlists) == 6 for user_id, playlists in components["fake_spotify"]._playlists.items())
+
+
+def test_owners_stay_within_their_concurrency_limit(monkeypatch, fake_components):
+    monkeypatch.setattr(spotify_main, "MAX_WORKERS", 8)
+    monkeypatch.setattr(spotify_main, "MAX_WORKERS_PER_OWNER", 2)
+    components = fake_components(24, owner_count=3, latency=0.002)
+    main = components["spotify_main"]
+    process_user = main.process_user
+    lock = threading.Lock()
+    active = {"all": 0}
+    peak = {"all": 0}
+
+    def tracked(owner_id, *args, **kwargs):
+        with lock:
+            for key in (owner_id, "all"):
+                active[key] = active.get(key, 0) + 1
+                peak[key] = max(peak.get(key, 0), active[key])
+        try:
+            time.sleep(0.005)
+            return process_user(owner_id, *args, **kwargs)
+        finally:
+            with lock:
+                active[owner_id] -= 1
+                active["all"] -= 1
+    main.process_user = tracked
+
+    main.run()
+
+    assert len(stored_users(components)) == 24
+    total = peak.pop("all")
+    assert set(peak) == {"owner0", "owner1", "owner2"}
+    assert max(peak.values()) == 2
+    # The pool still runs more users than one owner's limit at once.
+    assert total > 2
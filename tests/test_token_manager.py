@@ -0,0 +1,86 @@
+import time
+
+from spotipy.exceptions import SpotifyOauthError
+
+from fake_backend import FakeS3Client
+from s3_manager import S3Manager
+from spotify_error import InvalidGrantError
+from token_manager import TokenManager
+
+NOW = 1_000_000
+CREDENTIALS = ("client-id", "client-secret", "http://127.0.0.1/callback")
+
+
+class FakeOAuth:
+    def __init__(self, rejected=()):
+        self.rejected = set(rejected)
+        self.refreshed = []
+
+    def refresh_access_token(self, refresh_token):
+        self.refreshed.append(refresh_token)
+        if refresh_token in self.rejected:
+            raise SpotifyOauthError("invalid_grant", error="invalid_grant")
+        return {"access_token": f"new-{refresh_token}", "refresh_token": refresh_token, "expires_at": NOW + 3600}
+
+
+def make_manager(client, oauth):
+    token_manager = TokenManager(S3Manager(client=client), bucket="bucket", expiry_margin=60, clock=lambda: NOW)
+    token_manager.oauth_owners = []
+
+    def get_oauth(owner_id, credentials):
+        token_manager.oauth_owners.append(owner_id)
+        return oauth
+    token_manager.get_oauth = get_oauth
+    return token_manager
+
+
+def token(refresh_token, expires_at):
+    return {"access_token": f"old-{refresh_token}", "refresh_token": refresh_token, "expires_at": expires_at}
+
+
+def test_only_expired_tokens_are_refreshed_and_saved():
+    client, oauth = FakeS3Client(), FakeOAuth()
+    token_manager = make_manager(client, oauth)
+    token_manager.save_token("valid", token("r-valid", NOW + 3600))
+    token_manager.save_token("expiring", token("r-expiring", NOW + 30))
+    client.reset_stats()
+
+    tokens = token_manager.prepare([("owner", CREDENTIALS, user_id) for user_id in ("valid", "expiring", "missing")])
+
+    assert tokens["valid"]["access_token"] == "old-r-valid"
+    assert tokens["expiring"]["access_token"] == "new-r-expiring"
+    assert tokens["missing"] is None
+    assert oauth.refreshed == ["r-expiring"]
+    assert token_manager.refreshed == 1
+    assert client.stats()["gets"] == 3
+    assert client.stats()["puts"] == 1
+    assert token_manager.load_tokens(["expiring"])["expiring"]["expires_at"] == NOW + 3600
+
+
+def test_rejected_refresh_token_only_fails_its_user():
+    oauth = FakeOAuth(rejected={"r-bad"})
+    token_manager = make_manager(FakeS3Client(), oauth)
+    token_manager.save_token("bad", token("r-bad", 0))
+    token_manager.save_token("good", token("r-good", 0))
+
+    tokens = token_manager.prepare([("owner1", CREDENTIALS, "bad"), ("owner2", CREDENTIALS, "good")])
+
+    assert isinstance(tokens["bad"], InvalidGrantError)
+    assert tokens["good"]["access_token"] == "new-r-good"
+    assert sorted(token_manager.oauth_owners) == ["owner1", "owner2"]
+
+
+def test_oauth_client_is_created_once_per_owner(monkeypatch):
+    created = []
+
+    class RecordingOAuth:
+        def __init__(self, **kwargs):
+            created.append(kwargs["client_id"])
+
+    monkeypatch.setattr("spotipy.oauth2.SpotifyOAuth", RecordingOAuth)
+    token_manager = TokenManager(S3Manager(client=FakeS3Client()), clock=time.time)
+
+    first = token_manager.get_oauth("owner", CREDENTIALS)
+    assert token_manager.get_oauth("owner", CREDENTIALS) is first
+    token_manager.get_oauth("other", CREDENTIALS)
+    assert created == ["client-id", "client-id"]
@@ -0,0 +1,64 @@
+from fake_backend import FakeS3Client
+from json_manager import JsonManager
+from s3_manager import S3Manager
+from token_vault import TokenVault
+
+
+def token(access_token):
+    return {"access_token": access_token, "refresh_token": "refresh", "expires_at": 0}
+
+
+def make_vault(client, shard_count=4):
+    return TokenVault(S3Manager(client=client), JsonManager(), bucket="bucket", prefix="tokens/", shard_count=shard_count)
+
+
+def test_only_changed_tokens_are_written():
+    client = FakeS3Client()
+    vault = make_vault(client)
+    vault.put("user1", token("a"))
+    vault.put("user2", token("b"))
+    assert vault.flush() == len({vault._shard_id("user1"), vault._shard_id("user2")})
+
+    vault.reset()
+    client.reset_stats()
+    vault.put("user1", token("a"))
+    assert vault.flush() == 0
+    assert client.stats()["puts"] == 0
+
+    vault.put("user1", token("c"))
+    assert vault.flush() == 1
+    assert vault.flush() == 0
+    assert make_vault(client).get("user1") == token("c")
+
+
+def test_concurrent_runs_merge_their_tokens():
+    client = FakeS3Client()
+    first, second = make_vault(client, shard_count=1), make_vault(client, shard_count=1)
+    first.put("user0", token("old"))
+    first.flush()
+
+    # Both runs read the shard, then change different users.
+    first.reset()
+    assert first.get("user0") == token("old")
+    assert second.get("user0") == token("old")
+    first.put("user1", token("first"))
+    second.put("user2", token("second"))
+    first.flush()
+    client.reset_stats()
+    second.flush()
+
+    assert client.stats()["conflicts"] == 1
+    stored = make_vault(client, shard_count=1)
+    assert [stored.get(user_id)["access_token"] for user_id in ("user0", "user1", "user2")] == ["old", "first", "second"]
+
+
+def test_per_user_caches_are_adopted():
+    client = FakeS3Client()
+    s3_manager = S3Manager(client=client)
+    s3_manager.save_info("bucket", ".cache-legacy", token("legacy"))
+    vault = make_vault(client)
+
+    assert vault.get("legacy") == token("legacy")
+    assert vault.get("unknown") is None
+    assert vault.flush() == 1
+    assert s3_manager.load_info("bucket", vault.json_manager.shard_key("tokens/", vault._shard_id("legacy")))["legacy"] == token("legacy")
@@ -0,0 +1,62 @@
+import pytest
+
+from fake_backend import FakeS3Client
+from json_manager import JsonManager
+from s3_manager import S3Manager
+from users_store import UsersStore
+
+
+class RacingS3Client(FakeS3Client):
+    """
+    FakeS3Client where another writer runs right before the first
+    conditional write, so that write fails with 412.
+    """
+    def __init__(self):
+        super().__init__()
+        self.other_writer = None
+
+    def put_object(self, **kwargs):
+        other_writer = None
+        if "IfMatch" in kwargs or "IfNoneMatch" in kwargs:
+            with self._lock:
+                other_writer, self.other_writer = self.other_writer, None
+        if other_writer is not None:
+            other_writer()
+        return super().put_object(**kwargs)
+
+
+def user_ids(data):
+    return {owner_id: [user["id"] for user in owner_info["users"]] for owner_id, owner_info in data["owners"].items()}
+
+
+@pytest.fixture(params=["monolithic", "sharded"])
+def stores(request):
+    client = RacingS3Client()
+    s3_manager = S3Manager(client=client)
+    make_store = lambda: UsersStore(s3_manager, JsonManager(), bucket="bucket", layout=request.param)
+    make_store().save({"owners": {"owner0": {"users": [{"id": "a"}]}, "owner1": {"users": [{"id": "b"}]}}})
+    return client, make_store
+
+
+def test_register_adds_and_moves_users(stores):
+    _, make_store = stores
+    users_store = make_store()
+
+    assert users_store.register({"owner0": ["c"], "owner1": ["a"]}) == 2
+    assert user_ids(users_store.load()) == {"owner0": ["c"], "owner1": ["b", "a"]}
+
+    # Registering the same users again changes nothing.
+    assert users_store.register({"owner0": ["c"], "owner1": ["a"]}) == 0
+
+
+def test_register_merges_a_concurrent_registration(stores):
+    client, make_store = stores
+    client.other_writer = lambda: make_store().register({"owner1": ["other"]})
+    client.reset_stats()
+
+    assert make_store().register({"owner1": ["mine"], "owner2": ["new"]}) == 2
+
+    assert client.stats()["conflicts"] == 1
+    # Sharded owners are written concurrently, so either write may be the one retried.
+    stored = {owner_id: sorted(users) for owner_id, users in user_ids(make_store().load()).items()}
+    assert stored == {"owner0": ["a"], "owner1": ["b", "mine", "other"], "owner2": ["new"]}
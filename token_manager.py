@@ -0,0 +1,217 @@
+from __future__ import annotations
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from settings import BUCKET_NAME, SCOPE, TOKEN_EXPIRY_MARGIN_SECONDS, TOKEN_REFRESH_WORKERS
+from spotify_error import InvalidGrantError
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from spotipy.oauth2 import SpotifyOAuth
+    from s3_manager import S3Manager
+    from token_vault import TokenVault
+
+logger = logging.getLogger(__name__)
+
+class TokenManager:
+    """
+    Loads and refreshes the OAuth tokens of all users of a run up front.
+
+    All `.cache-{user_id}` objects are read from S3 in one concurrent batch.
+    Tokens that are still valid for at least TOKEN_EXPIRY_MARGIN_SECONDS are
+    used as they are, without asking Spotify. Only expired tokens are
+    refreshed, concurrently, with one SpotifyOAuth client per owner, and the
+    refreshed token is written back to S3.
+
+    With a TokenVault (TOKEN_BACKEND = 'vault'), tokens are read from and
+    written to the vault instead, and the vault is flushed once after the
+    refreshes.
+
+    prepare(jobs, persist=False) (plan mode) keeps refreshed tokens in memory
+    and does not flush the vault. The one write it cannot avoid: when Spotify
+    returns a new refresh token, the stored one may no longer be accepted, so
+    that token is saved anyway (with a vault, together with the other
+    changes of its shards) and the user is listed in unavoidable_saves.
+
+    Attributes:
+        s3_manager (S3Manager): Helper class for S3 read/write operations.
+        bucket (str): S3 bucket holding the token caches.
+        scope (str): Spotify scopes of the tokens.
+        expiry_margin (int): Seconds a token must stay valid to be used without refresh.
+        token_vault (TokenVault | None): Vault backend, or None for per-user objects.
+        refreshed (int): Number of tokens refreshed by this manager.
+        unavoidable_saves (Set[str]): Users whose token was saved by a prepare with
+                                      persist=False in this run.
+    """
+    def __init__(self, s3_manager: S3Manager, bucket: str = BUCKET_NAME, scope: str = SCOPE, expiry_margin: int = TOKEN_EXPIRY_MARGIN_SECONDS, max_workers: int = TOKEN_REFRESH_WORKERS, clock: Callable[[], float] = time.time, token_vault: Optional[TokenVault] = None, session_factory: Optional[Callable[[str], Any]] = None):
+        """
+        Parameters:
+            s3_manager (S3Manager): Helper class for S3 read/write operations.
+            bucket (str): S3 bucket holding the token caches.
+            scope (str): Spotify scopes of the tokens.
+            expiry_margin (int): Seconds a token must stay valid to be used without refresh.
+            max_workers (int): Maximum number of concurrent token refreshes.
+            clock (Callable): Returns the current UNIX time. Replaceable in tests.
+            token_vault (TokenVault | None): Vault backend, or None for per-user objects.
+            session_factory (Callable | None): Returns the requests.Session to use for an owner.
+                                               Each OAuth client gets its own session if None.
+        """
+        self.s3_manager = s3_manager
+        self.token_vault = token_vault
+        self.session_factory = session_factory
+        self.bucket = bucket
+        self.scope = scope
+        self.expiry_margin = expiry_margin
+        self.max_workers = max_workers
+        self.clock = clock
+        self.refreshed = 0
+        self.unavoidable_saves: Set[str] = set()
+        self._oauth: Dict[str, SpotifyOAuth] = {}
+        self._lock = threading.Lock()
+
+    def cache_key(self, user_id: str) -> str:
+        """
+        Return the S3 key of a user's token cache.
+        """
+        return f".cache-{user_id}"
+
+    def reset(self):
+        """
+        Start a new run: forget the vault shards read by the previous one,
+        since spotify_auth.py may have added tokens in the meantime.
+        """
+        self.unavoidable_saves = set()
+        if self.token_vault is not None:
+            self.token_vault.reset()
+
+    def load_tokens(self, user_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Read the token caches of the given users concurrently.
+
+        Returns:
+            dict: Token info keyed by user ID; None for users without a cache.
+        """
+        user_ids = list(user_ids)
+        if self.token_vault is not None:
+            self.token_vault.preload(user_ids)
+            return {user_id: self.token_vault.get(user_id) for user_id in user_ids}
+        loaded = self.s3_manager.load_many(self.bucket, [self.cache_key(user_id) for user_id in user_ids])
+        return {user_id: loaded.get(self.cache_key(user_id)) for user_id in user_ids}
+
+    def save_token(self, user_id: str, token_info: Dict[str, Any]):
+        """
+        Write a user's token cache to S3, or to the vault.
+        """
+        if self.token_vault is not None:
+            self.token_vault.put(user_id, token_info)
+            return
+        self.s3_manager.save_info(self.bucket, self.cache_key(user_id), token_info)
+
+    def is_expired(self, token_info: Dict[str, Any]) -> bool:
+        """
+        Check locally whether a token expires within the margin.
+        """
+        return token_info.get("expires_at", 0) - self.clock() < self.expiry_margin
+
+    def get_oauth(self, owner_id: str, credentials: Tuple[str, str, str]) -> SpotifyOAuth:
+        """
+        Return the owner's SpotifyOAuth client, creating it on first use.
+
+        The client only refreshes tokens; the tokens themselves are kept by
+        this manager, so its cache handler is an in-memory placeholder.
+        Clients are kept for the lifetime of the manager, so a manager that
+        outlives an invocation reuses them. spotipy is only imported when a
+        token actually has to be refreshed.
+        """
+        from spotipy.cache_handler import MemoryCacheHandler
+        from spotipy.oauth2 import SpotifyOAuth
+        with self._lock:
+            oauth = self._oauth.get(owner_id)
+            if oauth is None:
+                client_id, client_secret, redirect_url = credentials
+                oauth = SpotifyOAuth(client_id=client_id,
+                                     client_secret=client_secret,
+                                     redirect_uri=redirect_url,
+                                     scope=self.scope,
+                                     cache_handler=MemoryCacheHandler(),
+                                     open_browser=False,
+                                     requests_session=self.session_factory(owner_id) if self.session_factory else True)
+                self._oauth[owner_id] = oauth
+            return oauth
+
+    def refresh(self, owner_id: str, credentials: Tuple[str, str, str], user_id: str, token_info: Dict[str, Any], persist: bool = True) -> Dict[str, Any]:
+        """
+        Refresh one user's token with its owner's client and save it to S3.
+        With persist=False the token is only saved if Spotify replaced the
+        refresh token.
+
+        Raises:
+            InvalidGrantError: If Spotify rejected the refresh token.
+        """
+        from spotipy.exceptions import SpotifyOauthError
+        oauth = self.get_oauth(owner_id, credentials)
+        try:
+            new_token_info = oauth.refresh_access_token(token_info["refresh_token"])
+        except SpotifyOauthError as e:
+            if getattr(e, "error", None) == "invalid_grant":
+                raise InvalidGrantError(user_id) from e
+            raise
+        # spotipy keeps the old refresh token when Spotify does not send a new one.
+        rotated = new_token_info.get("refresh_token") != token_info.get("refresh_token")
+        if persist or rotated:
+            self.save_token(user_id, new_token_info)
+        with self._lock:
+            self.refreshed += 1
+            if not persist and rotated:
+                self.unavoidable_saves.add(user_id)
+        return new_token_info
+
+    def prepare(self, jobs: List[Tuple[str, Tuple[str, str, str], str]], persist: bool = True) -> Dict[str, Any]:
+        """
+        Load the tokens of all jobs and refresh the expired ones.
+
+        Parameters:
+            jobs (list): (owner_id, credentials, user_id) jobs of the run.
+            persist (bool): Save refreshed tokens and flush the vault (including
+                            tokens adopted into it). With False, only tokens whose
+                            refresh token was replaced are saved; see unavoidable_saves.
+
+        Returns:
+            dict: For every user ID, a valid token info, None if the user has
+                  no token cache, or the exception its refresh raised. Errors
+                  are returned instead of raised so that they only affect
+                  their own user.
+        """
+        tokens: Dict[str, Any] = self.load_tokens(user_id for _, _, user_id in jobs)
+        expired = [
+            (owner_id, credentials, user_id)
+            for owner_id, credentials, user_id in jobs
+            if tokens.get(user_id) is not None and self.is_expired(tokens[user_id])
+        ]
+        if not expired:
+            if persist:
+                self.flush()
+            return tokens
+
+        def refresh_job(job: Tuple[str, Tuple[str, str, str], str]) -> Any:
+            owner_id, credentials, user_id = job
+            try:
+                return self.refresh(owner_id, credentials, user_id, tokens[user_id], persist)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(expired)))) as executor:
+            for (_, _, user_id), result in zip(expired, executor.map(refresh_job, expired)):
+                tokens[user_id] = result
+        failed = sum(1 for _, _, user_id in expired if isinstance(tokens[user_id], Exception))
+        logger.info("Refreshed %d expired token(s), %d failed, of %d user(s).", len(expired) - failed, failed, len(tokens))
+        if persist or any(user_id in self.unavoidable_saves for _, _, user_id in expired):
+            self.flush()
+        return tokens
+
+    def flush(self):
+        """
+        Write changed vault shards. Per-user token caches are written on refresh.
+        """
+        if self.token_vault is not None:
+            self.token_vault.flush()
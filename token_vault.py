@@ -0,0 +1,187 @@
+from __future__ import annotations
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from spotipy.cache_handler import CacheHandler
+from settings import BUCKET_NAME, TOKEN_VAULT_PREFIX, TOKEN_VAULT_SHARDS
+from typing import Any, Dict, Iterable, Optional, Set, TYPE_CHECKING
+if TYPE_CHECKING:
+    from s3_manager import S3Manager
+    from json_manager import JsonManager
+
+logger = logging.getLogger(__name__)
+
+class TokenVault:
+    """
+    Keeps the OAuth tokens of all users in a few S3 objects instead of one
+    `.cache-{user_id}` object per user.
+
+    Users are spread over TOKEN_VAULT_SHARDS objects under TOKEN_VAULT_PREFIX
+    ({user_id: token_info}). A shard is read once per invocation, the first
+    time one of its users is needed, and written back only if a token in it
+    actually changed. The write is conditional on the ETag that was read; if
+    another run changed the shard in the meantime, the changed tokens are
+    put over the current shard and the write is retried.
+
+    Users that are not in the vault yet are read from their per-user
+    `.cache-{user_id}` object and adopted into the vault, so switching
+    TOKEN_BACKEND to 'vault' needs no separate migration.
+
+    Attributes:
+        reads (int): Number of S3 objects read.
+        writes (int): Number of S3 objects written.
+    """
+    def __init__(self, s3_manager: S3Manager, json_manager: JsonManager, bucket: str = BUCKET_NAME, prefix: str = TOKEN_VAULT_PREFIX, shard_count: int = TOKEN_VAULT_SHARDS):
+        """
+        Parameters:
+            s3_manager (S3Manager): Helper class for S3 read/write operations.
+            json_manager (JsonManager): Computes the users' shards and their keys.
+            bucket (str): S3 bucket name.
+            prefix (str): S3 key prefix of the vault shards.
+            shard_count (int): Number of vault shards.
+        """
+        self.s3_manager = s3_manager
+        self.json_manager = json_manager
+        self.bucket = bucket
+        self.prefix = prefix
+        self.shard_count = max(1, shard_count)
+        self.reads = 0
+        self.writes = 0
+        self._shards: Dict[str, Dict[str, Any]] = {}
+        self._dirty: Dict[str, Set[str]] = {}
+        self._lock = threading.RLock()
+
+    def _shard_id(self, user_id: str) -> str:
+        return self.json_manager.shard_of(user_id, self.shard_count)
+
+    def _load_shards(self, shard_ids: Iterable[str]):
+        with self._lock:
+            missing_shards = sorted(set(shard_ids) - set(self._shards))
+        if not missing_shards:
+            return
+        loaded = self.s3_manager.load_many(self.bucket, [self.json_manager.shard_key(self.prefix, shard_id) for shard_id in missing_shards], cache=True)
+        with self._lock:
+            self.reads += len(missing_shards)
+            for shard_id in missing_shards:
+                self._shards.setdefault(shard_id, loaded.get(self.json_manager.shard_key(self.prefix, shard_id)) or {})
+
+    def reset(self):
+        """
+        Forget the loaded shards, so that the next access reads them again.
+        A vault reused by a warm container calls this once per invocation;
+        unchanged shards are then answered from the S3Manager's ETag cache.
+        """
+        with self._lock:
+            if self._dirty:
+                logger.warning("Discarding %d unflushed token vault shard(s).", len(self._dirty))
+            self._shards = {}
+            self._dirty.clear()
+
+    def preload(self, user_ids: Iterable[str]):
+        """
+        Read the shards of the given users concurrently, then adopt users
+        missing from the vault from their per-user token caches.
+        """
+        user_ids = list(user_ids)
+        self._load_shards({self._shard_id(user_id) for user_id in user_ids})
+
+        with self._lock:
+            legacy_ids = [user_id for user_id in user_ids if user_id not in self._shards[self._shard_id(user_id)]]
+        if legacy_ids:
+            loaded = self.s3_manager.load_many(self.bucket, [f".cache-{user_id}" for user_id in legacy_ids])
+            with self._lock:
+                self.reads += len(legacy_ids)
+            for user_id in legacy_ids:
+                token_info = loaded.get(f".cache-{user_id}")
+                if token_info is not None:
+                    self.put(user_id, token_info)
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return a user's token info, or None if the user has no token.
+        """
+        with self._lock:
+            shard = self._shards.get(self._shard_id(user_id))
+            if shard is not None and user_id in shard:
+                return shard[user_id]
+        self.preload([user_id])
+        with self._lock:
+            return self._shards[self._shard_id(user_id)].get(user_id)
+
+    def put(self, user_id: str, token_info: Dict[str, Any]):
+        """
+        Store a user's token info. The shard is only marked dirty when the
+        token differs from the stored one.
+        """
+        shard_id = self._shard_id(user_id)
+        # Load the shard first, so that flushing it keeps the other users' tokens.
+        self._load_shards([shard_id])
+        with self._lock:
+            shard = self._shards[shard_id]
+            if shard.get(user_id) == token_info:
+                return
+            shard[user_id] = dict(token_info)
+            self._dirty.setdefault(shard_id, set()).add(user_id)
+
+    def flush(self) -> int:
+        """
+        Write the shards whose tokens changed.
+
+        Returns:
+            int: Number of shards written.
+        """
+        with self._lock:
+            dirty = {shard_id: (self._shards[shard_id], sorted(user_ids)) for shard_id, user_ids in sorted(self._dirty.items())}
+            self._dirty.clear()
+
+        def write_shard(shard_id: str):
+            local, user_ids = dirty[shard_id]
+            key = self.json_manager.shard_key(self.prefix, shard_id)
+
+            def merge(stored: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+                if stored is local:
+                    return local
+                logger.info("Token vault shard %s was changed by another run; merging %d token(s).", shard_id, len(user_ids))
+                stored = stored or {}
+                stored.update({user_id: local[user_id] for user_id in user_ids})
+                return stored
+
+            stored = self.s3_manager.update_info(self.bucket, key, merge, indent=None, data=local, etag=self.s3_manager.etag(self.bucket, key))
+            with self._lock:
+                self._shards[shard_id] = stored
+
+        if dirty:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.s3_manager.max_workers, len(dirty)))) as executor:
+                list(executor.map(write_shard, dirty))
+            with self._lock:
+                self.writes += len(dirty)
+            logger.info("Saved %d token vault shard(s).", len(dirty))
+        return len(dirty)
+
+class VaultCacheHandler(CacheHandler):
+    """
+    Spotipy cache handler backed by a TokenVault.
+
+    Unlike S3SpotifyCacheHandler it does not touch S3 on every save; the
+    vault writes changed tokens when it is flushed.
+    """
+    def __init__(self, vault: TokenVault, user_id: str):
+        """
+        Parameters:
+            vault (TokenVault): The vault holding the tokens.
+            user_id (str): The user whose token this handler reads and writes.
+        """
+        self.vault = vault
+        self.user_id = user_id
+
+    def get_cached_token(self) -> Optional[Dict[str, Any]]:
+        """
+        Retrieve the user's token from the vault.
+        """
+        return self.vault.get(self.user_id)
+
+    def save_token_to_cache(self, token_info: dict):
+        """
+        Store the user's token in the vault. Call TokenVault.flush to persist it.
+        """
+        self.vault.put(self.user_id, token_info)
@@ -0,0 +1,225 @@
+from __future__ import annotations
+import json
+import threading
+import time
+from contextlib import contextmanager
+from settings import TRACING_ENABLED, TRACING_NAMESPACE, TRACING_TOP_USERS
+from typing import Any, Callable, Dict, Iterator, Optional
+
+# Run instrumentation: wall time of stages (spans), counters and a run report.
+#
+#   with tracer.span("top_tracks", user=user_id, term=term):
+#       ...
+#   tracer.count("s3.bytes_read", len(body))
+#
+# Spans are aggregated by name (and term), and per user for spans inside a
+# span with a user tag. lambda_handler resets the tracer at the start of an
+# invocation and returns tracer.report() in its body, logs it as one JSON
+# line and prints it as CloudWatch Embedded Metric Format (EMF) metrics.
+# With TRACING_ENABLED = False every call returns immediately.
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def cache_stats(hits: int, misses: int) -> Dict[str, Any]:
+    """
+    Return the hits, misses and hit rate (0 to 1, None without lookups) of a cache.
+    """
+    lookups = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": round(hits / lookups, 3) if lookups else None}
+
+class Tracer:
+    """
+    Collects spans and counters of one invocation. Thread-safe.
+
+    Attributes:
+        enabled (bool): Whether anything is recorded.
+    """
+    def __init__(self, enabled: bool = TRACING_ENABLED, clock: Callable[[], float] = time.perf_counter):
+        """
+        Parameters:
+            enabled (bool): Whether anything is recorded.
+            clock (Callable): Returns a monotonic time in seconds. Replaceable in tests.
+        """
+        self.enabled = enabled
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything recorded so far, e.g. at the start of an invocation.
+        """
+        with self._lock:
+            self._started = self.clock()
+            self._spans: Dict[str, Dict[str, float]] = {}
+            self._users: Dict[str, Dict[str, float]] = {}
+            self._counters: Dict[str, float] = {}
+
+    def _tags(self) -> Dict[str, Any]:
+        return getattr(self._local, "tags", {})
+
+    def span(self, name: str, **tags: Any):
+        """
+        Measure the wall time of a block. A 'term' tag is added to the span name;
+        spans inside a span with a 'user' tag are also counted for that user.
+        """
+        if not self.enabled:
+            return _NO_SPAN
+        return self._span(name, tags)
+
+    @contextmanager
+    def _span(self, name: str, tags: Dict[str, Any]) -> Iterator[None]:
+        outer = self._tags()
+        self._local.tags = {**outer, **tags}
+        start = self.clock()
+        try:
+            yield
+        finally:
+            elapsed_ms = (self.clock() - start) * 1000
+            current = self._local.tags
+            self._local.tags = outer
+            self._record(name, elapsed_ms, current, tags)
+
+    def record(self, name: str, elapsed_ms: float, **tags: Any):
+        """
+        Record a span measured elsewhere, e.g. by a coroutine on an event loop
+        thread, as if it had run inside the calling thread's current spans.
+        """
+        if not self.enabled:
+            return
+        self._record(name, elapsed_ms, {**self._tags(), **tags}, tags)
+
+    def _record(self, name: str, elapsed_ms: float, current: Dict[str, Any], tags: Dict[str, Any]):
+        key = f"{name}.{tags['term']}" if "term" in tags else name
+        with self._lock:
+            self._add(self._spans.setdefault(key, {"count": 0, "total_ms": 0.0, "max_ms": 0.0}), elapsed_ms)
+            user = current.get("user")
+            if user is not None:
+                user_spans = self._users.setdefault(user, {})
+                user_spans[key] = user_spans.get(key, 0.0) + elapsed_ms
+                if name.startswith("spotify."):
+                    user_spans["spotify_calls"] = user_spans.get("spotify_calls", 0) + 1
+
+    def _add(self, stats: Dict[str, float], elapsed_ms: float):
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    def count(self, name: str, value: float = 1):
+        """
+        Add value to a counter.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def wrap(self, function: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        Return function running with the caller's tags, for work handed to
+        another thread (e.g. a ThreadPoolExecutor), so its spans still count
+        for the caller's user.
+        """
+        if not self.enabled:
+            return function
+        tags = self._tags()
+
+        def wrapped(*args: Any, **kwargs: Any) -> Any:
+            outer = self._tags()
+            self._local.tags = tags
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.tags = outer
+        return wrapped
+
+    def report(self, extra: Optional[Dict[str, Any]] = None, top_users: int = TRACING_TOP_USERS) -> Dict[str, Any]:
+        """
+        Return the recorded spans and counters.
+
+        Parameters:
+            extra (dict | None): Additional sections, e.g. cache statistics.
+            top_users (int): Number of slowest users whose spans are listed.
+
+        The ETag cache of S3Manager is reported under "caches" as "s3_etag".
+        """
+        with self._lock:
+            spans = {
+                name: {"count": int(stats["count"]), "total_ms": round(stats["total_ms"], 1), "max_ms": round(stats["max_ms"], 1)}
+                for name, stats in sorted(self._spans.items())
+            }
+            users = sorted(self._users.items(), key=lambda item: item[1].get("user", 0.0), reverse=True)
+            report = {
+                "duration_ms": round((self.clock() - self._started) * 1000, 1),
+                "spans": spans,
+                "counters": dict(sorted(self._counters.items())),
+                "users": len(self._users),
+                "slowest_users": {
+                    user: {name: round(value, 1) for name, value in sorted(user_spans.items())}
+                    for user, user_spans in users[:top_users]
+                },
+                "caches": {
+                    "s3_etag": cache_stats(int(self._counters.get("s3.cache_hits", 0)), int(self._counters.get("s3.cache_misses", 0))),
+                },
+            }
+        for name, section in (extra or {}).items():
+            if isinstance(section, dict) and isinstance(report.get(name), dict):
+                report[name].update(section)
+            else:
+                report[name] = section
+        return report
+
+    def emf(self, report: Dict[str, Any], namespace: str = TRACING_NAMESPACE) -> Dict[str, Any]:
+        """
+        Build a CloudWatch Embedded Metric Format record of a report's totals.
+        """
+        spans = report.get("spans", {})
+        counters = report.get("counters", {})
+        caches = report.get("caches", {})
+        metrics = {
+            "RunDuration": (report.get("duration_ms", 0), "Milliseconds"),
+            "UsersProcessed": (report.get("users", 0), "Count"),
+            "SpotifyCalls": (sum(stats["count"] for name, stats in spans.items() if name.startswith("spotify.")), "Count"),
+            "SpotifyTime": (round(sum(stats["total_ms"] for name, stats in spans.items() if name.startswith("spotify.")), 1), "Milliseconds"),
+            "SpotifyThrottles": (counters.get("spotify.throttles", 0), "Count"),
+            "S3BytesRead": (counters.get("s3.bytes_read", 0), "Bytes"),
+            "S3BytesWritten": (counters.get("s3.bytes_written", 0), "Bytes"),
+            "PlaylistsModified": (counters.get("playlists.modified", 0), "Count"),
+        }
+        for name, cache in sorted(caches.items()):
+            if cache.get("hit_rate") is not None:
+                metric = "".join(part.capitalize() for part in name.split("_"))
+                metrics[f"{metric}CacheHitRate"] = (round(cache["hit_rate"] * 100, 1), "Percent")
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": namespace,
+                    "Dimensions": [[]],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()],
+                }],
+            },
+            **{name: value for name, (value, _) in metrics.items()},
+        }
+
+    def emit(self, report: Dict[str, Any]):
+        """
+        Print a report as one structured JSON log line and as EMF metrics.
+        """
+        if not self.enabled:
+            return
+        print(json.dumps({"run_report": report}, ensure_ascii=False))
+        print(json.dumps(self.emf(report)))
+
+'''
+The tracer of this process, shared by all modules.
+'''
+tracer = Tracer()
@@ -0,0 +1,307 @@
+from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date
+from settings import PLAN_WORKERS
+from refresh_schedule import KIND_TOP_ARTISTS_TRACKS, KIND_TOP_TRACKS
+from tracing import tracer
+from typing import Any, Callable, Dict, Iterable, List, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from playlist_manager import PlaylistManager, SyncStats
+    from spotify_top_tracks import SpotifyTopTracks
+    from spotify_top_artists_tracks import SpotifyTopArtistsTracks
+    from spotipy import Spotify
+
+# Per-user planning stage: every read both playlist generators need is sent
+# up front in a few parallel waves, the six target playlists are computed,
+# and the writes are applied in one batched phase.
+#
+#   wave 1: profile (new users), playlist listing, top tracks and top artists of every due term
+#   wave 2: top tracks of the top artists (shared cache first), current content of the
+#           playlists whose stored state does not tell it
+#
+# The top tracks, top artists and artists' tracks are each one batch sent with
+# ScheduledSpotify.gather: coroutines on the shared event loop with the async
+# client, a thread per request with Spotipy. The paginated reads (playlist
+# listing and contents) and the writes are sent from the executor's threads.
+#   writes: missing playlists are created in order, then every playlist's description
+#           and tracks are written concurrently
+#
+# In plan mode (SpotifyMain.run(plan=True)) preview() describes the writes
+# instead of apply() sending them.
+
+class PlaylistTarget:
+    """
+    One playlist of a user as it should be after the run.
+
+    Attributes:
+        kind (str): KIND_TOP_TRACKS or KIND_TOP_ARTISTS_TRACKS.
+        term (str): Spotify time range.
+        name (str): Name used when the playlist has to be created.
+        description (str): Wanted description.
+        playlist (dict | None): The existing playlist object, None if it has to be created.
+        track_uris (List[str]): Track URIs the playlist should contain.
+        state (dict | None): Stored snapshot ID and tracks hash of the playlist.
+        prev_track_uris (List[str] | None): Current content, if it had to be read
+                                            (PlaylistManager.read_content).
+    """
+    def __init__(self, kind: str, term: str, name: str, description: str, playlist: Optional[Dict[str, Any]], state: Optional[Dict[str, str]] = None):
+        self.kind = kind
+        self.term = term
+        self.name = name
+        self.description = description
+        self.playlist = playlist
+        self.track_uris: List[str] = []
+        self.state = state
+        self.prev_track_uris: Optional[List[str]] = None
+
+    def __repr__(self) -> str:
+        return f"PlaylistTarget(kind={self.kind!r}, term={self.term!r}, tracks={len(self.track_uris)}, exists={self.playlist is not None})"
+
+class UserPlan:
+    """
+    Everything read for one user, and the target playlists computed from it.
+
+    Attributes:
+        user_id (str): The user's ID.
+        profile (dict): {"id": ..., "display_name": ...} of the Spotify account.
+        playlist_index (dict): Playlists keyed by URI (PlaylistManager.build_playlist_index).
+        targets (List[PlaylistTarget]): The due playlists, top tracks first, in term order.
+    """
+    def __init__(self, user_id: str, profile: Dict[str, Any], playlist_index: Dict[str, Dict[str, Any]], targets: List[PlaylistTarget]):
+        self.user_id = user_id
+        self.profile = profile
+        self.playlist_index = playlist_index
+        self.targets = targets
+
+class UserPlanner:
+    """
+    Plans and applies the playlists of one user for both generators at once.
+
+    SpotifyTopTracks and SpotifyTopArtistsTracks still provide the reads and
+    the track lists; the planner only changes when the requests are sent.
+    """
+    def __init__(self, spotify_top_tracks: SpotifyTopTracks, spotify_top_artists_tracks: SpotifyTopArtistsTracks, workers: int = PLAN_WORKERS):
+        """
+        Parameters:
+            spotify_top_tracks (SpotifyTopTracks): Reads the users' top tracks.
+            spotify_top_artists_tracks (SpotifyTopArtistsTracks): Reads the top artists and their tracks.
+            workers (int): Requests of one user sent at the same time.
+        """
+        self.spotify_top_tracks = spotify_top_tracks
+        self.spotify_top_artists_tracks = spotify_top_artists_tracks
+        self.playlist_manager: PlaylistManager = spotify_top_tracks.playlist_manager
+        self.workers = workers
+
+    def plan(self, sp: Spotify, user_id: str, playlist_uri_data: Dict[str, Dict], due_terms: Dict[str, Iterable[str]]) -> UserPlan:
+        """
+        Send every read request of the due playlists and compute their targets.
+        Nothing is written to Spotify and playlist_uri_data is not changed.
+
+        Parameters:
+            sp (Spotify): Authenticated Spotipy client.
+            user_id (str): User ID.
+            playlist_uri_data (dict): The user's working copy from PlaylistStateStore.checkout.
+            due_terms (dict): Due terms keyed by kind (RefreshSchedule.due_terms).
+
+        Returns:
+            UserPlan: The read data and the target playlists.
+        """
+        entry = playlist_uri_data[user_id]
+        due_tracks, due_artists = set(due_terms.get(KIND_TOP_TRACKS, ())), set(due_terms.get(KIND_TOP_ARTISTS_TRACKS, ()))
+        track_terms = [term for term in entry[KIND_TOP_TRACKS] if term in due_tracks]
+        artist_terms = [term for term in entry[KIND_TOP_ARTISTS_TRACKS] if term in due_artists]
+        profile = entry.get("profile")
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            def submit(function: Callable[..., Any], *args: Any) -> Future:
+                return executor.submit(tracer.wrap(function), *args)
+
+            with tracer.span("plan.read"):
+                me = submit(sp.me) if not profile else None
+                index = submit(self.playlist_manager.build_playlist_index, sp)
+                top_tracks = submit(self.spotify_top_tracks.get_top_tracks, sp, track_terms)
+                top_artists = submit(self.spotify_top_artists_tracks.get_top_artists, sp, artist_terms)
+                if me is not None:
+                    me = me.result()
+                    profile = {"id": me['id'], "display_name": me['display_name']}
+                playlist_index = index.result()
+                terms_artist_ids = {term: [artist['id'] for artist in result['items']] for term, result in top_artists.result().items()}
+                terms_track_uris = top_tracks.result()
+
+                targets = []
+                for term in track_terms:
+                    target = self._target(KIND_TOP_TRACKS, term, f'{term} top tracks', entry, playlist_index, user_id, playlist_uri_data)
+                    target.track_uris = terms_track_uris[term]
+                    targets.append(target)
+                for term in artist_terms:
+                    targets.append(self._target(KIND_TOP_ARTISTS_TRACKS, term, f'{term} top artists tracks', entry, playlist_index, user_id, playlist_uri_data))
+
+            with tracer.span("plan.contents"):
+                artists_tracks = None
+                if terms_artist_ids:
+                    artists_tracks = submit(
+                        self.spotify_top_artists_tracks.get_artists_tracks,
+                        sp,
+                        [artist_id for artist_ids in terms_artist_ids.values() for artist_id in artist_ids]
+                    )
+
+                def read_content(target: PlaylistTarget):
+                    if target.kind == KIND_TOP_ARTISTS_TRACKS:
+                        target.track_uris = self.spotify_top_artists_tracks.build_playlist_tracks(terms_artist_ids[target.term], artists_tracks.result())
+                    if target.playlist is not None and self.playlist_manager.needs_read(target.track_uris, target.playlist.get('snapshot_id'), target.state):
+                        target.prev_track_uris = self.playlist_manager.read_content(sp, target.playlist['uri'], target.track_uris)
+
+                # The artists' tracks were submitted first, so reads waiting for them never hold every worker.
+                for future in [submit(read_content, target) for target in targets]:
+                    future.result()
+
+        return UserPlan(user_id, profile, playlist_index, targets)
+
+    def _target(self, kind: str, term: str, name: str, entry: Dict[str, Any], playlist_index: Dict[str, Dict[str, Any]], user_id: str, playlist_uri_data: Dict[str, Dict]) -> PlaylistTarget:
+        recorded_playlist_uri = entry[kind][term]
+        playlist = playlist_index.get(recorded_playlist_uri) if recorded_playlist_uri else None
+        state = None
+        if playlist is not None:
+            state = self.playlist_manager.get_playlist_state(playlist_uri_data, playlist['uri'], user_id)
+        return PlaylistTarget(kind, term, name, f'my {term} playlist on {date.today()}', playlist, state)
+
+    def apply(self, sp: Spotify, plan: UserPlan, playlist_uri_data: Dict[str, Dict]) -> Dict[str, Dict[str, SyncStats]]:
+        """
+        Write the planned playlists and record their URIs and states in
+        playlist_uri_data.
+
+        Missing playlists are created one after another, in plan order, so
+        they appear in the user's library in a stable order. The descriptions
+        and tracks of all playlists are then written concurrently.
+
+        Parameters:
+            sp (Spotify): Authenticated Spotipy client.
+            plan (UserPlan): The plan returned by plan().
+            playlist_uri_data (dict): The user's working copy from PlaylistStateStore.checkout.
+
+        Returns:
+            dict: The SyncStats of every refreshed term, keyed by kind and term.
+        """
+        user_id = plan.user_id
+        playlist_uri_data[user_id]["profile"] = plan.profile
+        record_uri = {
+            KIND_TOP_TRACKS: self.playlist_manager.record_cuttu_playlist_uri,
+            KIND_TOP_ARTISTS_TRACKS: self.playlist_manager.record_attu_playlist_uri,
+        }
+        created = set()
+        with tracer.span("plan.create"):
+            for target in plan.targets:
+                if target.playlist is not None:
+                    continue
+                target.playlist = self.playlist_manager.make_playlist(sp, name=target.name, description=target.description, playlist_index=plan.playlist_index, user_id=plan.profile.get('id'))
+                record_uri[target.kind](playlist_uri_data, target.playlist['uri'], target.term, user_id)
+                # A new playlist is empty, so its content is known without reading it.
+                target.state = {"snapshot_id": target.playlist.get('snapshot_id'), "tracks_hash": self.playlist_manager.tracks_hash([])}
+                target.prev_track_uris = []
+                created.add(id(target))
+
+        def write(target: PlaylistTarget) -> Any:
+            with tracer.span("plan.write", term=target.term):
+                details_changed = id(target) not in created and self.playlist_manager.update_description(sp, target.playlist, target.description)
+                stats = self.playlist_manager.update_tracks(sp, target.playlist['uri'], target.track_uris, target.playlist.get('snapshot_id'), target.state, target.prev_track_uris)
+                self.playlist_manager.record_sync_result(sp, playlist_uri_data, target.playlist['uri'], stats, target.track_uris, details_changed, user_id)
+                return details_changed, stats
+
+        # Every write records only its own playlist's entry; creating the dict of
+        # states up front leaves the threads a single item change each.
+        playlist_uri_data[user_id].setdefault("playlist_states", {})
+
+        with tracer.span("plan.writes"):
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(plan.targets)))) as executor:
+                written = list(executor.map(tracer.wrap(write), plan.targets))
+
+        results: Dict[str, Dict[str, SyncStats]] = {}
+        for target, (details_changed, stats) in zip(plan.targets, written):
+            results.setdefault(target.kind, {})[target.term] = stats
+            print(f"====={self._label(target)}=====")
+            print("playlist is made." if id(target) in created else "playlist exists.")
+            if details_changed:
+                print("details are changed.")
+            if stats.modified:
+                print(f"modified ({stats.strategy}, {stats.api_calls} API calls)")
+            else:
+                print("NOT modified.")
+        return results
+
+    def preview(self, plan: UserPlan) -> List[Dict[str, Any]]:
+        """
+        Describe the writes apply() would send for every planned playlist,
+        without sending them (plan mode).
+
+        Parameters:
+            plan (UserPlan): The plan returned by plan().
+
+        Returns:
+            list: One dict per planned playlist with its kind and term, its
+                  URI (None if it would be created), whether it would be
+                  created and its description changed, the sync strategy,
+                  the number of operations of each kind, the number of tracks,
+                  and api_calls, the requests apply() would send (including
+                  the snapshot read after a description-only change).
+        """
+        changes = []
+        for target in plan.targets:
+            create = target.playlist is None
+            if create:
+                details_changed = False
+                strategy, ops = self.playlist_manager.plan_update(target.track_uris, prev_track_uris=[])
+            else:
+                details_changed = target.playlist.get('description') != target.description
+                strategy, ops = self.playlist_manager.plan_update(target.track_uris, target.playlist.get('snapshot_id'), target.state, target.prev_track_uris)
+            operations: Dict[str, int] = {}
+            for op in ops:
+                operations[op[0]] = operations.get(op[0], 0) + 1
+            api_calls = int(create) + int(details_changed) + len(ops) + int(details_changed and not ops)
+            changes.append({
+                "kind": target.kind,
+                "term": target.term,
+                "playlist": None if create else target.playlist['uri'],
+                "create": create,
+                "description": details_changed,
+                "strategy": strategy,
+                "operations": operations,
+                "tracks": len(target.track_uris),
+                "api_calls": api_calls,
+            })
+            print(f"====={self._label(target)}=====")
+            print("playlist would be made." if create else "playlist exists.")
+            if details_changed:
+                print("details would change.")
+            if ops:
+                print(f"would modify ({strategy}, {len(ops)} API calls)")
+            else:
+                print("NOT modified.")
+        return changes
+
+    def _label(self, target: PlaylistTarget) -> str:
+        return f"{'top song' if target.kind == KIND_TOP_TRACKS else 'top artists'} {target.term}"
+
+
+def summarize_plans(plans: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Add up the planned changes returned by SpotifyMain.run(plan=True).
+
+    Returns:
+        dict: Numbers of users, playlists, playlists to create, description
+              changes, reads already sent, write-phase API calls, tokens that
+              had to be saved, and the number of operations of each kind and
+              playlists per strategy.
+    """
+    totals: Dict[str, Any] = {"users": len(plans), "playlists": 0, "create": 0, "description": 0, "reads": 0, "api_calls": 0, "tokens_saved": 0, "operations": {}, "strategies": {}}
+    for user_plan in plans.values():
+        totals["reads"] += user_plan["reads"]
+        totals["tokens_saved"] += int(user_plan.get("token_saved", False))
+        for change in user_plan["playlists"]:
+            totals["playlists"] += 1
+            totals["create"] += int(change["create"])
+            totals["description"] += int(change["description"])
+            totals["api_calls"] += change["api_calls"]
+            totals["strategies"][change["strategy"]] = totals["strategies"].get(change["strategy"], 0) + 1
+            for kind, count in change["operations"].items():
+                totals["operations"][kind] = totals["operations"].get(kind, 0) + count
+    return totals
@@ -0,0 +1,199 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from settings import BUCKET_NAME, STATE_LAYOUT, USERS_FILE_KEY, USERS_SHARD_PREFIX
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from s3_manager import S3Manager
+    from json_manager import JsonManager
+
+class UsersStore:
+    """
+    Reads and writes the users json (owner -> Spotify users) in the
+    configured STATE_LAYOUT.
+
+    'monolithic' keeps everything in USERS_FILE_KEY. 'sharded' keeps every
+    owner's {"users": [...]} as its own object under USERS_SHARD_PREFIX and
+    lists the owners in manifest.json, so a caller that only needs some
+    owners does not read the others.
+    """
+    def __init__(self, s3_manager: S3Manager, json_manager: JsonManager, bucket: str = BUCKET_NAME, layout: str = STATE_LAYOUT):
+        """
+        Parameters:
+            s3_manager (S3Manager): Helper class for S3 read/write operations.
+            json_manager (JsonManager): Names, splits and merges the shards.
+            bucket (str): S3 bucket name.
+            layout (str): 'monolithic' or 'sharded'.
+        """
+        self.s3_manager = s3_manager
+        self.json_manager = json_manager
+        self.bucket = bucket
+        self.layout = layout
+
+    def load(self, owner_ids: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Load the users json, optionally only for some owners.
+
+        Returns:
+            dict | None: {"owners": {...}}, or None if nothing is stored.
+        """
+        if self.layout != 'sharded':
+            data = self.s3_manager.load_info(self.bucket, USERS_FILE_KEY, cache=True)
+            if data and owner_ids is not None:
+                wanted = set(owner_ids)
+                data = {"owners": {k: v for k, v in data.get("owners", {}).items() if k in wanted}}
+            return data
+
+        manifest = self.s3_manager.load_info(self.bucket, self.json_manager.manifest_key(USERS_SHARD_PREFIX), cache=True)
+        if not manifest:
+            return None
+        shard_ids = manifest.get("shards", [])
+        if owner_ids is not None:
+            wanted = set(owner_ids)
+            shard_ids = [owner_id for owner_id in shard_ids if owner_id in wanted]
+        loaded = self.s3_manager.load_many(self.bucket, [self.json_manager.shard_key(USERS_SHARD_PREFIX, owner_id) for owner_id in shard_ids], cache=True)
+        owners = {
+            owner_id: loaded.get(self.json_manager.shard_key(USERS_SHARD_PREFIX, owner_id))
+            for owner_id in shard_ids
+        }
+        return self.json_manager.merge_users_info(owners, shard_ids)
+
+    def iter_owners(self, owner_ids: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Yield (owner_id, {"users": [...]}) one owner at a time, optionally only
+        for some owners, without holding all owners in memory. The monolithic
+        file is streamed while it downloads; sharded owners are read one by one.
+        """
+        wanted = set(owner_ids) if owner_ids is not None else None
+        if self.layout != 'sharded':
+            for owner_id, owner_info in self.s3_manager.iter_items(self.bucket, USERS_FILE_KEY, "owners"):
+                if wanted is None or owner_id in wanted:
+                    yield owner_id, owner_info
+            return
+
+        manifest = self.s3_manager.load_info(self.bucket, self.json_manager.manifest_key(USERS_SHARD_PREFIX), cache=True)
+        for owner_id in (manifest or {}).get("shards", []):
+            if wanted is None or owner_id in wanted:
+                owner_info = self.s3_manager.load_info(self.bucket, self.json_manager.shard_key(USERS_SHARD_PREFIX, owner_id))
+                if owner_info is not None:
+                    yield owner_id, owner_info
+
+    def save(self, data: Dict[str, Any], changed_owner_ids: Optional[Iterable[str]] = None):
+        """
+        Save the users json. In the sharded layout only the owners listed in
+        changed_owner_ids (all owners if None) are written, followed by the
+        manifest.
+        """
+        if self.layout != 'sharded':
+            self.s3_manager.save_info(self.bucket, USERS_FILE_KEY, data)
+            return
+
+        owners = self.json_manager.split_users_info(data)
+        changed = list(owners) if changed_owner_ids is None else [owner_id for owner_id in changed_owner_ids if owner_id in owners]
+        self.s3_manager.save_many(self.bucket, {
+            self.json_manager.shard_key(USERS_SHARD_PREFIX, owner_id): owners[owner_id]
+            for owner_id in changed
+        }, indent=None)
+        self.s3_manager.save_info(
+            self.bucket,
+            self.json_manager.manifest_key(USERS_SHARD_PREFIX),
+            self.json_manager.make_manifest(owners)
+        )
+
+    def plan_registrations(self, data: Optional[Dict[str, Any]], registrations: Dict[str, Iterable[str]]) -> Dict[str, Tuple[List[str], Set[str]]]:
+        """
+        Work out how the users json changes when users are registered.
+
+        A user belongs to one owner: registering it under another owner moves
+        it. The users json is indexed once, so the cost does not grow with
+        the number of registered users times the number of stored users.
+
+        Parameters:
+            data (dict | None): The current users json.
+            registrations (dict): {owner_id: [user_id, ...]}; a user listed under
+                                  several owners ends up under the last one.
+
+        Returns:
+            dict: {owner_id: (user IDs to add, user IDs to remove)} for every owner that changes.
+        """
+        target = {user_id: owner_id for owner_id, user_ids in registrations.items() for user_id in user_ids}
+        index: Dict[str, Set[str]] = {}
+        for owner_id, owner_info in (data or {}).get("owners", {}).items():
+            for user in (owner_info or {}).get("users", []):
+                index.setdefault(user.get("id"), set()).add(owner_id)
+
+        plan: Dict[str, Tuple[List[str], Set[str]]] = {}
+        for user_id, owner_id in target.items():
+            owner_ids = index.get(user_id, set())
+            if owner_id not in owner_ids:
+                plan.setdefault(owner_id, ([], set()))[0].append(user_id)
+            for other_id in owner_ids - {owner_id}:
+                plan.setdefault(other_id, ([], set()))[1].add(user_id)
+        return plan
+
+    def apply_registrations(self, owner_info: Optional[Dict[str, Any]], add: List[str], remove: Set[str]) -> Dict[str, Any]:
+        """
+        Add and remove users in one owner's {"users": [...]}. Users that are
+        already there are not added twice, so applying a change again is harmless.
+        """
+        owner_info = owner_info or {}
+        users = [user for user in owner_info.get("users", []) if user.get("id") not in remove]
+        present = {user.get("id") for user in users}
+        users.extend({"id": user_id} for user_id in add if user_id not in present)
+        owner_info["users"] = users
+        return owner_info
+
+    def register(self, registrations: Dict[str, Iterable[str]]) -> int:
+        """
+        Register many users at once, with optimistic concurrency.
+
+        The monolithic users json is changed with a single conditional PUT
+        (S3Manager.update_info), which is retried on the current file when it
+        was changed concurrently. In the sharded layout every changed owner
+        shard and the manifest are changed that way.
+
+        Parameters:
+            registrations (dict): {owner_id: [user_id, ...]}.
+
+        Returns:
+            int: Number of owners whose user list changed.
+        """
+        registrations = {owner_id: list(user_ids) for owner_id, user_ids in registrations.items()}
+        if self.layout != 'sharded':
+            changed = []
+
+            def update(data: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+                data = data or {}
+                owners = data.setdefault("owners", {})
+                plan = self.plan_registrations(data, registrations)
+                for owner_id, (add, remove) in plan.items():
+                    owners[owner_id] = self.apply_registrations(owners.get(owner_id), add, remove)
+                changed[:] = list(plan)
+                return data if plan else None
+
+            self.s3_manager.update_info(self.bucket, USERS_FILE_KEY, update)
+            return len(changed)
+
+        plan = self.plan_registrations(self.load(), registrations)
+        if not plan:
+            return 0
+
+        def update_owner(owner_id: str):
+            add, remove = plan[owner_id]
+            self.s3_manager.update_info(
+                self.bucket,
+                self.json_manager.shard_key(USERS_SHARD_PREFIX, owner_id),
+                lambda owner_info: self.apply_registrations(owner_info, add, remove),
+                indent=None
+            )
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.s3_manager.max_workers, len(plan)))) as executor:
+            list(executor.map(update_owner, plan))
+
+        def update_manifest(manifest: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            shard_ids = set((manifest or {}).get("shards", []))
+            if shard_ids.issuperset(plan):
+                return None
+            return self.json_manager.make_manifest(shard_ids | set(plan))
+
+        self.s3_manager.update_info(self.bucket, self.json_manager.manifest_key(USERS_SHARD_PREFIX), update_manifest)
+        return len(plan)